@@ -0,0 +1,157 @@
+##----------------------------------------------------------------------------##
+## benchmarks/bench_archive_formats.py                                        ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Compare size and extraction throughput of the same files published in
+every archive format ezdeps supports, to choose the publishing format.
+Formats whose Python module is missing (zstd) are skipped.
+Usage: python benchmarks/bench_archive_formats.py [--size-mb 256]
+                                                  [--jobs 8]
+                                                  [--json results.json]"""
+
+import argparse
+import gzip
+import json
+import lzma
+import os
+import platform
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from eztools.ezdeps import action, archive, xz  # noqa: E402
+
+
+def write_files(folder, size, file_size=4 * 1024 * 1024):
+    """Write |size| bytes of files that compress about 3:1, like binaries of
+    a toolchain, to |folder|/bin."""
+    os.makedirs(os.path.join(folder, "bin"))
+    for i in range((size + file_size - 1) // file_size):
+        data = b"".join(os.urandom(64) + bytes(128)
+                        for _ in range(file_size // 192 + 1))
+        with open(os.path.join(folder, "bin", "file{}".format(i)), "wb") as f:
+            f.write(data[:min(file_size, size - i * file_size)])
+
+
+def compress_stream(src_path, dst_path, open_function):
+    with open(src_path, "rb") as src, open_function(dst_path) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+
+def write_archives(files_folder, folder, jobs):
+    """Write the files in every format.
+    Returns list of (format name, archive path)."""
+    tar_path = os.path.join(folder, "archive.tar")
+    with tarfile.open(tar_path, "w") as tar:
+        tar.add(os.path.join(files_folder, "bin"), arcname="bin")
+    archives = [("tar", tar_path)]
+    path = tar_path + ".gz"
+    compress_stream(tar_path, path, lambda path: gzip.open(path, "wb", 6))
+    archives.append(("tar.gz", path))
+    path = tar_path + ".xz"
+    compress_stream(tar_path, path, lambda path: lzma.open(path, "wb"))
+    archives.append(("tar.xz", path))
+    path = os.path.join(folder, "blocks.tar.xz")
+    xz.compress_file(tar_path, path, block_size=8 * 1024 * 1024, jobs=jobs)
+    archives.append(("tar.xz 8 MiB blocks", path))
+    if archive.get_format_by_name("a.tar.zst").available:
+        path = tar_path + ".zst"
+        if archive.zstd:
+            compress_stream(tar_path, path,
+                            lambda path: archive.zstd.open(path, "wb"))
+        else:
+            with open(tar_path, "rb") as src, open(path, "wb") as dst:
+                archive.zstandard.ZstdCompressor(level=19).copy_stream(
+                    src, dst)
+        archives.append(("tar.zst", path))
+    else:
+        print("Skipping tar.zst, install zstandard to measure it")
+    path = os.path.join(folder, "archive.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip:
+        for file_name in sorted(os.listdir(os.path.join(files_folder,
+                                                        "bin"))):
+            zip.write(os.path.join(files_folder, "bin", file_name),
+                      "bin/" + file_name)
+    archives.append(("zip", path))
+    return archives
+
+
+def measure(function, repeat):
+    """Returns the best wall time of |repeat| runs of |function|."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", default=256, type=int,
+                        help="Size of the files in MiB")
+    parser.add_argument("--jobs", default=None, type=int,
+                        help="Threads used to extract (default to the number"
+                        " of CPUs)")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--json", default="",
+                        help="Also write results to this file")
+    parsed_args = parser.parse_args(args)
+    size = parsed_args.size_mb * 1024 * 1024
+    folder = tempfile.mkdtemp(prefix="ezdeps-bench-")
+    results = []
+    try:
+        files_folder = os.path.join(folder, "files")
+        print("Generating {} MiB of files...".format(parsed_args.size_mb))
+        write_files(files_folder, size)
+        archives = write_archives(files_folder, folder, parsed_args.jobs)
+        extract_path = os.path.join(folder, "out")
+
+        def extract(path):
+            shutil.rmtree(extract_path, ignore_errors=True)
+            if action.extract_archive(path, extract_path,
+                                      jobs=parsed_args.jobs) is None:
+                raise RuntimeError("Cannot extract " + path)
+
+        for name, path in archives:
+            elapsed = measure(lambda: extract(path), parsed_args.repeat)
+            archive_size = os.path.getsize(path)
+            results.append({
+                "format": name,
+                "size": archive_size,
+                "ratio": archive_size / size,
+                "seconds": elapsed,
+                "mib_per_second": size / elapsed / 1024 / 1024
+            })
+            print("{:<20} {:>8.1f} MiB ({:>5.1%}) {:>8.3f} s {:>8.1f} MiB/s"
+                  .format(name, archive_size / 1024 / 1024,
+                          results[-1]["ratio"], elapsed,
+                          results[-1]["mib_per_second"]))
+    finally:
+        shutil.rmtree(folder)
+    if parsed_args.json:
+        content = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": vars(parsed_args),
+            "results": results
+        }
+        with open(parsed_args.json, "w") as f:
+            json.dump(content, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,127 @@
+##----------------------------------------------------------------------------##
+## benchmarks/bench_extract_xz.py                                             ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Measure how extraction time of a multi-block .tar.xz scales with the
+number of decompression threads, compared with a single-block archive.
+Usage: python benchmarks/bench_extract_xz.py [--size-mb 512]
+                                             [--block-size-mb 8]
+                                             [--jobs 1,2,4,8,16,32]
+                                             [--json results.json]"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from eztools.ezdeps import action, xz  # noqa: E402
+
+
+def write_tar(path, size, file_size=4 * 1024 * 1024):
+    """Write a tar of |size| bytes of files that compress about 3:1, like
+    binaries of a toolchain."""
+    with tarfile.open(path, "w") as tar:
+        for i in range((size + file_size - 1) // file_size):
+            data = b"".join(os.urandom(64) + bytes(128)
+                            for _ in range(file_size // 192 + 1))
+            info = tarfile.TarInfo("bin/file{}".format(i))
+            info.size = min(file_size, size - i * file_size)
+            tar.addfile(info, io.BytesIO(data[:info.size]))
+
+
+def measure(function, repeat):
+    """Returns the best wall time of |repeat| runs of |function|."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", default=512, type=int,
+                        help="Uncompressed size of the archive in MiB")
+    parser.add_argument("--block-size-mb", default=8, type=int,
+                        help="Size of xz blocks in MiB")
+    parser.add_argument("--jobs", default="",
+                        help="Comma separated numbers of threads (default"
+                        " to powers of 2 up to the number of CPUs)")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--json", default="",
+                        help="Also write results to this file")
+    parsed_args = parser.parse_args(args)
+    if parsed_args.jobs:
+        jobs_list = [int(jobs) for jobs in parsed_args.jobs.split(",")]
+    else:
+        cpu_count = os.cpu_count() or 1
+        jobs_list = [2 ** i for i in range(cpu_count.bit_length())]
+        if jobs_list[-1] != cpu_count:
+            jobs_list.append(cpu_count)
+    size = parsed_args.size_mb * 1024 * 1024
+    folder = tempfile.mkdtemp(prefix="ezdeps-bench-")
+    results = []
+    try:
+        tar_path = os.path.join(folder, "archive.tar")
+        print("Generating a {} MiB archive...".format(parsed_args.size_mb))
+        write_tar(tar_path, size)
+        single_path = os.path.join(folder, "single.tar.xz")
+        xz.compress_file(tar_path, single_path, block_size=size + 1)
+        multi_path = os.path.join(folder, "multi.tar.xz")
+        xz.compress_file(tar_path, multi_path,
+                         block_size=parsed_args.block_size_mb * 1024 * 1024)
+        os.remove(tar_path)
+        extract_path = os.path.join(folder, "out")
+
+        def extract(path, jobs):
+            shutil.rmtree(extract_path, ignore_errors=True)
+            if action.extract_archive(path, extract_path, jobs=jobs) is None:
+                raise RuntimeError("Cannot extract " + path)
+
+        def report(name, jobs, elapsed, baseline):
+            results.append({"name": name, "jobs": jobs, "seconds": elapsed,
+                            "mib_per_second": size / elapsed / 1024 / 1024,
+                            "speedup": baseline / elapsed})
+            print("{:<24} {:>3} jobs {:>8.3f} s {:>8.1f} MiB/s  x{:.2f}"
+                  .format(name, jobs, elapsed, results[-1]["mib_per_second"],
+                          results[-1]["speedup"]))
+
+        baseline = measure(lambda: extract(single_path, 1),
+                           parsed_args.repeat)
+        report("single block", 1, baseline, baseline)
+        for jobs in jobs_list:
+            report("{} MiB blocks".format(parsed_args.block_size_mb), jobs,
+                   measure(lambda: extract(multi_path, jobs),
+                           parsed_args.repeat), baseline)
+    finally:
+        shutil.rmtree(folder)
+    if parsed_args.json:
+        content = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": vars(parsed_args),
+            "results": results
+        }
+        with open(parsed_args.json, "w") as f:
+            json.dump(content, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,108 @@
+##----------------------------------------------------------------------------##
+## benchmarks/bench_hashing.py                                                ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Compare hashing throughput of the old 4 KiB chunked sha1 loop with
+eztools.ezdeps.hashing for every supported algorithm, on one file and on
+many files in parallel.
+Usage: python benchmarks/bench_hashing.py [--size-mb 256] [--files 8]"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from eztools.ezdeps import hashing  # noqa: E402
+
+
+def old_calculate_sha1(path):
+    """calculate_sha1 before eztools.ezdeps.hashing existed."""
+    hash_sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(4096), b""):
+            hash_sha1.update(chunk)
+    return hash_sha1.hexdigest().lower()
+
+
+def write_random_file(path, size):
+    chunk = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size // len(chunk)):
+            f.write(chunk)
+        f.write(chunk[:size % len(chunk)])
+
+
+def measure(function, repeat):
+    """Returns the best wall time of |repeat| runs of |function|."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", default=256, type=int,
+                        help="Size of each file in MiB")
+    parser.add_argument("--files", default=8, type=int,
+                        help="Number of files hashed in parallel")
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--json", default="",
+                        help="Also write results to this file")
+    parsed_args = parser.parse_args(args)
+    size = parsed_args.size_mb * 1024 * 1024
+    folder = tempfile.mkdtemp(prefix="ezdeps-bench-")
+    results = []
+    try:
+        paths = []
+        for i in range(parsed_args.files):
+            paths.append(os.path.join(folder, str(i)))
+            write_random_file(paths[-1], size)
+
+        def report(name, elapsed, total_size):
+            throughput = total_size / elapsed / 1024 / 1024
+            results.append({"name": name, "seconds": elapsed,
+                            "mib_per_second": throughput})
+            print("{:<32} {:>8.3f} s {:>10.1f} MiB/s".format(
+                name, elapsed, throughput))
+
+        report("old sha1 (4 KiB chunks)",
+               measure(lambda: old_calculate_sha1(paths[0]),
+                       parsed_args.repeat), size)
+        for algorithm in hashing.supported_algorithms:
+            report("hash_file " + algorithm,
+                   measure(lambda: hashing.hash_file(paths[0], algorithm),
+                           parsed_args.repeat), size)
+        total_size = size * len(paths)
+        report("old sha1 x{} sequential".format(len(paths)),
+               measure(lambda: [old_calculate_sha1(path) for path in paths],
+                       parsed_args.repeat), total_size)
+        for algorithm in hashing.supported_algorithms:
+            files = [(path, algorithm) for path in paths]
+            report("hash_files {} x{}".format(algorithm, len(paths)),
+                   measure(lambda: hashing.hash_files(files),
+                           parsed_args.repeat), total_size)
+    finally:
+        shutil.rmtree(folder)
+    if parsed_args.json:
+        with open(parsed_args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,263 @@
+##----------------------------------------------------------------------------##
+## benchmarks/bench_sync.py                                                   ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Measure cold sync, warm (no-op) sync, clean, load_deps and calculate_sha1
+on a synthetic DEPS tree whose archives are served by a local server.
+Usage: python benchmarks/bench_sync.py [--deps 32] [--files 16]
+                                       [--file-size-kb 256] [--jobs 4]
+                                       [--json results.json]
+                                       [--compare previous.json]"""
+
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import platform
+import shutil
+import socketserver
+import statistics
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from eztools.ezdeps import action  # noqa: E402
+from eztools.ezdeps.loader import DepsLoader, load_deps_cached  # noqa: E402
+
+
+class QuietRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Served folder, SimpleHTTPRequestHandler only takes a directory since
+    # Python 3.7.
+    folder = "."
+
+    def translate_path(self, path):
+        relpath = os.path.relpath(super().translate_path(path), os.getcwd())
+        return os.path.join(self.folder, relpath)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+@contextlib.contextmanager
+def serve(folder):
+    """Serve |folder| on a free port. Yields the server address."""
+    handler = type("FolderRequestHandler", (QuietRequestHandler,),
+                   {"folder": folder})
+    httpd = LocalServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}/".format(httpd.server_address[1])
+    finally:
+        httpd.shutdown()
+        thread.join()
+        httpd.server_close()
+
+
+def write_archive(path, prefix, files, file_size):
+    """Write a .tar.xz with |files| random files of |file_size| bytes."""
+    with tarfile.open(path, "w:xz") as tar:
+        for i in range(files):
+            data = os.urandom(file_size)
+            info = tarfile.TarInfo("{}/file{}.bin".format(prefix, i))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def make_tree(root, deps, files, file_size, deps_per_file):
+    """Write |deps| archives to |root|/served and a DEPS tree that declares
+    them to |root|/workspace. The top level DEPS.py links to one DEPS.py per
+    |deps_per_file| deps.
+    Returns (workspace path, served path, total archive size)."""
+    served = os.path.join(root, "served")
+    workspace = os.path.join(root, "workspace")
+    os.makedirs(served)
+    os.makedirs(workspace)
+    total_size = 0
+    links = []
+    for start in range(0, deps, deps_per_file):
+        link = "part{}".format(start // deps_per_file)
+        links.append(link)
+        part_deps = []
+        for i in range(start, min(start + deps_per_file, deps)):
+            file_name = "dep{}.tar.xz".format(i)
+            archive_path = os.path.join(served, file_name)
+            write_archive(archive_path, "dep{}".format(i), files, file_size)
+            total_size += os.path.getsize(archive_path)
+            part_deps.append({
+                "file_name": file_name,
+                "folder": "../out",
+                "url": "{server}" + file_name,
+                "sha1": action.calculate_sha1(archive_path)
+            })
+        os.makedirs(os.path.join(workspace, link))
+        with open(os.path.join(workspace, link, "DEPS.py"), "w") as f:
+            f.write("deps = {!r}\n".format(part_deps))
+    with open(os.path.join(workspace, "DEPS.py"), "w") as f:
+        f.write("links = {!r}\n".format(links))
+    return workspace, served, total_size
+
+
+def set_server(workspace, address):
+    """Point urls of every DEPS.py in |workspace| to |address|."""
+    for folder, _, file_names in os.walk(workspace):
+        if "DEPS.py" not in file_names:
+            continue
+        path = os.path.join(folder, "DEPS.py")
+        with open(path, "r") as f:
+            content = f.read()
+        with open(path, "w") as f:
+            f.write(content.replace("{server}", address))
+
+
+class Results:
+
+    def __init__(self):
+        self.timings = {}
+
+    def measure(self, name, function):
+        """Time one run of |function| with its output silenced."""
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+        self.timings.setdefault(name, []).append(elapsed)
+        return result
+
+    def summarize(self, name, deps, total_size):
+        timings = self.timings[name]
+        best = min(timings)
+        summary = {
+            "name": name,
+            "runs": len(timings),
+            "best_seconds": best,
+            "median_seconds": statistics.median(timings),
+            "ms_per_dep": best * 1000 / deps,
+        }
+        if total_size:
+            summary["mib_per_second"] = total_size / best / 1024 / 1024
+        print("{:<20} best {:>8.3f} s  median {:>8.3f} s  {:>8.2f} ms/dep"
+              "{}".format(name, best, summary["median_seconds"],
+                          summary["ms_per_dep"],
+                          "  {:>8.1f} MiB/s".format(
+                              summary["mib_per_second"])
+                          if total_size else ""))
+        return summary
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--deps", default=32, type=int,
+                        help="Number of archives")
+    parser.add_argument("--files", default=16, type=int,
+                        help="Number of files in each archive")
+    parser.add_argument("--file-size-kb", default=256, type=int,
+                        help="Size of each file in archives in KiB")
+    parser.add_argument("--deps-per-file", default=8, type=int,
+                        help="Number of deps declared by each DEPS.py")
+    parser.add_argument("--jobs", default=4, type=int)
+    parser.add_argument("--pipeline", action="store_true", default=False)
+    parser.add_argument("--repeat", default=3, type=int)
+    parser.add_argument("--json", default="",
+                        help="Also write results to this file")
+    parser.add_argument("--compare", default="",
+                        help="Compare with results written by --json")
+    parsed_args = parser.parse_args(args)
+    root = tempfile.mkdtemp(prefix="ezdeps-bench-")
+    old_cwd = os.getcwd()
+    summaries = []
+    try:
+        print("Generating {} archives...".format(parsed_args.deps))
+        workspace, served, total_size = make_tree(
+            root, parsed_args.deps, parsed_args.files,
+            parsed_args.file_size_kb * 1024, parsed_args.deps_per_file)
+        with serve(served) as address:
+            set_server(workspace, address)
+            os.chdir(workspace)
+            results = Results()
+
+            def run(name):
+                options = action.SyncOptions(jobs=parsed_args.jobs,
+                                             pipeline=parsed_args.pipeline)
+                if not action.run_action(name, ".", options):
+                    raise RuntimeError(name + " failed")
+
+            config = {"benchmark": True}
+            graph_path = os.path.join(action.tmp_folder_name,
+                                      "bench_graph.json")
+            archives = [os.path.join(served, file_name)
+                        for file_name in sorted(os.listdir(served))]
+            for _ in range(parsed_args.repeat):
+                results.measure("cold sync", lambda: run("sync"))
+                results.measure("warm sync", lambda: run("sync"))
+                results.measure("clean", lambda: run("clean"))
+                results.measure("load_deps",
+                                lambda: DepsLoader().load("."))
+                results.measure(
+                    "load_deps cached",
+                    lambda: load_deps_cached(".", config, graph_path))
+                results.measure(
+                    "calculate_sha1",
+                    lambda: [action.calculate_sha1(path)
+                             for path in archives])
+            deps = parsed_args.deps
+            summaries = [
+                results.summarize("cold sync", deps, total_size),
+                results.summarize("warm sync", deps, 0),
+                results.summarize("clean", deps, 0),
+                results.summarize("load_deps", deps, 0),
+                results.summarize("load_deps cached", deps, 0),
+                results.summarize("calculate_sha1", deps, total_size),
+            ]
+    finally:
+        os.chdir(old_cwd)
+        shutil.rmtree(root)
+    if parsed_args.json:
+        content = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": vars(parsed_args),
+            "total_archive_size": total_size,
+            "results": summaries
+        }
+        with open(parsed_args.json, "w") as f:
+            json.dump(content, f, indent=2)
+    if parsed_args.compare:
+        compare(parsed_args.compare, summaries)
+
+
+def compare(path, summaries):
+    """Print how much slower (> 1) or faster (< 1) each measurement is than
+    in the results saved to |path|."""
+    with open(path, "r") as f:
+        previous = {summary["name"]: summary
+                    for summary in json.load(f)["results"]}
+    print("Compared with " + path)
+    for summary in summaries:
+        if summary["name"] not in previous:
+            continue
+        old_best = previous[summary["name"]]["best_seconds"]
+        print("{:<20} {:>8.3f} s -> {:>8.3f} s  x{:.2f}".format(
+            summary["name"], old_best, summary["best_seconds"],
+            summary["best_seconds"] / old_best if old_best else 0))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
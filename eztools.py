@@ -17,5 +17,6 @@ if __name__ == "__main__":
     parser.add_argument("--tool", choices=["ezdeps"])
     namespace, tool_args = parser.parse_known_args()
     if namespace.tool == "ezdeps":
-        ezdeps(tool_args)
+        if not ezdeps(tool_args):
+            sys.exit(1)
     sys.exit(0)
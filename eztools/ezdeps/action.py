@@ -6,17 +6,176 @@
 ## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
 ##----------------------------------------------------------------------------##
 
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import functools
 import hashlib
-import lzma
+import http.client
+import json
 import os
+import re
 import shutil
-import tarfile
+import stat
+import tempfile
+import time
 import urllib.error
-import urllib.request
+import urllib.parse
 
-from eztools.ezdeps.utils import import_from_path
+from eztools.ezdeps.archive import (ArchiveError, can_stream, extract_all,
+                                    extract_member, has_archive_name,
+                                    open_archive, open_archive_stream)
+from eztools.ezdeps.cache import lock_suffix
+from eztools.ezdeps.connection import (ConnectionPool,
+                                       default_max_connections_per_host,
+                                       urlopen)
+from eztools.ezdeps.create__config import config_filename
+from eztools.ezdeps.delta import download_delta
+from eztools.ezdeps.hashing import (get_dep_checksum, hash_file, hash_files,
+                                    new_hash, update_hash_from_file,
+                                    verify_file)
+from eztools.ezdeps.loader import (DepsLoader, deps_graph_file_name,
+                                   load_deps_cached)
+from eztools.ezdeps.lock import FileLock
+from eztools.ezdeps.lockfile import (lock_file_name, read_lock_file,
+                                     write_lock_file)
+from eztools.ezdeps.mirrors import (MirrorSelector, get_origin,
+                                    mirror_stats_file_name)
+from eztools.ezdeps.scheduler import BandwidthLimiter, Scheduler, probe_size
+from eztools.ezdeps.stamp import remove_stamp, write_stamp
+from eztools.ezdeps.state import SyncState, get_state_key, state_file_name
+from eztools.ezdeps.trace import add_args, record_spans, span, traced
+from eztools.ezdeps.utils import buffered_log, log, recorded_log
 
 tmp_folder_name = ".tmp"
+locks_folder_name = "locks"
+# Suffix of files that are being downloaded.
+part_suffix = ".part"
+# Suffix of files that store how to resume a part file.
+part_info_suffix = ".json"
+old_suffix = ".old"
+# Suffix of files that list paths extracted from an archive.
+manifest_suffix = ".files"
+# Extracted files are hashed with this algorithm for |action_verify|.
+manifest_algorithm = "sha1"
+# Size of the buffer used to stream downloads to disk.
+download_chunk_size = 1024 * 1024
+# Statuses of DepResult that mean the dep is synced.
+ok_statuses = ("up_to_date", "synced")
+
+
+class SyncCancelledError(Exception):
+    """Raised while a dep is being synced when |SyncOptions.cancel| is
+    set."""
+
+
+class DepResult(collections.namedtuple(
+        "DepResult",
+        ["dep", "status", "bytes", "seconds", "phases", "error",
+         "messages"])):
+    """What happened to |dep| during a sync.
+    - status: "up_to_date" if nothing had to be done, "synced" if files
+              were downloaded, copied, hashed or extracted, "failed" or
+              "cancelled".
+    - bytes: bytes downloaded for the dep.
+    - seconds: time spent on the dep.
+    - phases: dict of seconds spent in each span of the trace (e.g.
+              "download_file", "extract_archive", "hash_file"), see
+              eztools.ezdeps.trace. Spans can be nested.
+    - error: message that explains why the dep failed, or None.
+    - messages: messages logged while syncing the dep."""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.status in ok_statuses
+
+
+# Progress of a dep reported to |SyncOptions.progress|. |kind| is "start"
+# when the dep starts, "bytes" every time data of it is downloaded and
+# "done" when it is finished, with its DepResult in |result|. |bytes| is
+# the number of bytes of the dep downloaded so far.
+DepEvent = collections.namedtuple("DepEvent",
+                                  ["kind", "dep", "bytes", "result"])
+# Deps of a workspace opened by |open_workspace|, the path of its lock file
+# and |inputs|, the files deps were read from: DEPS.py files and _config.py,
+# or the lock file.
+Workspace = collections.namedtuple("Workspace",
+                                   ["deps", "lock_path", "inputs"])
+
+
+class SyncOptions:
+    """Options shared by all deps of one sync.
+    - jobs: number of deps synced in parallel.
+    - pipeline: extract archives while they are being downloaded, if their
+                format can be read as a stream.
+    - keep_archive: in pipeline mode, also save the downloaded archive to
+                    |tmp_folder_name| so later syncs can reuse it.
+    - state: SyncState used to skip deps that are already synced.
+    - cache: DownloadCache shared with other workspaces.
+    - pool: ConnectionPool used for all downloads.
+    - config: values of variables in _config.py. If set, resolved deps are
+              saved to |tmp_folder_name| and reused until DEPS.py files or
+              config values change.
+    - reload_deps: execute all DEPS.py files even if the saved deps are up
+                   to date.
+    - incremental: when an archive is extracted again, only write members
+                   that differ from the files on disk and delete files left
+                   over from the previous version of the archive.
+    - compare_content: in incremental mode, compare content of members
+                       with files on disk instead of their mtime.
+    - mirrors: MirrorSelector that chooses which url of a dep to download
+               from, None to only use "url" of deps.
+    - limiter: BandwidthLimiter that caps the total download rate and counts
+               downloaded bytes.
+    - delta: when the hash of a dep changes, only download the chunks of the
+             new version that are not in the previous one, see
+             |download_delta|. Not used in pipeline mode.
+    - lock_file: lock file written by the "lock" action and read with
+                 |from_lock|, default to |lock_file_name| in the top level
+                 directory.
+    - from_lock: read deps from |lock_file| instead of DEPS.py files.
+    - fast: the "verify" and "repair" actions only compare size and mtime of
+            extracted files instead of their content.
+    - progress: function called with a DepEvent when a dep starts, when
+                data of it is downloaded and when it is done. It is called
+                from the threads that sync deps.
+    - cancel: threading.Event, when it is set deps that didn't start are
+              skipped and downloads stop at their next chunk. Partly
+              downloaded files are kept so the next sync resumes them.
+    - stamp: path of a stamp file written after a successful sync, along
+             with a Ninja depfile, see |action_sync_with_stamp|.
+    - depfile: path of the depfile of |stamp|, default to |stamp| +
+               |depfile_suffix|.
+    """
+
+    def __init__(self, jobs=1, pipeline=False, keep_archive=False,
+                 state=None, cache=None, pool=None, config=None,
+                 reload_deps=False, incremental=False, compare_content=False,
+                 mirrors=None, limiter=None, delta=False, lock_file=None,
+                 from_lock=False, fast=False, progress=None, cancel=None,
+                 stamp=None, depfile=None):
+        self.jobs = jobs
+        self.pipeline = pipeline
+        self.keep_archive = keep_archive
+        self.state = state
+        self.cache = cache
+        self.pool = pool
+        self.config = config
+        self.reload_deps = reload_deps
+        self.incremental = incremental
+        self.compare_content = compare_content
+        self.mirrors = mirrors
+        self.limiter = limiter
+        self.delta = delta
+        self.lock_file = lock_file
+        self.from_lock = from_lock
+        self.fast = fast
+        self.progress = progress
+        self.cancel = cancel
+        self.stamp = stamp
+        self.depfile = depfile
 
 
 def get_download_path(folder, file_name):
@@ -27,129 +186,905 @@ def get_download_path(folder, file_name):
 
 
 def calculate_sha1(path):
-    hash_sha1 = hashlib.sha1()
-    if not os.path.isfile(path):
-        return ""
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha1.update(chunk)
-    return hash_sha1.hexdigest().lower()
+    return hash_file(path, "sha1")
 
 
 def verify_sha1(path, checksum):
-    return calculate_sha1(path) == checksum.lower()
+    return verify_file(path, checksum, "sha1")
 
 
-def download_file(url, save_path):
+def read_part_info(part_path):
+    """Returns metadata saved by |write_part_info| or None."""
+    try:
+        with open(part_path + part_info_suffix, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_part_info(part_path, url, checksum, headers, algorithm="sha1"):
+    """Save what is needed to resume downloading |part_path| later: the url,
+    the expected checksum and the validators used in If-Range."""
+    info = {
+        "url": url,
+        "checksum": checksum,
+        "algorithm": algorithm,
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+    }
+    with open(part_path + part_info_suffix, "w") as f:
+        json.dump(info, f)
+
+
+def get_resumable_size(part_path, url, checksum, algorithm="sha1"):
+    """Returns size of |part_path| if it is a partial download of the same
+    url and checksum, 0 otherwise."""
+    info = read_part_info(part_path)
+    if not info or info.get("url") != url or \
+            info.get("checksum") != checksum or \
+            info.get("algorithm") != algorithm:
+        return 0
+    try:
+        return os.path.getsize(part_path)
+    except OSError:
+        return 0
+
+
+def is_resumed_response(res, offset):
+    """Returns True if |res| is a partial response starting at |offset|.
+    Servers that don't support ranges reply with the whole file instead."""
+    if getattr(res, "status", None) != 206:
+        return False
+    content_range = res.headers.get("Content-Range", "")
+    match = re.match(r"bytes\s+(\d+)-", content_range)
+    return bool(match) and int(match.group(1)) == offset
+
+
+@traced("download_file")
+def download_file(url, save_path, checksum=None, pool=None,
+                  algorithm="sha1", limiter=None):
     """Downloads file from url then saves to save_path.
+    Data is written in chunks to a |part_suffix| file next to save_path and
+    hashed with |algorithm| as it arrives, so memory usage doesn't depend on
+    the file size. The part file is renamed to save_path once it is complete
+    and, if |checksum| is given, its hash matches.
+    If the download is interrupted, the part file is kept and the next call
+    continues from where it stopped using a Range request. The whole file
+    is downloaded again if the server doesn't support ranges or the resumed
+    file doesn't match |checksum|.
+    Connections are taken from |pool| if it is given and downloaded data goes
+    through |limiter| if it is given.
     Returns True if succeeded"""
     folder = os.path.dirname(os.path.abspath(save_path))
     os.makedirs(folder, exist_ok=True)
+    part_path = save_path + part_suffix
+    offset = get_resumable_size(part_path, url, checksum, algorithm)
+    add_args(url=url)
+    while True:
+        hash = new_hash(algorithm)
+        headers = {}
+        if offset:
+            update_hash_from_file(hash, part_path)
+            headers["Range"] = "bytes={}-".format(offset)
+            info = read_part_info(part_path)
+            validator = info["etag"] or info["last_modified"]
+            if validator:
+                headers["If-Range"] = validator
+        try:
+            with urlopen(url, headers, pool) as res:
+                if offset and not is_resumed_response(res, offset):
+                    log('Cannot resume "{}", downloading from the start'
+                        .format(url))
+                    offset = 0
+                    hash = new_hash(algorithm)
+                if not offset:
+                    write_part_info(part_path, url, checksum, res.headers,
+                                    algorithm)
+                with open(part_path, "ab" if offset else "wb") as f:
+                    is_complete = copy_response(res, f, hash, limiter)
+                    add_args(bytes=f.tell() - offset, resumed_from=offset)
+                    if not is_complete:
+                        log('Downloading "{}" was interrupted, {} bytes are'
+                            ' kept to resume later'.format(url, f.tell()))
+                        return False
+        except urllib.error.HTTPError as e:
+            if offset and e.code == 416:
+                # The saved part is not a prefix of the file anymore.
+                discard_part(part_path)
+                offset = 0
+                continue
+            log("Cannot download from: " + url)
+            return False
+        except urllib.error.URLError:
+            log("Cannot download from: " + url)
+            return False
+        except IOError:
+            log("Cannot save downloaded data to: " + save_path)
+            discard_part(part_path)
+            return False
+        if checksum is not None and \
+                hash.hexdigest().lower() != checksum.lower():
+            discard_part(part_path)
+            if offset:
+                log('Resumed download of "{}" does not match {} {},'
+                    ' downloading from the start'.format(url, algorithm,
+                                                         checksum))
+                offset = 0
+                continue
+            log('Downloaded data from "{}" does not match {} {}'.format(
+                url, algorithm, checksum))
+            return False
+        os.replace(part_path, save_path)
+        remove_file(part_path + part_info_suffix)
+        return True
+
+
+def copy_response(res, f, hash, limiter=None):
+    """Write the body of |res| to |f| and feed it to |hash| in chunks.
+    Every chunk is passed to |limiter| if it is given.
+    Returns False if the connection is broken before the body is complete.
+    Errors when writing to |f| are raised."""
+    buffer = memoryview(bytearray(download_chunk_size))
+    while True:
+        try:
+            size = res.readinto(buffer)
+        except (OSError, http.client.HTTPException):
+            return False
+        if not size:
+            # HTTPResponse.readinto() returns 0 instead of raising when the
+            # connection is closed early, its length tells what is missing.
+            return not getattr(res, "length", None)
+        if limiter:
+            limiter.consume(size)
+        hash.update(buffer[:size])
+        f.write(buffer[:size])
+
+
+def discard_part(part_path):
+    remove_file(part_path)
+    remove_file(part_path + part_info_suffix)
+
+
+def remove_file(path):
+    if os.path.isfile(path):
+        os.remove(path)
+
+
+def get_manifest_path(archive_path):
+    return archive_path + manifest_suffix
+
+
+# A path extracted from an archive. size, mtime and sha1 are only known for
+# regular files, they are None for folders, links and entries of manifests
+# written by older ezdeps.
+ManifestRecord = collections.namedtuple("ManifestRecord",
+                                        ["entry", "size", "mtime", "sha1"])
+
+
+def get_entry_name(member):
+    return member.name + "/" if member.isdir() else member.name
+
+
+def get_manifest_entries(tar):
+    """Returns names of all members of |tar|, folders end with "/"."""
+    return [get_entry_name(member) for member in tar.getmembers()]
+
+
+def get_manifest_records(members, extract_path, old_records=None):
+    """Returns ManifestRecord of tar |members| that were extracted to
+    |extract_path|. Regular files are hashed in parallel, except those that
+    have the same size and mtime as in |old_records| (files that incremental
+    extraction skipped), which keep their previous hash."""
+    old_hashes = {}
+    for record in old_records or []:
+        if record.sha1:
+            old_hashes[(record.entry, record.size, record.mtime)] = \
+                record.sha1
+    records = []
+    files = []
+    for member in members:
+        if not member.isreg():
+            records.append(ManifestRecord(get_entry_name(member), None, None,
+                                          None))
+            continue
+        record = ManifestRecord(member.name, member.size, int(member.mtime),
+                                old_hashes.get((member.name, member.size,
+                                                int(member.mtime))))
+        if record.sha1 is None:
+            files.append(len(records))
+        records.append(record)
+    hashes = hash_files([(os.path.join(extract_path, records[i].entry),
+                          manifest_algorithm) for i in files])
+    for i, sha1 in zip(files, hashes):
+        records[i] = records[i]._replace(sha1=sha1 or None)
+    return records
+
+
+def write_manifest(manifest_path, records):
+    """Save |records| returned by |get_manifest_records| (or entries
+    returned by |get_manifest_entries|), one per line: the entry, followed
+    by its size, mtime and hash separated by tabs for regular files."""
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)),
+                exist_ok=True)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for record in records:
+            if isinstance(record, str) or record.sha1 is None:
+                f.write(getattr(record, "entry", record) + "\n")
+            else:
+                f.write("{}\t{}\t{}\t{}\n".format(*record))
+
+
+def parse_manifest_line(line):
+    fields = line.rsplit("\t", 3)
+    if len(fields) == 4 and fields[1].isdigit() and \
+            fields[2].lstrip("-").isdigit() and \
+            re.match("^[0-9a-f]{40}$", fields[3]):
+        return ManifestRecord(fields[0], int(fields[1]), int(fields[2]),
+                              fields[3])
+    return ManifestRecord(line, None, None, None)
+
+
+def read_manifest_records(manifest_path):
+    """Returns ManifestRecord saved by |write_manifest| or None."""
     try:
-        res = urllib.request.urlopen(url)
-        with open(save_path, "wb") as f:
-            f.write(res.read())
-    except (urllib.error.URLError, urllib.error.HTTPError):
-        print("Cannot download from: " + url)
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return [parse_manifest_line(line.rstrip("\n"))
+                    for line in f if line.strip()]
+    except OSError:
+        return None
+
+
+def read_manifest(manifest_path):
+    """Returns entries saved by |write_manifest| or None."""
+    records = read_manifest_records(manifest_path)
+    if records is None:
+        return None
+    return [record.entry for record in records]
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def hash_member(tar, member):
+    hash = new_hash("sha1")
+    f = tar.extractfile(member)
+    for chunk in iter(lambda: f.read(download_chunk_size), b""):
+        hash.update(chunk)
+    return hash.hexdigest().lower()
+
+
+def is_member_unchanged(tar, member, path, compare_content=False):
+    """Returns True if |path| already is what extracting |member| would
+    write: a folder for a folder, a symbolic link to the same target for a
+    symbolic link or a regular file with the same size, mode and mtime (or
+    content if |compare_content| is True) for a file.
+    Only the permission bits that tarfile's "data" filter keeps are
+    compared."""
+    try:
+        st = os.lstat(path)
+    except OSError:
         return False
-    except IOError:
-        print("Cannot save downloaded data to: " + save_path)
+    if member.isdir():
+        return stat.S_ISDIR(st.st_mode)
+    if member.issym():
+        return stat.S_ISLNK(st.st_mode) and \
+            os.readlink(path) == member.linkname
+    if not member.isreg() or not stat.S_ISREG(st.st_mode) or \
+            st.st_size != member.size:
         return False
-    return True
+    if os.name != "nt" and \
+            stat.S_IMODE(st.st_mode) & 0o755 != member.mode & 0o755:
+        return False
+    if compare_content:
+        return hash_file(path) == hash_member(tar, member)
+    return int(st.st_mtime) == int(member.mtime)
+
+
+def extract_changed_members(tar, extract_path, compare_content=False):
+    """Extract members of |tar| that are not already on disk, see
+    |is_member_unchanged|. Files that are skipped keep their mtime so
+    build tools don't rebuild what depends on them.
+    Returns number of skipped members."""
+    skipped_count = 0
+    for member in tar:
+        path = os.path.join(extract_path, member.name)
+        if is_member_unchanged(tar, member, path, compare_content):
+            skipped_count += 1
+            continue
+        if os.path.lexists(path) and member.isdir() != \
+                (os.path.isdir(path) and not os.path.islink(path)):
+            # A file became a folder or the other way around.
+            remove_path(path)
+        extract_member(tar, member, extract_path)
+    return skipped_count
 
 
-def extract_tar_xz(tar_xz_path, extract_path):
-    if os.path.exists(tar_xz_path):
+def delete_stale_entries(old_entries, entries, extract_path):
+    """Delete |old_entries| that are not in |entries| anymore, together
+    with their parent folders if they become empty.
+    Returns number of deleted files/folders."""
+    names = set(entry.rstrip("/") for entry in entries)
+    stale_entries = []
+    for entry in old_entries:
+        name = entry.rstrip("/")
+        if name in names:
+            continue
+        stale_entries.append(entry)
+        parent = os.path.dirname(name)
+        while parent and parent != "." and parent not in names:
+            stale_entries.append(parent + "/")
+            parent = os.path.dirname(parent)
+    return delete_entries(list(collections.OrderedDict.fromkeys(
+        stale_entries)), extract_path)
+
+
+@traced("extract_archive")
+def extract_archive(archive_path, extract_path, incremental=False,
+                    compare_content=False, jobs=None):
+    """Extract |archive_path| to |extract_path| and write the manifest of
+    extracted paths next to the archive. The archive can be in any format
+    of eztools.ezdeps.archive, formats that support it are decompressed on
+    up to |jobs| threads (e.g. .tar.xz compressed in several blocks).
+    If |incremental| is True, members that are already on disk are not
+    written again (see |extract_changed_members|) and files listed in the
+    previous manifest that are not in the archive anymore are deleted.
+    Returns list of manifest entries or None if the archive can't be
+    extracted."""
+    manifest_path = get_manifest_path(archive_path)
+    if os.path.exists(archive_path):
+        old_records = None
+        if incremental:
+            old_records = read_manifest_records(manifest_path)
         try:
-            with lzma.open(tar_xz_path) as f:
-                with tarfile.open(fileobj=f) as tar:
-                    if not os.path.isdir(extract_path):
-                        os.makedirs(extract_path)
-                    tar.extractall(extract_path)
-                    return True
-        except (lzma.LZMAError, tarfile.TarError, EOFError):
+            # Comparing content reads members before extracting them.
+            with open_archive(archive_path, jobs, compare_content) as tar:
+                if not os.path.isdir(extract_path):
+                    os.makedirs(extract_path)
+                if incremental:
+                    add_args(skipped=extract_changed_members(
+                        tar, extract_path, compare_content))
+                else:
+                    extract_all(tar, extract_path)
+                members = tar.getmembers()
+            records = get_manifest_records(members, extract_path,
+                                           old_records)
+            entries = [record.entry for record in records]
+            add_args(path=archive_path, bytes=os.path.getsize(archive_path),
+                     files=len(entries))
+            if old_records:
+                add_args(deleted=delete_stale_entries(
+                    [record.entry for record in old_records], entries,
+                    extract_path))
+            write_manifest(manifest_path, records)
+            return entries
+        except ArchiveError as e:
+            log(str(e))
+    return None
+
+
+class HashingReader:
+    """Read-only file object that hashes everything read from |fileobj| and
+    optionally copies it to |copy_file| and passes its size to |limiter|."""
+
+    def __init__(self, fileobj, hash, copy_file=None, limiter=None):
+        self.fileobj = fileobj
+        self.hash = hash
+        self.copy_file = copy_file
+        self.limiter = limiter
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.size += len(data)
+        if self.limiter:
+            self.limiter.consume(len(data))
+        self.hash.update(data)
+        if self.copy_file:
+            self.copy_file.write(data)
+        return data
+
+
+def move_tree(src, dst):
+    """Move all files in |src| to the same relative location in |dst|,
+    replacing files that already exist. Other files in |dst| are kept."""
+    for root, dirs, files in os.walk(src):
+        target_root = os.path.normpath(
+            os.path.join(dst, os.path.relpath(root, src)))
+        os.makedirs(target_root, exist_ok=True)
+        # Symbolic links to folders are moved as they are.
+        links = [name for name in dirs
+                 if os.path.islink(os.path.join(root, name))]
+        dirs[:] = [name for name in dirs if name not in links]
+        for name in files + links:
+            target_path = os.path.join(target_root, name)
+            if os.path.isdir(target_path) and \
+                    not os.path.islink(target_path):
+                shutil.rmtree(target_path)
+            os.replace(os.path.join(root, name), target_path)
+
+
+@traced("download_and_extract_archive")
+def download_and_extract_archive(url, extract_path, checksum, save_path=None,
+                                 pool=None, algorithm="sha1",
+                                 manifest_path=None, limiter=None,
+                                 file_name=None):
+    """Download an archive from url and extract it while the data is
+    arriving: the response is hashed, decompressed and untarred in a single
+    pass into a staging folder inside |extract_path|. The staging folder is
+    moved into |extract_path| only if the hash matches |checksum|.
+    The format of the archive comes from |file_name| (default to the end of
+    |url|) and must support streaming, see |can_stream|.
+    If |save_path| is given, the archive is also saved there.
+    If |manifest_path| is given, the manifest of extracted paths is written
+    there.
+    Connections are taken from |pool| if it is given and downloaded data goes
+    through |limiter| if it is given.
+    Returns list of manifest entries or None if failed."""
+    if file_name is None:
+        file_name = urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1]
+    os.makedirs(extract_path, exist_ok=True)
+    staging_path = tempfile.mkdtemp(prefix=".ezdeps-", dir=extract_path)
+    part_path = None
+    copy_file = None
+    hash = new_hash(algorithm)
+    try:
+        if save_path:
+            os.makedirs(os.path.dirname(os.path.abspath(save_path)),
+                        exist_ok=True)
+            part_path = save_path + part_suffix
+            copy_file = open(part_path, "wb")
+        with urlopen(url, pool=pool) as res:
+            reader = HashingReader(res, hash, copy_file, limiter)
+            with open_archive_stream(reader, file_name) as tar:
+                # Members are checked before they are written, the hash can
+                # only be checked once the whole stream is read.
+                extract_all(tar, staging_path)
+                members = tar.getmembers()
+                entries = [get_entry_name(member) for member in members]
+            # Hash the end of the stream that tar doesn't need to read.
+            for _ in iter(lambda: reader.read(download_chunk_size), b""):
+                pass
+            add_args(url=url, bytes=reader.size, files=len(entries))
+        if copy_file:
+            copy_file.close()
+        if hash.hexdigest().lower() != checksum.lower():
+            log('Downloaded data from "{}" does not match {} {}'.format(
+                url, algorithm, checksum))
+            return None
+        move_tree(staging_path, extract_path)
+        if manifest_path:
+            write_manifest(manifest_path,
+                           get_manifest_records(members, extract_path))
+        if part_path:
+            os.replace(part_path, save_path)
+            part_path = None
+        return entries
+    except (urllib.error.URLError, urllib.error.HTTPError):
+        log("Cannot download from: " + url)
+    except ArchiveError as e:
+        log('Cannot extract data downloaded from "{}": {}'.format(url, e))
+    except IOError:
+        log('Cannot save data downloaded from "{}"'.format(url))
+    finally:
+        if copy_file:
+            copy_file.close()
+        if part_path:
+            remove_file(part_path)
+        shutil.rmtree(staging_path, ignore_errors=True)
+    return None
+
+
+def delete_entries(entries, extract_path):
+    """Delete manifest |entries| from |extract_path|. Folders are only
+    deleted if they are empty afterward.
+    Returns number of deleted files/folders."""
+    deleted_count = 0
+    folders = []
+    for entry in entries:
+        path = os.path.join(extract_path, entry.rstrip("/"))
+        if entry.endswith("/") and not os.path.islink(path):
+            folders.append(path)
+        elif os.path.lexists(path):
+            remove_path(path)
+            deleted_count += 1
+    # Delete the deepest folders first so their parents can become empty.
+    for folder in sorted(folders, key=len, reverse=True):
+        try:
+            os.rmdir(folder)
+            deleted_count += 1
+        except OSError:
             pass
-    return False
+    return deleted_count
+
+
+@traced("delete_extracted_files")
+def delete_extracted_files(archive_path, extract_path):
+    """Delete files/folders extracted from an archive to |extract_path|.
+    They are read from the manifest written when the archive was extracted.
+    If there is no manifest (the archive was extracted by an older ezdeps),
+    the list is read from the archive itself.
+    Folders are only deleted if they are empty afterward, so files that
+    don't come from the archive are kept."""
+    manifest_path = get_manifest_path(archive_path)
+    entries = read_manifest(manifest_path)
+    if entries is None:
+        try:
+            with open_archive(archive_path) as tar:
+                entries = get_manifest_entries(tar)
+        except (OSError, ArchiveError):
+            return
+    deleted_count = delete_entries(entries, extract_path)
+    add_args(path=archive_path, deleted=deleted_count)
+    if deleted_count:
+        log('Deleted {} files/folders extracted from "{}"'.format(
+            deleted_count, archive_path))
+    remove_file(manifest_path)
 
 
-def delete_extracted_files(xz_path, extract_path):
-    """Get list of files/folders from an archive and
-    try to delete those files/folders if they have been extracted"""
+def is_entry_intact(path, record, fast=False):
+    """Returns True if |path| is what |record| describes, False if it is
+    not, or None if its content has to be hashed to know.
+    Only the existence of folders, links and files without a hash is
+    checked. If |fast| is True, files are only compared by size and mtime."""
     try:
-        with lzma.open(xz_path) as f:
-            with tarfile.open(fileobj=f) as tar:
-                message = 'Deleting files extracted from "{}"'.format(xz_path)
-                has_printed_message = False
-                for extracted_file in tar.getnames():
-                    extracted_file_path = os.path.join(extract_path,
-                                                       extracted_file)
-                    if os.path.exists(extracted_file_path):
-                        if not has_printed_message:
-                            print(message)
-                            has_printed_message = True
-                        print('Deleting "{}"'.format(extracted_file_path))
-                        if os.path.isfile(extracted_file_path):
-                            os.remove(extracted_file_path)
-                        else:
-                            shutil.rmtree(extracted_file_path)
-    except (lzma.LZMAError, tarfile.TarError, EOFError):
-        return
-
-
-def has_archive_name(path):
-    if path[-2:] == "xz":
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if record.entry.endswith("/"):
+        return stat.S_ISDIR(st.st_mode)
+    if record.sha1 is None:
+        return True
+    if not stat.S_ISREG(st.st_mode) or st.st_size != record.size:
+        return False
+    if fast:
+        return int(st.st_mtime) == record.mtime
+    return None
+
+
+def verify_entries(checks, fast=False, jobs=None):
+    """Check files/folders extracted from archives, files are hashed in
+    parallel on up to |jobs| threads (default to the number of CPUs).
+    Args:
+        checks: list of (path, record), |record| is the ManifestRecord of
+                |path|.
+        fast: only compare size and mtime of files, see |is_entry_intact|.
+    Returns:
+        List of True for intact paths and False for missing or modified
+        paths, in the same order as |checks|."""
+    results = [is_entry_intact(path, record, fast)
+               for path, record in checks]
+    indexes = [i for i, result in enumerate(results) if result is None]
+    hashes = hash_files([(checks[i][0], manifest_algorithm)
+                         for i in indexes], jobs)
+    for i, sha1 in zip(indexes, hashes):
+        results[i] = sha1 == checks[i][1].sha1
+    return results
+
+
+@traced("fetch_from_cache")
+def fetch_from_cache(cache, download_path, checksum, algorithm="sha1"):
+    """Place the file with |checksum| from |cache| at |download_path|.
+    Returns True if the file is in the cache and its content is intact."""
+    if not cache or not cache.fetch(checksum, download_path, algorithm):
+        return False
+    if verify_file(download_path, checksum, algorithm):
         return True
+    cache.remove(checksum, algorithm)
+    remove_file(download_path)
     return False
 
 
-def get_dep(dep):
+def get_lock_path(download_path):
+    """Returns path of the lock that all processes syncing to
+    |download_path| share."""
+    key = os.path.normcase(os.path.abspath(download_path))
+    return os.path.join(tmp_folder_name, locks_folder_name,
+                        hashlib.sha1(key.encode("utf-8")).hexdigest() +
+                        lock_suffix)
+
+
+def read_lock_record(lock, dep):
+    """Returns the state record of |dep| left in |lock| by the process that
+    synced it last, or None."""
+    try:
+        content = json.loads(lock.read())
+        if content["key"] == get_state_key(dep):
+            return content["record"]
+    except (ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def download_dep_file(url, download_path, checksum, options,
+                      algorithm="sha1"):
+    """Download |url| to |download_path|. With |options.delta|, first try to
+    rebuild the file from the previous version kept in
+    |download_path| + |old_suffix| and download only what changed.
+    Returns True if succeeded."""
+    old_path = download_path + old_suffix
+    if options.delta and os.path.isfile(old_path):
+        if download_delta(url, download_path, checksum, old_path,
+                          options.pool, algorithm, options.limiter):
+            return True
+        log('Cannot update "{}" from its previous version, downloading all'
+            ' of it'.format(download_path))
+    return download_file(url, download_path, checksum, options.pool,
+                         algorithm, options.limiter)
+
+
+def download_from_mirrors(dep, options, download_path, download):
+    """Call |download| with urls of |dep| from the best mirror to the worst
+    (see MirrorSelector) until one succeeds, and measure how fast each
+    mirror was. Only "url" of |dep| is used if |options| has no mirrors.
+    Returns the result of the successful call or None if all failed."""
+    mirrors = options.mirrors
+    urls = [dep["url"]]
+    if mirrors:
+        urls = mirrors.rank(mirrors.get_urls(dep), options.pool)
+    for i, url in enumerate(urls):
+        if i:
+            log('Trying to download "{}" from "{}"'.format(dep["file_name"],
+                                                          url))
+        start = time.perf_counter()
+        result = download(url)
+        if result is None or result is False:
+            if mirrors:
+                mirrors.record_failure(url)
+            continue
+        if mirrors:
+            size = None
+            if os.path.isfile(download_path):
+                size = os.path.getsize(download_path)
+            mirrors.record(url, time.perf_counter() - start, size)
+        return result
+    return None
+
+
+def get_dep(dep, options=None):
+    """If the dep is recorded in |options.state| and its files haven't changed
+    since, then do nothing.
+    Otherwise, the dep is synced by |sync_dep| while holding a lock on its
+    download path, so concurrent processes that sync the same workspace
+    don't write the same files. A process that waited for the lock reuses
+    the result of the process that held it if it is still up to date.
+    Returns True if there is no error, False otherwise.
+    """
+    if options is None:
+        options = SyncOptions()
+    state = options.state
+    download_path = get_download_path(dep["folder"], dep["file_name"])
+    if state and state.is_up_to_date(dep, download_path):
+        return True
+    with FileLock(get_lock_path(download_path)) as lock:
+        if state and state.adopt(dep, download_path,
+                                 read_lock_record(lock, dep)):
+            return True
+        is_synced = sync_dep(dep, options)
+        if state:
+            lock.write(json.dumps({"key": get_state_key(dep),
+                                   "record": state.get_record(dep)}))
+        return is_synced
+
+
+def sync_dep(dep, options):
     """If the file is not an archive, exists and the hash matches, then do nothing.
     If the file is an archive, exists in |tmp_dir|, and the hash matches, then re-extract the file.
     Otherwise, re-download the file and extract it if it is an archive.
+    With |options.incremental|, files extracted from an older version of an
+    archive are kept until the new version is extracted over them, except
+    in pipeline mode.
+    Downloads of the same file by different processes are serialized by a
+    lock on its cache entry so it is downloaded once.
     Returns True if there is no error, False otherwise.
     """
+    state = options.state
     file_name = dep["file_name"]
     folder = dep["folder"]
-    url = dep["url"]
-    sha1 = dep["sha1"]
+    checksum, algorithm = get_dep_checksum(dep)
     is_archive = has_archive_name(file_name)
     download_path = get_download_path(folder, file_name)
+    incremental = options.incremental and not options.pipeline
     if os.path.exists(download_path):
-        if verify_sha1(download_path, sha1):
+        if verify_file(download_path, checksum, algorithm):
+            names = []
             if is_archive:
-                if not extract_tar_xz(download_path, folder):
-                    print('Cannot extract "{}" even when sha1 is matched'
-                          .format(file_name))
+                names = extract_archive(download_path, folder, incremental,
+                                        options.compare_content)
+                if names is None:
+                    log('Cannot extract "{}" even when {} is matched'
+                        .format(file_name, algorithm))
+                    if state:
+                        state.remove(dep)
                     return False
+            if options.cache:
+                options.cache.add(download_path, checksum, algorithm)
+            if state:
+                state.update(dep, download_path, names)
             return True
         else:
-            print('File "{}" sha1 is not matched'.format(file_name))
-            if is_archive:
+            log('File "{}" {} is not matched'.format(file_name, algorithm))
+            if is_archive and not incremental:
                 delete_extracted_files(download_path, folder)
-            os.remove(download_path)
-            print('Re-downloading "{}"'.format(file_name))
+            if options.delta and not options.pipeline:
+                # Keep it so unchanged parts are not downloaded again.
+                os.replace(download_path, download_path + old_suffix)
+            else:
+                os.remove(download_path)
+            log('Re-downloading "{}"'.format(file_name))
     else:
-        print('Downloading "{}"'.format(file_name))
-    if not download_file(url, download_path):
-        return False
-    print('Downloaded "{}"'.format(file_name))
-    if not verify_sha1(download_path, sha1):
-        print('Failed to verify sha1 of "{}" even after downloading'
-              .format(file_name))
-        return False
-    if is_archive and not extract_tar_xz(download_path, folder):
-        print('Cannot extract "{}" even after downloading'.format(file_name))
-        return False
-    print('Processed "{}" successfully'.format(file_name))
+        if is_archive and not incremental:
+            # Files extracted from a previous version of the archive that
+            # was not kept.
+            delete_extracted_files(download_path, folder)
+        log('Downloading "{}"'.format(file_name))
+    if state:
+        state.remove(dep)
+    cache_lock = contextlib.suppress()
+    if options.cache:
+        cache_lock = options.cache.lock(checksum, algorithm)
+    with cache_lock:
+        names = None
+        if fetch_from_cache(options.cache, download_path, checksum, algorithm):
+            log('Copied "{}" from cache'.format(file_name))
+        elif is_archive and options.pipeline and can_stream(file_name):
+            save_path = None
+            if options.keep_archive or options.cache:
+                save_path = download_path
+            names = download_from_mirrors(
+                dep, options, download_path,
+                lambda url: download_and_extract_archive(
+                    url, folder, checksum, save_path, options.pool,
+                    algorithm, get_manifest_path(download_path),
+                    options.limiter, file_name))
+            if names is None:
+                log('Failed to download and extract "{}"'.format(file_name))
+                return False
+        else:
+            if not download_from_mirrors(
+                    dep, options, download_path,
+                    lambda url: download_dep_file(url, download_path,
+                                                  checksum, options,
+                                                  algorithm)):
+                log('Failed to download "{}"'.format(file_name))
+                return False
+            remove_file(download_path + old_suffix)
+            log('Downloaded "{}"'.format(file_name))
+        if options.cache and os.path.isfile(download_path):
+            options.cache.add(download_path, checksum, algorithm)
+    if is_archive and names is None:
+        names = extract_archive(download_path, folder, incremental,
+                                options.compare_content)
+        if names is None:
+            log('Cannot extract "{}" even after downloading'
+                .format(file_name))
+            return False
+    if is_archive and options.pipeline and not options.keep_archive:
+        remove_file(download_path)
+    if state:
+        state.update(dep, download_path, names or [])
+    log('Processed "{}" successfully'.format(file_name))
     return True
 
 
-def clean(dep):
+@traced("find_damaged_deps")
+def find_damaged_deps(deps, options):
+    """Check that files of |deps| are still what was synced: the file
+    itself for deps that are not archives and every file/folder listed in
+    the manifest for archives, see |verify_entries|. Everything is checked
+    in one parallel pass.
+    Returns:
+        List of (dep, entries) for damaged deps, |entries| are the damaged
+        manifest entries or None if the whole dep has to be synced again
+        (the file of a dep that is not an archive is damaged or the archive
+        was never extracted)."""
+    jobs = options.jobs if options.jobs > 1 else None
+    checks = []
+    check_deps = []
+    files = []
+    file_deps = []
+    damaged = {}
+    for i, dep in enumerate(deps):
+        download_path = get_download_path(dep["folder"], dep["file_name"])
+        if not has_archive_name(dep["file_name"]):
+            if not os.path.isfile(download_path):
+                damaged[i] = None
+            elif options.fast:
+                if options.state and options.state.get_record(dep) and \
+                        not options.state.is_up_to_date(dep, download_path):
+                    damaged[i] = None
+            else:
+                checksum, algorithm = get_dep_checksum(dep)
+                files.append((download_path, algorithm, checksum))
+                file_deps.append(i)
+            continue
+        records = read_manifest_records(get_manifest_path(download_path))
+        if records is None:
+            damaged[i] = None
+            continue
+        for record in records:
+            checks.append((os.path.join(dep["folder"],
+                                        record.entry.rstrip("/")), record))
+            check_deps.append(i)
+    results = verify_entries(checks, options.fast, jobs)
+    hashes = hash_files([(path, algorithm) for path, algorithm, _ in files],
+                        jobs)
+    for i, (_, _, checksum), sha1 in zip(file_deps, files, hashes):
+        if sha1 != checksum:
+            damaged[i] = None
+    for i, (_, record), is_intact in zip(check_deps, checks, results):
+        if not is_intact and damaged.get(i, []) is not None:
+            damaged.setdefault(i, []).append(record.entry)
+    add_args(deps=len(deps), files=len(checks) + len(files),
+             damaged=len(damaged))
+    return [(deps[i], damaged[i]) for i in sorted(damaged)]
+
+
+def extract_members(archive_path, extract_path, entries):
+    """Extract members of |archive_path| named in manifest |entries| to
+    |extract_path|, replacing what is there.
+    Returns number of extracted members or None if the archive can't be
+    extracted."""
+    names = set(entries)
+    extracted_count = 0
+    try:
+        with open_archive(archive_path) as tar:
+            for member in tar:
+                if get_entry_name(member) not in names:
+                    continue
+                path = os.path.join(extract_path, member.name)
+                if os.path.lexists(path) and not (
+                        member.isdir() and os.path.isdir(path) and
+                        not os.path.islink(path)):
+                    remove_path(path)
+                extract_member(tar, member, extract_path)
+                extracted_count += 1
+    except (OSError, ArchiveError):
+        return None
+    return extracted_count
+
+
+def repair_dep(dep, entries, options):
+    """Restore damaged manifest |entries| of |dep| from its archive, which
+    is taken from |tmp_folder_name| or the cache. Deps that are not
+    archives, that have no archive at hand or whose damaged entries are
+    unknown (|entries| is None) are synced again by |get_dep|.
+    Returns True if there is no error, False otherwise."""
+    file_name = dep["file_name"]
+    download_path = get_download_path(dep["folder"], file_name)
+    checksum, algorithm = get_dep_checksum(dep)
+    if entries is not None:
+        is_kept = os.path.isfile(download_path)
+        if is_kept and verify_file(download_path, checksum, algorithm) or \
+                not is_kept and fetch_from_cache(options.cache, download_path,
+                                                 checksum, algorithm):
+            extracted_count = extract_members(download_path, dep["folder"],
+                                              entries)
+            if not is_kept:
+                remove_file(download_path)
+            if extracted_count is not None:
+                log('Restored {} files/folders of "{}"'.format(
+                    extracted_count, file_name))
+                return True
+        log('Cannot restore files of "{}" from its archive'.format(
+            file_name))
+    if options.state:
+        options.state.remove(dep)
+    log('Syncing "{}" again'.format(file_name))
+    return get_dep(dep, options)
+
+
+def clean(dep, options=None):
     """Delete a file and if the file is an archive,
     then delete all files extracted from that file
     Args:
         file (str): path to file you want to delete
     """
+    if options is None:
+        options = SyncOptions()
     file_name = dep["file_name"]
     folder = dep["folder"]
     is_archive = has_archive_name(file_name)
@@ -157,58 +1092,409 @@ def clean(dep):
     message = 'Deleting "{}"'
     if is_archive:
         message = 'Deleting "{}" and its contents'
-    print(message.format(file_name))
-    if os.path.exists(download_path):
-        if is_archive:
-            delete_extracted_files(download_path, folder)
-    os.remove(download_path)
-    print('Deleted "{}"'.format(file_name))
-
-
-def load_deps(relpath_to_toplevel, global_deps):
-    """Run DEPS.py file in \relpath_to_toplevel.
-    Each DEPS.py is a python script but there are some important variables:
-    - links: path to relative directories to the current DEPS.py file directory
-             that contains other DEPS.py files.
-    - deps: list of dependencies which are objects like this
-            {
-                "file_name": "file_name",
-                "folder": "save or extract location which is relative to DEPS.py",
-                "url": "download url",
-                "sha1": "sha1 of the file",
-            }
-            All objects will be save to global_deps to return to upper level
+    log(message.format(file_name))
+    if options.state:
+        options.state.remove(dep)
+    if is_archive:
+        delete_extracted_files(download_path, folder)
+    remove_file(download_path)
+    log('Deleted "{}"'.format(file_name))
+
+
+def load_deps(relpath_to_toplevel, global_deps, deps_files=None):
+    """Load DEPS.py in |relpath_to_toplevel| and all DEPS.py files linked
+    from it, see DepsLoader for the format.
+    If |deps_files| is given, it is extended with paths of all those
+    DEPS.py files.
     Returns:
-        Lists of deps of current DEPS.py and all links DEPS.py files.
+        |global_deps| extended with deps of all those DEPS.py files.
     """
-    deps_path = os.path.join(relpath_to_toplevel, "DEPS.py")
-    deps = import_from_path(deps_path, deps_path)
-    if hasattr(deps, "links"):
-        for link in deps.links:
-            global_deps = load_deps(
-                os.path.join(relpath_to_toplevel, link), global_deps)
-    if hasattr(deps, "deps"):
-        for dep in deps.deps:
-            dep["folder"] = os.path.join(relpath_to_toplevel, dep["folder"])
-            dep["deps_file"] = os.path.join(relpath_to_toplevel, "DEPS.py")
-        global_deps.extend(deps.deps)
+    loader = DepsLoader()
+    global_deps.extend(loader.load(relpath_to_toplevel))
+    if deps_files is not None:
+        deps_files.extend(loader.deps_files)
     return global_deps
 
 
-def action_get_deps(deps):
+def group_deps(deps):
+    """Group deps that share the same download path. Deps in a group write to
+    the same file so they have to be processed one after another, while
+    different groups are independent and can be processed in parallel.
+    Returns:
+        List of groups, each group is a list of deps in their original order.
+    """
+    groups = collections.OrderedDict()
     for dep in deps:
-        get_dep(dep)
+        download_path = get_download_path(dep["folder"], dep["file_name"])
+        key = os.path.normcase(os.path.abspath(download_path))
+        groups.setdefault(key, []).append(dep)
+    return list(groups.values())
+
+
+class DepMonitor:
+    """Takes the place of the BandwidthLimiter of |options| while |dep| is
+    synced: counts bytes downloaded for |dep|, reports them to
+    |options.progress| and stops the download when |options.cancel| is
+    set."""
+
+    def __init__(self, dep, options):
+        self.dep = dep
+        self.options = options
+        self.limiter = options.limiter
+        self.bytes = 0
+
+    def consume(self, size):
+        if self.options.cancel and self.options.cancel.is_set():
+            raise SyncCancelledError('Syncing "{}" was cancelled'.format(
+                self.dep["file_name"]))
+        self.bytes += size
+        if self.limiter:
+            self.limiter.consume(size)
+        if self.options.progress:
+            self.options.progress(DepEvent("bytes", self.dep, self.bytes,
+                                           None))
 
 
-def action_clean(deps):
+def get_dep_result(dep, options):
+    """Sync |dep| like |get_dep| and record what happened.
+    Returns a DepResult."""
+    progress = options.progress
+    if options.cancel and options.cancel.is_set():
+        result = DepResult(dep, "cancelled", 0, 0, {},
+                           "Cancelled before it started", [])
+        if progress:
+            progress(DepEvent("done", dep, 0, result))
+        return result
+    if progress:
+        progress(DepEvent("start", dep, 0, None))
+    monitor = DepMonitor(dep, options)
+    dep_options = copy.copy(options)
+    dep_options.limiter = monitor
+    start = time.perf_counter()
+    error = None
+    with record_spans() as spans, recorded_log() as messages:
+        try:
+            if get_dep(dep, dep_options):
+                status = "up_to_date"
+            else:
+                status = "failed"
+        except SyncCancelledError as e:
+            log(str(e))
+            status = "cancelled"
+        except Exception as e:
+            # Other deps are still synced and reported.
+            log('Failed to sync "{}": {!r}'.format(dep["file_name"], e))
+            status = "failed"
+            error = str(e) or repr(e)
+    phases = {}
+    for name, seconds, _ in spans:
+        phases[name] = phases.get(name, 0) + seconds
+    if status == "up_to_date" and (phases or monitor.bytes):
+        status = "synced"
+    if status not in ok_statuses and error is None:
+        error = messages[-1] if messages else status
+    result = DepResult(dep, status, monitor.bytes,
+                       time.perf_counter() - start, phases, error,
+                       messages)
+    if progress:
+        progress(DepEvent("done", dep, monitor.bytes, result))
+    return result
+
+
+def get_deps_group(group, options, buffered=False):
+    """Sync deps in |group| one after another.
+    If |buffered| is True, messages of the whole group are printed at once
+    when the group is done so they don't interleave with other groups.
+    Returns list of DepResult of deps in |group|."""
+    results = []
+    with buffered_log() if buffered else contextlib.suppress():
+        for dep in group:
+            with span("get_dep", file_name=dep["file_name"],
+                      folder=dep["folder"]):
+                results.append(get_dep_result(dep, options))
+    return results
+
+
+def is_in_cache(dep, cache):
+    """Returns True if the file of |dep| can be copied from |cache|."""
+    if not cache:
+        return False
+    try:
+        checksum, algorithm = get_dep_checksum(dep)
+    except KeyError:
+        return False
+    return cache.has(checksum, algorithm)
+
+
+def get_group_size(group, options):
+    """Returns how many bytes syncing |group| will probably download: 0 for
+    deps that are already synced or in |options.cache|, otherwise their
+    "size" if they declare it, the size of the previous version or the size
+    from a HEAD request."""
+    size = 0
+    state = options.state
+    for dep in group:
+        download_path = get_download_path(dep["folder"], dep["file_name"])
+        if state and state.is_up_to_date(dep, download_path):
+            continue
+        if is_in_cache(dep, options.cache):
+            continue
+        record = state.get_record(dep) if state else None
+        if "size" in dep:
+            size += dep["size"]
+        elif record and record["size"]:
+            size += record["size"]
+        else:
+            size += probe_size(dep["url"], options.pool) or 0
+    return size
+
+
+def sync_deps(deps, options=None):
+    """Sync |deps| using up to |options.jobs| worker threads. In parallel,
+    the largest groups are started first and at most
+    |options.pool.max_connections_per_host| groups of the same host are
+    synced at the same time, see Scheduler. The host of a group is the host
+    of the "url" of its first dep, even if it is downloaded from a mirror.
+    Returns list of DepResult in the order of |deps|."""
+    if options is None:
+        options = SyncOptions()
+    groups = group_deps(deps)
+    if options.jobs <= 1 or len(groups) <= 1:
+        return get_results_in_order(
+            deps, [get_deps_group(group, options) for group in groups])
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=options.jobs) as executor:
+        sizes = list(executor.map(
+            lambda group: get_group_size(group, options), groups))
+    max_per_host = default_max_connections_per_host
+    if options.pool:
+        max_per_host = options.pool.max_connections_per_host
+    scheduler = Scheduler(options.jobs, max_per_host)
+    results = scheduler.run([
+        (get_origin(group[0]["url"]), size,
+         functools.partial(get_deps_group, group, options, True))
+        for group, size in zip(groups, sizes)])
+    log("Synced {} groups of deps in {:.2f}s, waited {:.2f}s on average"
+        " and {:.2f}s at most to start, {} times for a busy host".format(
+            scheduler.stats["tasks"], scheduler.stats["seconds"],
+            scheduler.stats["average_wait"], scheduler.stats["max_wait"],
+            scheduler.stats["host_waits"]))
+    return get_results_in_order(deps, results)
+
+
+def get_results_in_order(deps, group_results):
+    """Returns DepResult of |group_results| (lists of DepResult of groups of
+    |deps|) in the order of |deps|."""
+    results = {}
+    for result in sum(group_results, []):
+        results[id(result.dep)] = result
+    return [results[id(dep)] for dep in deps]
+
+
+def action_get_deps(deps, options=None):
+    """Sync |deps|, see |sync_deps|.
+    Returns True if all deps are synced successfully."""
+    return all(result.ok for result in sync_deps(deps, options))
+
+
+def action_lock(deps, lock_path, options=None):
+    """Write |deps| to the lock file |lock_path| with their sizes, which are
+    asked to the server with HEAD requests if deps don't declare them.
+    Returns True if the lock file is written."""
+    if options is None:
+        options = SyncOptions()
+
+    def get_size(dep):
+        if "size" in dep:
+            return dep["size"]
+        return probe_size(dep["url"], options.pool)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(options.jobs, 1)) as executor:
+        sizes = list(executor.map(get_size, deps))
+    locked_deps = []
+    for dep, size in zip(deps, sizes):
+        dep = dict(dep)
+        if size is None:
+            log('Warning: Size of "{}" is unknown'.format(dep["file_name"]))
+        else:
+            dep["size"] = size
+        locked_deps.append(dep)
+    write_lock_file(lock_path, locked_deps, options.config)
+    log('Locked {} deps in "{}"'.format(len(locked_deps), lock_path))
+    return True
+
+
+def get_dep_artifact(dep):
+    """Returns the file that changes when |dep| is synced again: its
+    downloaded file, or the manifest of its archive if the archive is not
+    kept. None if neither exists."""
+    download_path = get_download_path(dep["folder"], dep["file_name"])
+    for path in [download_path, get_manifest_path(download_path)]:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def action_sync_with_stamp(workspace, options):
+    """Sync deps of |workspace| and, if all of them are synced, write
+    |options.stamp| with the checksums of the deps and a Ninja depfile that
+    lists |workspace.inputs| and the files of the deps, see
+    eztools.ezdeps.stamp. The stamp is only rewritten if something was
+    synced or a checksum changed, so a build with restat doesn't rebuild
+    targets that depend on it. If a dep fails, the stamp is removed.
+    Returns True if all deps are synced successfully."""
+    results = sync_deps(workspace.deps, options)
+    if not all(result.ok for result in results):
+        remove_stamp(options.stamp)
+        return False
+    lines = []
+    inputs = list(workspace.inputs)
+    for dep in workspace.deps:
+        checksum, algorithm = get_dep_checksum(dep)
+        lines.append("{} {} {}\n".format(
+            algorithm, checksum, os.path.join(dep["folder"],
+                                              dep["file_name"])))
+        artifact = get_dep_artifact(dep)
+        if artifact:
+            inputs.append(artifact)
+    touch = any(result.status == "synced" for result in results)
+    if write_stamp(options.stamp, "".join(sorted(lines)), inputs,
+                   options.depfile, touch):
+        log('Updated stamp "{}"'.format(options.stamp))
+    return True
+
+
+def report_damaged_deps(damaged_deps):
+    for dep, entries in damaged_deps:
+        if entries is None:
+            log('"{}" is missing or modified'.format(dep["file_name"]))
+            continue
+        for entry in entries:
+            log('"{}" extracted from "{}" is missing or modified'.format(
+                os.path.join(dep["folder"], entry.rstrip("/")),
+                dep["file_name"]))
+
+
+def action_verify(deps, options=None):
+    """Check that files of |deps| have not been modified or deleted since
+    they were synced, see |find_damaged_deps|.
+    Returns True if nothing is damaged."""
+    if options is None:
+        options = SyncOptions()
+    start = time.perf_counter()
+    damaged_deps = find_damaged_deps(deps, options)
+    report_damaged_deps(damaged_deps)
+    log("Verified {} deps in {:.2f}s, {} damaged".format(
+        len(deps), time.perf_counter() - start, len(damaged_deps)))
+    return not damaged_deps
+
+
+def action_repair(deps, options=None):
+    """Find damaged deps like |action_verify| and restore only the damaged
+    files, see |repair_dep|.
+    Returns True if all damaged deps are repaired."""
+    if options is None:
+        options = SyncOptions()
+    damaged_deps = find_damaged_deps(deps, options)
+    report_damaged_deps(damaged_deps)
+    results = []
+    for dep, entries in damaged_deps:
+        with span("repair_dep", file_name=dep["file_name"],
+                  folder=dep["folder"]):
+            results.append(repair_dep(dep, entries, options))
+    log("Repaired {} of {} damaged deps".format(sum(results),
+                                                len(damaged_deps)))
+    return all(results)
+
+
+def action_clean(deps, options=None):
     for dep in deps:
-        clean(dep)
+        with span("clean", file_name=dep["file_name"], folder=dep["folder"]):
+            clean(dep, options)
+    return True
+
+
+def set_default_options(options):
+    """Give |options| the sync state of the workspace, measurements of
+    mirrors saved in |tmp_folder_name| and a BandwidthLimiter without limit,
+    unless it already has them."""
+    if options.state is None:
+        options.state = SyncState(
+            os.path.join(tmp_folder_name, state_file_name)).load()
+    if options.mirrors is None:
+        options.mirrors = MirrorSelector(
+            [], os.path.join(tmp_folder_name, mirror_stats_file_name)).load()
+    if options.limiter is None:
+        options.limiter = BandwidthLimiter()
 
 
-def run_action(action, dir):
-    deps = load_deps(dir, [])
-    # Choose function depends on action once and for all.
-    if action == "sync":
-        action_get_deps(deps)
-    elif action == "clean":
-        action_clean(deps)
+@contextlib.contextmanager
+def open_workspace(dir, options):
+    """Load all deps reachable from DEPS.py in |dir|, or deps in the lock
+    file if |options.from_lock| is True.
+    The sync state of the workspace and measurements of mirrors are loaded
+    from |tmp_folder_name| unless |options| already has them, and saved
+    when the block ends.
+    Yields a Workspace."""
+    set_default_options(options)
+    pool = options.pool
+    if pool is None:
+        options.pool = ConnectionPool()
+    lock_path = options.lock_file or os.path.join(dir, lock_file_name)
+    inputs = []
+    with span("load_deps", dir=dir):
+        if options.from_lock:
+            deps = read_lock_file(lock_path)
+            inputs.append(lock_path)
+        elif options.config is None:
+            deps = load_deps(dir, [], inputs)
+        else:
+            deps = load_deps_cached(
+                dir, options.config,
+                os.path.join(tmp_folder_name, deps_graph_file_name),
+                options.reload_deps, inputs)
+            if os.path.isfile(config_filename):
+                inputs.append(config_filename)
+        add_args(deps=len(deps))
+    try:
+        yield Workspace(deps, lock_path, inputs)
+    finally:
+        options.state.save()
+        if options.mirrors:
+            options.mirrors.save()
+        if options.pool.created:
+            log("Opened {} connections, reused them for {} requests".format(
+                options.pool.created, options.pool.reused))
+        if options.limiter.total:
+            log("Downloaded {:.1f} MiB at {:.1f} MiB/s".format(
+                options.limiter.total / 1024 / 1024,
+                options.limiter.get_throughput() / 1024 / 1024))
+        if pool is None:
+            options.pool.close()
+            options.pool = None
+
+
+def run_action(action, dir, options=None):
+    """Run |action| on all deps of the workspace in |dir|, see
+    |open_workspace|.
+    Returns True if the action succeeded for every dep."""
+    if options is None:
+        options = SyncOptions()
+    with open_workspace(dir, options) as workspace:
+        deps = workspace.deps
+        lock_path = workspace.lock_path
+        # Choose function depends on action once and for all.
+        if action == "sync" and options.stamp:
+            return action_sync_with_stamp(workspace, options)
+        elif action == "sync":
+            return action_get_deps(deps, options)
+        elif action == "clean":
+            return action_clean(deps, options)
+        elif action == "lock":
+            return action_lock(deps, lock_path, options)
+        elif action == "verify":
+            return action_verify(deps, options)
+        elif action == "repair":
+            return action_repair(deps, options)
+        return False
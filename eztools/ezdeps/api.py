@@ -0,0 +1,116 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/api.py                                                      ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""API for programs that sync deps in their own process, e.g. a build driver
+that does its own work while deps are being synced:
+
+    cancel = CancelToken()
+    result = sync("path/to/workspace", progress=print, cancel=cancel)
+    for dep_result in result.failed:
+        print(dep_result.dep["file_name"], dep_result.error)
+
+or from a coroutine:
+
+    result = await sync_async("path/to/workspace", progress=print)
+
+SyncOptions, DepResult, DepEvent and SyncCancelledError can be imported
+from here too. Messages are printed like the command line does, call
+eztools.ezdeps.utils.set_log_function to send them somewhere else."""
+
+import asyncio
+import copy
+import functools
+import threading
+import time
+
+from eztools.ezdeps.action import (DepEvent, DepResult, SyncCancelledError,
+                                   SyncOptions, open_workspace, sync_deps)
+
+
+class CancelToken(threading.Event):
+    """Set it from any thread to cancel the sync it is given to, see
+    |SyncOptions.cancel|."""
+
+    def cancel(self):
+        self.set()
+
+    @property
+    def cancelled(self):
+        return self.is_set()
+
+
+class SyncResult:
+    """Result of |sync|.
+    - deps: list of DepResult in the order of deps in the workspace.
+    - seconds: time spent on the whole sync, loading deps included."""
+
+    def __init__(self, deps, seconds):
+        self.deps = deps
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return all(result.ok for result in self.deps)
+
+    @property
+    def cancelled(self):
+        return any(result.status == "cancelled" for result in self.deps)
+
+    @property
+    def failed(self):
+        """DepResult of deps that are not synced."""
+        return [result for result in self.deps if not result.ok]
+
+    @property
+    def bytes(self):
+        return sum(result.bytes for result in self.deps)
+
+    def __repr__(self):
+        return "SyncResult(ok={}, deps={}, bytes={}, seconds={:.2f})".format(
+            self.ok, len(self.deps), self.bytes, self.seconds)
+
+
+def sync(dir=".", options=None, progress=None, cancel=None):
+    """Sync all deps of the workspace in |dir| like `ezdeps.py sync`.
+    |options| is a SyncOptions, it is not modified. |progress| and
+    |cancel| replace those of |options|, see SyncOptions. Pass
+    |options.config| to reuse deps resolved by the last sync.
+    Returns a SyncResult. Raises DepsCycleError or LockFileError if deps
+    can't be loaded."""
+    options = copy.copy(options) if options else SyncOptions()
+    if progress is not None:
+        options.progress = progress
+    if cancel is not None:
+        options.cancel = cancel
+    start = time.perf_counter()
+    with open_workspace(dir, options) as workspace:
+        results = sync_deps(workspace.deps, options)
+    return SyncResult(results, time.perf_counter() - start)
+
+
+async def sync_async(dir=".", options=None, progress=None, cancel=None):
+    """Same as |sync|, but the sync runs on the default executor of the
+    running event loop and |progress| is called on the loop's thread.
+    Cancelling the task cancels the sync: deps that are being downloaded
+    stop at their next chunk, then the task raises CancelledError."""
+    loop = asyncio.get_event_loop()
+    if cancel is None:
+        cancel = CancelToken()
+    report = None
+    if progress is not None:
+        def report(event):
+            loop.call_soon_threadsafe(progress, event)
+    future = loop.run_in_executor(
+        None, functools.partial(sync, dir, options, report, cancel))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.cancel()
+        # Don't leave threads writing to the workspace behind.
+        await asyncio.wait([future])
+        raise
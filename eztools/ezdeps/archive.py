@@ -0,0 +1,347 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/archive.py                                                  ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Archive formats that ezdeps can extract.
+Every format opens its archives as a tarfile.TarFile (zip archives are
+wrapped in a ZipTar that has the same interface), so extraction, manifests
+and cleaning work the same way for all formats. A dep is an archive if its
+file name ends with the extension of a registered format, the format of a
+downloaded archive is detected from its magic bytes."""
+
+import contextlib
+import gzip
+import lzma
+import os
+import stat
+import tarfile
+import tempfile
+import time
+import zipfile
+import zlib
+
+from eztools.ezdeps.xz import open_tar_xz
+
+try:
+    # Python 3.14+
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Registered ArchiveFormat, see |register_format|.
+formats = []
+# Enough bytes to find the magic of every format.
+magic_size = 512
+
+
+class ArchiveError(Exception):
+    """Raised when an archive can't be read."""
+
+
+class ArchiveFormat:
+    """A kind of archive ezdeps can extract.
+    - name: name of the format, e.g. "tar.xz".
+    - extensions: endings of file names of archives of this format.
+    - magic: bytes found at |magic_offset| of every archive of this format.
+    - open: function(path, jobs, seekable) that returns a context manager
+            that yields the archive |path| as a TarFile. |jobs| is the
+            number of threads it may use. If |seekable| is False, members
+            may only be readable in order.
+    - open_stream: function(fileobj) that returns a context manager that
+                   yields a TarFile in stream mode reading the archive from
+                   |fileobj|, None if the format can't be read as a stream.
+    - errors: exceptions raised for corrupted archives.
+    - available: False if a module needed to read the format is missing."""
+
+    def __init__(self, name, extensions, magic, magic_offset, open,
+                 open_stream=None, errors=(), available=True):
+        self.name = name
+        self.extensions = extensions
+        self.magic = magic
+        self.magic_offset = magic_offset
+        self.open = open
+        self.open_stream = open_stream
+        self.errors = (tarfile.TarError, EOFError) + tuple(errors)
+        self.available = available
+
+
+def register_format(format):
+    """Add |format| to the formats ezdeps can extract."""
+    formats.append(format)
+    return format
+
+
+def get_format_by_name(file_name):
+    """Returns the ArchiveFormat whose extension ends |file_name| (the
+    longest one if several do) or None."""
+    file_name = file_name.lower()
+    best_format = None
+    best_length = 0
+    for format in formats:
+        for extension in format.extensions:
+            if file_name.endswith(extension) and \
+                    len(extension) > best_length:
+                best_format = format
+                best_length = len(extension)
+    return best_format
+
+
+def detect_format(path):
+    """Returns the ArchiveFormat of the file |path| from its magic bytes or
+    None."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(magic_size)
+    except OSError:
+        return None
+    for format in formats:
+        if head[format.magic_offset:].startswith(format.magic):
+            return format
+    return None
+
+
+def has_archive_name(file_name):
+    return get_format_by_name(file_name) is not None
+
+
+def can_stream(file_name):
+    """Returns True if archives named |file_name| can be extracted while
+    they are being downloaded."""
+    format = get_format_by_name(file_name)
+    return format is not None and format.available and \
+        format.open_stream is not None
+
+
+def check_available(format):
+    if not format.available:
+        raise ArchiveError("Python has no module to read {} archives".format(
+            format.name))
+
+
+@contextlib.contextmanager
+def open_archive(path, jobs=None, seekable=False):
+    """Open the archive |path| as a TarFile. Its format is detected from its
+    content, or from its name if the content doesn't tell.
+    Raises ArchiveError if the format is unknown or the archive is
+    corrupted, also while the archive is being read in the with block."""
+    format = detect_format(path) or get_format_by_name(path)
+    if format is None:
+        raise ArchiveError('Unknown archive format of "{}"'.format(path))
+    check_available(format)
+    try:
+        with format.open(path, jobs, seekable) as tar:
+            yield tar
+    except format.errors as e:
+        raise ArchiveError('Cannot read "{}": {}'.format(path, e))
+
+
+@contextlib.contextmanager
+def open_archive_stream(fileobj, file_name):
+    """Read the archive named |file_name| from |fileobj| as a TarFile in
+    stream mode, see |open_archive|."""
+    format = get_format_by_name(file_name)
+    if format is None or format.open_stream is None:
+        raise ArchiveError('"{}" can not be extracted as a stream'.format(
+            file_name))
+    check_available(format)
+    try:
+        with format.open_stream(fileobj) as tar:
+            yield tar
+    except format.errors as e:
+        raise ArchiveError('Cannot read "{}": {}'.format(file_name, e))
+
+
+def check_member(member):
+    """Raises ArchiveError if extracting |member| would write outside the
+    extract folder: absolute paths, ".." parts, links to somewhere outside
+    the folder and device files."""
+    name = member.name.replace("\\", "/")
+    if name.startswith("/") or os.path.isabs(member.name) or \
+            os.path.splitdrive(member.name)[0] or ".." in name.split("/"):
+        raise ArchiveError('Member "{}" is outside of the extract'
+                           ' folder'.format(member.name))
+    if member.issym() or member.islnk():
+        target = member.linkname.replace("\\", "/")
+        if member.issym():
+            # Targets of symbolic links are relative to their folder, those
+            # of hard links to the archive.
+            target = os.path.join(os.path.dirname(name), target)
+        target = os.path.normpath(target).replace("\\", "/")
+        if member.linkname.startswith("/") or \
+                os.path.isabs(member.linkname) or target == ".." or \
+                target.startswith("../"):
+            raise ArchiveError('Link "{}" points outside of the extract'
+                               ' folder: "{}"'.format(member.name,
+                                                      member.linkname))
+    if member.isdev():
+        raise ArchiveError('Member "{}" is a device file'.format(
+            member.name))
+
+
+def extract_member(tar, member, path):
+    """Extract |member| of |tar| into |path| after |check_member|. tarfile's
+    "data" filter is also used where it exists."""
+    check_member(member)
+    if isinstance(tar, tarfile.TarFile) and hasattr(tarfile, "data_filter"):
+        tar.extract(member, path, filter="data")
+    else:
+        tar.extract(member, path)
+
+
+def extract_all(tar, path):
+    """Extract all members of |tar| into |path|, see |extract_member|.
+    Raises ArchiveError before writing a member that is not safe, members
+    before it are already extracted."""
+    for member in tar:
+        extract_member(tar, member, path)
+
+
+def open_tar(mode):
+    """Returns an |ArchiveFormat.open| function for formats tarfile reads
+    with |mode|."""
+    def open(path, jobs=None, seekable=False):
+        return tarfile.open(path, mode)
+    return open
+
+
+def open_tar_stream(mode):
+    def open_stream(fileobj):
+        return tarfile.open(fileobj=fileobj, mode=mode)
+    return open_stream
+
+
+@contextlib.contextmanager
+def open_tar_zst(path, jobs=None, seekable=False):
+    if zstd:
+        with zstd.ZstdFile(path) as f:
+            with tarfile.open(fileobj=f) as tar:
+                yield tar
+    elif seekable:
+        # zstandard readers can't go back, extract a temporary tar instead.
+        with open(path, "rb") as f, tempfile.TemporaryFile() as tar_file:
+            zstandard.ZstdDecompressor().copy_stream(f, tar_file)
+            tar_file.seek(0)
+            with tarfile.open(fileobj=tar_file) as tar:
+                yield tar
+    else:
+        with open(path, "rb") as f:
+            with open_tar_zst_stream(f) as tar:
+                yield tar
+
+
+@contextlib.contextmanager
+def open_tar_zst_stream(fileobj):
+    if zstd:
+        with zstd.ZstdFile(fileobj) as f:
+            with tarfile.open(fileobj=f, mode="r|") as tar:
+                yield tar
+    else:
+        with zstandard.ZstdDecompressor().stream_reader(
+                fileobj, closefd=False) as reader:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                yield tar
+
+
+class ZipTar:
+    """Zip archive with the interface of tarfile.TarFile that ezdeps uses:
+    iteration, getmembers, extract, extractall and extractfile. Members are
+    tarfile.TarInfo so they can be compared with files on disk like members
+    of tar archives."""
+
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path)
+        self.members = []
+        self.infos = {}
+        for info in self.zip.infolist():
+            member = get_zip_member(self.zip, info)
+            self.members.append(member)
+            self.infos[member.name] = info
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def getmembers(self):
+        return list(self.members)
+
+    def extractfile(self, member):
+        return self.zip.open(self.infos[member.name])
+
+    def extract(self, member, path):
+        info = self.infos[member.name]
+        target_path = os.path.join(path, member.name)
+        if member.isdir():
+            os.makedirs(target_path, exist_ok=True)
+        elif member.issym():
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            if os.path.lexists(target_path):
+                # Replace what is there, like tarfile does.
+                os.remove(target_path)
+            os.symlink(member.linkname, target_path)
+            return
+        else:
+            target_path = self.zip.extract(info, path)
+        if os.name != "nt" and member.mode:
+            os.chmod(target_path, member.mode & 0o755)
+        os.utime(target_path, (member.mtime, member.mtime))
+
+    def extractall(self, path):
+        for member in self.members:
+            self.extract(member, path)
+
+    def close(self):
+        self.zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_zip_member(zip, info):
+    """Returns a tarfile.TarInfo that describes the member |info| of
+    |zip|."""
+    member = tarfile.TarInfo(info.filename.rstrip("/"))
+    mode = info.external_attr >> 16
+    if info.filename.endswith("/"):
+        member.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(mode):
+        member.type = tarfile.SYMTYPE
+        member.linkname = zip.read(info).decode("utf-8")
+    member.size = 0 if member.isdir() else info.file_size
+    member.mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+    member.mode = stat.S_IMODE(mode) or (0o755 if member.isdir() else 0o644)
+    return member
+
+
+register_format(ArchiveFormat(
+    "tar.xz", [".tar.xz", ".txz", ".xz"], b"\xfd7zXZ\x00", 0,
+    lambda path, jobs=None, seekable=False: open_tar_xz(
+        path, 1 if seekable else jobs),
+    open_tar_stream("r|xz"), [lzma.LZMAError]))
+register_format(ArchiveFormat(
+    "tar.gz", [".tar.gz", ".tgz"], b"\x1f\x8b", 0, open_tar("r:gz"),
+    open_tar_stream("r|gz"),
+    [zlib.error] + ([gzip.BadGzipFile] if hasattr(gzip, "BadGzipFile")
+                    else [])))
+register_format(ArchiveFormat(
+    "tar.zst", [".tar.zst", ".tzst"], b"\x28\xb5\x2f\xfd", 0, open_tar_zst,
+    open_tar_zst_stream,
+    [zstd.ZstdError] if zstd else
+    [zstandard.ZstdError] if zstandard else [],
+    bool(zstd or zstandard)))
+register_format(ArchiveFormat(
+    "zip", [".zip"], b"PK\x03\x04", 0,
+    lambda path, jobs=None, seekable=False: ZipTar(path), None,
+    [zipfile.BadZipFile, zlib.error]))
+# Plain tar goes last: its magic is further in the file.
+register_format(ArchiveFormat(
+    "tar", [".tar"], b"ustar", 257, open_tar("r:")))
@@ -0,0 +1,201 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/cache.py                                                    ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import os
+import shutil
+import sys
+import threading
+
+from eztools.ezdeps.lock import FileLock
+
+cache_env_name = "EZDEPS_CACHE"
+cache_size_env_name = "EZDEPS_CACHE_SIZE"
+default_cache_size = 10 * 1024 * 1024 * 1024
+# Suffix of the file whose mtime is the last time an object was used.
+# The object's own mtime can't be used since it is shared with hard links in
+# workspaces.
+last_used_suffix = ".used"
+lock_suffix = ".lock"
+
+if sys.platform == "linux":
+    import fcntl
+    # From linux/fs.h
+    FICLONE = 0x40049409
+
+
+def get_default_cache_dir():
+    """Returns $EZDEPS_CACHE or ~/.cache/ezdeps"""
+    cache_dir = os.environ.get(cache_env_name)
+    if cache_dir:
+        return cache_dir
+    return os.path.join(os.path.expanduser("~"), ".cache", "ezdeps")
+
+
+def parse_size(size):
+    """Convert sizes like "512", "100K", "20M" or "10G" to bytes."""
+    size = str(size).strip().upper()
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if size and size[-1] == "B":
+        size = size[:-1]
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def reflink(src, dst):
+    """Create |dst| as a copy-on-write clone of |src|.
+    Raises OSError if the file system doesn't support it."""
+    if sys.platform != "linux":
+        raise OSError("reflink is not supported on " + sys.platform)
+    with open(src, "rb") as src_file:
+        with open(dst, "wb") as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            except OSError:
+                dst_file.close()
+                os.remove(dst)
+                raise
+
+
+def get_unique_tmp_path(path):
+    """Returns a temporary path next to |path| that no other thread or
+    process uses."""
+    return "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+
+
+def place_file(src, dst):
+    """Make |dst| have the content of |src| using a hard link, a reflink or a
+    copy, whichever works first. |dst| is replaced atomically.
+    Returns the method that was used."""
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    tmp_path = get_unique_tmp_path(dst)
+    methods = [("hardlink", os.link), ("reflink", reflink),
+               ("copy", shutil.copyfile)]
+    try:
+        for method, function in methods:
+            try:
+                function(src, tmp_path)
+            except OSError:
+                if method == "copy":
+                    raise
+                continue
+            os.replace(tmp_path, dst)
+            return method
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class DownloadCache:
+    """Content addressed store of downloaded files that is shared by all
+    workspaces on a machine. Files are stored as
+    |root|/objects/<algorithm>/ab/abcdef... where abcdef... is their hash.
+    Objects are written to a temporary file then renamed so concurrent
+    readers never see partial objects. When the total size goes over
+    |max_size|, the least recently used objects are deleted.
+    |lock| gives a lock per object so processes that need the same object
+    download it once."""
+
+    def __init__(self, root, max_size=default_cache_size):
+        self.root = root
+        self.max_size = max_size
+
+    def get_object_path(self, checksum, algorithm="sha1"):
+        checksum = checksum.lower()
+        return os.path.join(self.root, "objects", algorithm, checksum[:2],
+                            checksum)
+
+    def has(self, checksum, algorithm="sha1"):
+        """Returns True if the object with |checksum| is in the cache."""
+        return bool(checksum) and os.path.isfile(
+            self.get_object_path(checksum, algorithm))
+
+    def lock(self, checksum, algorithm="sha1"):
+        """Returns the FileLock of the object with |checksum|."""
+        return FileLock(self.get_object_path(checksum, algorithm) +
+                        lock_suffix)
+
+    def touch(self, object_path):
+        used_path = object_path + last_used_suffix
+        with open(used_path, "a"):
+            pass
+        os.utime(used_path)
+
+    def fetch(self, checksum, dst, algorithm="sha1"):
+        """Place the object with |checksum| at |dst|.
+        Returns True if the object is in the cache."""
+        if not checksum:
+            return False
+        object_path = self.get_object_path(checksum, algorithm)
+        try:
+            place_file(object_path, dst)
+            self.touch(object_path)
+        except OSError:
+            # Not in the cache or evicted meanwhile.
+            return False
+        return True
+
+    def add(self, src, checksum, algorithm="sha1"):
+        """Store |src| whose content has |checksum| in the cache."""
+        if not checksum:
+            return
+        object_path = self.get_object_path(checksum, algorithm)
+        try:
+            if not os.path.isfile(object_path):
+                place_file(src, object_path)
+            self.touch(object_path)
+        except OSError:
+            return
+        self.evict()
+
+    def remove(self, checksum, algorithm="sha1"):
+        self.remove_object(self.get_object_path(checksum, algorithm))
+
+    def remove_object(self, object_path):
+        for path in [object_path, object_path + last_used_suffix]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def evict(self):
+        """Delete least recently used objects until the cache fits in
+        |self.max_size|. If another process is already evicting, let it do
+        the work."""
+        lock = FileLock(os.path.join(self.root, "evict.lock"))
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            objects = []
+            total_size = 0
+            objects_dir = os.path.join(self.root, "objects")
+            for root, dirs, files in os.walk(objects_dir):
+                for name in files:
+                    if name.endswith(last_used_suffix) or \
+                            name.endswith(lock_suffix) or \
+                            name.endswith(".tmp"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        size = os.stat(path).st_size
+                    except OSError:
+                        continue
+                    try:
+                        last_used = os.stat(path + last_used_suffix).st_mtime
+                    except OSError:
+                        last_used = 0
+                    total_size += size
+                    objects.append((last_used, size, path))
+            objects.sort()
+            for last_used, size, path in objects:
+                if total_size <= self.max_size:
+                    break
+                self.remove_object(path)
+                total_size -= size
+        finally:
+            lock.release()
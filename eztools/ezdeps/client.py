@@ -0,0 +1,84 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/client.py                                                   ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Thin client of the `ezdeps watch` daemon. It only imports the standard
+modules it needs so it starts fast, use it from editors and build tools:
+python -m eztools.ezdeps.client [status|sync|reload|stop]
+Requests and responses are one JSON object per line. The daemon listens on a
+Unix socket in the .tmp folder of the workspace, or on a localhost TCP port
+written to a file in .tmp where Unix sockets are not available."""
+
+import json
+import os
+import socket
+import sys
+
+# Same as eztools.ezdeps.action.tmp_folder_name.
+tmp_folder_name = ".tmp"
+socket_file_name = "ezdeps.sock"
+port_file_name = "ezdeps.port"
+connect_timeout = 5
+
+
+class DaemonNotRunningError(Exception):
+    """Raised when there is no daemon to send a request to."""
+
+
+def get_socket_path():
+    return os.path.join(tmp_folder_name, socket_file_name)
+
+
+def get_port_path():
+    return os.path.join(tmp_folder_name, port_file_name)
+
+
+def connect():
+    """Returns a socket connected to the daemon of the current directory."""
+    try:
+        if hasattr(socket, "AF_UNIX") and os.path.exists(get_socket_path()):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(connect_timeout)
+            sock.connect(get_socket_path())
+        else:
+            with open(get_port_path(), "r") as f:
+                port = int(f.read())
+            sock = socket.create_connection(("127.0.0.1", port),
+                                            connect_timeout)
+    except (OSError, ValueError) as e:
+        raise DaemonNotRunningError(
+            "ezdeps watch is not running in {}: {}".format(os.getcwd(), e))
+    sock.settimeout(None)
+    return sock
+
+
+def send_request(command, **args):
+    """Send |command| with |args| to the daemon.
+    Returns the response, a dict that has at least "ok"."""
+    request = dict(args, command=command)
+    with connect() as sock:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise DaemonNotRunningError("ezdeps watch closed the connection")
+    return json.loads(line.decode("utf-8"))
+
+
+def main(args):
+    command = args[0] if args else "status"
+    try:
+        response = send_request(command)
+    except DaemonNotRunningError as e:
+        print(e)
+        return False
+    print(json.dumps(response, indent=1, sort_keys=True))
+    return bool(response.get("ok"))
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
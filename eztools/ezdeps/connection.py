@@ -0,0 +1,191 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/connection.py                                               ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import http.client
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+default_max_connections_per_host = 4
+default_timeout = 60
+max_redirects = 10
+redirect_codes = [301, 302, 303, 307, 308]
+
+
+class PooledResponse:
+    """Wrapper of http.client.HTTPResponse that gives the connection back to
+    its pool when the response is closed."""
+
+    def __init__(self, pool, key, connection, response, url):
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.headers = response.headers
+
+    @property
+    def length(self):
+        return self.response.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self.response.read()
+        return self.response.read(size)
+
+    def readinto(self, buffer):
+        return self.response.readinto(buffer)
+
+    def geturl(self):
+        return self.url
+
+    def close(self):
+        if self.connection is None:
+            return
+        # The connection can only be reused if the body was read completely.
+        reusable = self.response.isclosed() and not self.response.will_close
+        if not reusable:
+            self.response.close()
+            self.connection.close()
+        self.pool.release(self.key, self.connection, reusable)
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool:
+    """Keep-alive HTTP and HTTPS connections that are reused across
+    downloads of a whole sync. At most |max_connections_per_host| connections
+    are open to each host at the same time, other threads wait for one to
+    be released.
+    |created| and |reused| count how many connections were opened and how
+    many requests were sent on an already open connection."""
+
+    def __init__(self,
+                 max_connections_per_host=default_max_connections_per_host,
+                 timeout=default_timeout):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle_connections = {}
+        self.semaphores = {}
+        self.ssl_context = None
+        self.created = 0
+        self.reused = 0
+
+    def get_semaphore(self, key):
+        with self.lock:
+            if key not in self.semaphores:
+                self.semaphores[key] = threading.BoundedSemaphore(
+                    self.max_connections_per_host)
+            return self.semaphores[key]
+
+    def acquire(self, key):
+        """Returns (connection, True if it is reused)."""
+        self.get_semaphore(key).acquire()
+        with self.lock:
+            idle_connections = self.idle_connections.get(key)
+            if idle_connections:
+                self.reused += 1
+                return idle_connections.pop(), True
+            self.created += 1
+        scheme, host, port = key
+        if scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            connection = http.client.HTTPSConnection(
+                host, port, timeout=self.timeout, context=self.ssl_context)
+        else:
+            connection = http.client.HTTPConnection(
+                host, port, timeout=self.timeout)
+        return connection, False
+
+    def release(self, key, connection, reusable):
+        if reusable:
+            with self.lock:
+                self.idle_connections.setdefault(key, []).append(connection)
+        self.get_semaphore(key).release()
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self.idle_connections = {}
+
+    def request(self, method, url, headers):
+        """Send a single request without following redirects.
+        Returns a PooledResponse."""
+        parts = urllib.parse.urlsplit(url)
+        if not parts.hostname:
+            raise urllib.error.URLError("No host in url: " + url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        headers = dict(headers)
+        headers.setdefault("User-Agent", "ezdeps")
+        connection, is_reused = self.acquire(key)
+        try:
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException):
+                if not is_reused:
+                    raise
+                # The server closed the idle connection, try a new one.
+                connection.close()
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            self.release(key, connection, False)
+            raise urllib.error.URLError(e)
+        return PooledResponse(self, key, connection, response, url)
+
+    def urlopen(self, url, headers={}, method="GET"):
+        """Like urllib.request.urlopen, follows redirects and raises
+        urllib.error.HTTPError for error statuses."""
+        for _ in range(max_redirects + 1):
+            res = self.request(method, url, headers)
+            if res.status in redirect_codes and res.headers.get("Location"):
+                res.read()
+                res.close()
+                url = urllib.parse.urljoin(url, res.headers["Location"])
+                continue
+            if res.status >= 400:
+                res.read()
+                res.close()
+                raise urllib.error.HTTPError(url, res.status,
+                                             res.response.reason,
+                                             res.headers, None)
+            return res
+        raise urllib.error.URLError("Too many redirects: " + url)
+
+
+def uses_proxy(url):
+    parts = urllib.parse.urlsplit(url)
+    return parts.scheme in urllib.request.getproxies() and \
+        not urllib.request.proxy_bypass(parts.hostname or "")
+
+
+def urlopen(url, headers={}, pool=None, method="GET"):
+    """Open |url| through |pool| if it is a http(s) url that doesn't go
+    through a proxy, otherwise fall back to urllib."""
+    scheme = urllib.parse.urlsplit(url).scheme
+    if pool and scheme in ["http", "https"] and not uses_proxy(url):
+        return pool.urlopen(url, headers, method)
+    request = urllib.request.Request(url, headers=headers, method=method)
+    return urllib.request.urlopen(request)
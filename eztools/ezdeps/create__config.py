@@ -67,6 +67,7 @@ def create__config(dir, commandline_values={}, skip_config=False):
     default < existing value in file < command line
     You can skip loading value from |config_filename|
     (force recreate |config_filename|) by passing True to skip_config
+    Returns dict of variables and their values.
     """
     variables_value = {}
     # First, set variables to their default value
@@ -108,3 +109,4 @@ def create__config(dir, commandline_values={}, skip_config=False):
             if isinstance(value, bool):
                 writebool(f, key, value)
     importlib.invalidate_caches()
+    return variables_value
@@ -0,0 +1,283 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/daemon.py                                                   ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from eztools.ezdeps.action import (action_get_deps, get_download_path,
+                                   set_default_options, tmp_folder_name)
+from eztools.ezdeps.client import (DaemonNotRunningError, get_port_path,
+                                   get_socket_path, send_request)
+from eztools.ezdeps.connection import ConnectionPool
+from eztools.ezdeps.create__config import config_filename, create__config
+from eztools.ezdeps.loader import (DepsGraphCache, DepsLoader,
+                                   deps_graph_file_name)
+from eztools.ezdeps.utils import log
+from eztools.ezdeps.watcher import create_watcher
+
+# Changes that arrive within this many seconds of each other are handled
+# together, editors often write a file several times when saving it.
+settle_seconds = 0.1
+
+
+class DaemonRunningError(Exception):
+    """Raised when a daemon is already running in the current directory."""
+
+
+def get_dep_content(dep):
+    """Deps with the same content don't need to be synced again when DEPS.py
+    files are evaluated again."""
+    return json.dumps({key: value for key, value in dep.items()
+                       if key != "deps_file"}, sort_keys=True)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode("utf-8"))
+            response = self.server.daemon.handle_request(request)
+        except (ValueError, AttributeError) as e:
+            response = {"ok": False, "error": "Invalid request: {}".format(e)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, "UnixStreamServer"):
+    class UnixServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+        daemon_threads = True
+else:
+    UnixServer = None
+
+
+class Daemon:
+    """Keep the deps of DEPS.py in |dir| synced and answer requests of
+    eztools.ezdeps.client, see |handle_request|.
+    The resolved deps, SyncState records (the stat cache of synced files)
+    and the connection pool of |options| stay in memory between syncs.
+    DEPS.py files and _config.py are watched (with inotify or by polling
+    every |poll_interval| seconds), and when one of them changes, DEPS.py
+    files are evaluated again and only deps that are new or changed are
+    synced.
+    If |config_values| is None, _config.py is not used, otherwise it is
+    created again from these command line values when it changes."""
+
+    def __init__(self, dir, options, config_values=None, poll_interval=1.0):
+        self.dir = dir
+        self.options = options
+        set_default_options(options)
+        if options.pool is None:
+            options.pool = ConnectionPool()
+        self.config_values = config_values
+        self.poll_interval = poll_interval
+        self.deps = []
+        self.deps_files = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        # Set when the watched paths changed, the watcher is only used by
+        # the thread of |run|.
+        self.paths_changed = threading.Event()
+        self.syncing = False
+        self.last_sync = None
+        self.last_error = None
+        self.server = None
+        self.watcher = None
+
+    def get_watched_paths(self):
+        paths = list(self.deps_files)
+        if self.config_values is not None:
+            paths.append(config_filename)
+        return paths
+
+    def load(self):
+        """Evaluate _config.py and DEPS.py files again.
+        Returns False if they can't be evaluated, in which case the previous
+        deps are kept."""
+        config = self.options.config
+        try:
+            if self.config_values is not None:
+                config = create__config(".", self.config_values)
+            loader = DepsLoader()
+            deps = loader.load(self.dir)
+        except (Exception, SystemExit) as e:
+            # DEPS.py files are scripts that can raise anything, and
+            # create__config exits on unknown variables.
+            self.last_error = "Cannot load deps: {}".format(e)
+            log(self.last_error)
+            return False
+        self.options.config = config
+        self.deps = deps
+        self.deps_files = loader.deps_files
+        self.last_error = None
+        if config is not None:
+            # So ezdeps runs outside of the daemon don't evaluate them again.
+            DepsGraphCache(os.path.join(tmp_folder_name,
+                                        deps_graph_file_name)).save(
+                self.dir, config, deps, loader.deps_files)
+        return True
+
+    def sync(self, deps=None):
+        """Sync |deps| (default to all deps) and save the state.
+        Returns the result that is also kept in |self.last_sync|."""
+        with self.lock:
+            if deps is None:
+                deps = self.deps
+            self.syncing = True
+            start = time.perf_counter()
+            try:
+                is_synced = action_get_deps(deps, self.options)
+            finally:
+                self.syncing = False
+                self.options.state.save()
+                if self.options.mirrors:
+                    self.options.mirrors.save()
+            self.last_sync = {
+                "ok": is_synced,
+                "deps": len(deps),
+                "seconds": time.perf_counter() - start,
+                "time": time.time()
+            }
+            return self.last_sync
+
+    def reload(self):
+        """Load deps again and sync those that changed."""
+        with self.lock:
+            old_contents = set(get_dep_content(dep) for dep in self.deps)
+            is_loaded = self.load()
+            self.paths_changed.set()
+        if not is_loaded:
+            return {"ok": False, "error": self.last_error}
+        changed_deps = [dep for dep in self.deps
+                        if get_dep_content(dep) not in old_contents]
+        log("Deps were loaded again, {} of {} changed".format(
+            len(changed_deps), len(self.deps)))
+        if not changed_deps:
+            return {"ok": True, "deps": 0, "seconds": 0}
+        return self.sync(changed_deps)
+
+    def get_status(self):
+        state = self.options.state
+        out_of_date = [
+            os.path.join(dep["folder"], dep["file_name"])
+            for dep in self.deps
+            if not state.is_up_to_date(dep, get_download_path(
+                dep["folder"], dep["file_name"]))]
+        return {
+            "ok": not out_of_date and self.last_error is None,
+            "deps": len(self.deps),
+            "deps_files": len(self.deps_files),
+            "out_of_date": out_of_date,
+            "syncing": self.syncing,
+            "last_sync": self.last_sync,
+            "error": self.last_error
+        }
+
+    def handle_request(self, request):
+        """Answer |request| of a client, which looks like
+        {"command": "status" | "sync" | "reload" | "stop"}.
+        - status: deps that are not up to date according to the sync state
+                  (nothing is hashed) and the result of the last sync.
+        - sync: sync all deps, deps that didn't change since the last sync
+                only cost a stat.
+        - reload: evaluate DEPS.py files again and sync deps that changed.
+        - stop: stop the daemon."""
+        command = request.get("command")
+        if command == "status":
+            return self.get_status()
+        elif command == "sync":
+            return self.sync()
+        elif command == "reload":
+            return self.reload()
+        elif command == "stop":
+            self.stopped.set()
+            return {"ok": True}
+        return {"ok": False, "error": "Unknown command: {}".format(command)}
+
+    def check_not_running(self):
+        """Raises DaemonRunningError if a daemon answers requests in the
+        current directory."""
+        try:
+            send_request("status")
+        except DaemonNotRunningError:
+            return
+        raise DaemonRunningError("ezdeps watch is already running in " +
+                                 os.getcwd())
+
+    def start_server(self):
+        """Listen on a Unix socket in |tmp_folder_name|, or on a localhost
+        TCP port written to a file there if Unix sockets are not
+        available."""
+        os.makedirs(tmp_folder_name, exist_ok=True)
+        self.check_not_running()
+        if UnixServer is not None and hasattr(socket, "AF_UNIX"):
+            if os.path.exists(get_socket_path()):
+                # Left by a daemon that was killed.
+                os.remove(get_socket_path())
+            self.server = UnixServer(get_socket_path(), RequestHandler)
+        else:
+            self.server = TCPServer(("127.0.0.1", 0), RequestHandler)
+            with open(get_port_path(), "w") as f:
+                f.write(str(self.server.server_address[1]))
+        self.server.daemon = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop_server(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for path in [get_socket_path(), get_port_path()]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def run(self):
+        """Sync all deps, then answer requests and sync changes until a
+        client sends "stop".
+        Returns True if the first sync succeeded. Raises DaemonRunningError
+        without syncing anything if a daemon already runs here."""
+        # Before syncing, which the running daemon is already doing.
+        self.check_not_running()
+        self.load()
+        try:
+            self.watcher = create_watcher(self.get_watched_paths(),
+                                          self.poll_interval)
+            is_synced = self.sync()["ok"]
+            self.start_server()
+            self.ready.set()
+            log("Watching {} files for changes, waiting for requests".format(
+                len(self.get_watched_paths())))
+            while not self.stopped.is_set():
+                if self.paths_changed.is_set():
+                    self.paths_changed.clear()
+                    self.watcher.set_paths(self.get_watched_paths())
+                changed_paths = self.watcher.wait(self.poll_interval)
+                if not changed_paths:
+                    continue
+                # Wait for the other files of the same change.
+                changed_paths |= self.watcher.wait(settle_seconds)
+                log("Changed: " + ", ".join(sorted(changed_paths)))
+                self.reload()
+        finally:
+            if self.server is not None:
+                self.stop_server()
+            if self.watcher is not None:
+                self.watcher.close()
+        return is_synced
@@ -0,0 +1,199 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/delta.py                                                    ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Delta updates: a new version of a file is rebuilt from chunks of the
+previous version that are still the same plus ranges downloaded from the
+server.
+Files are cut into content-defined chunks: a chunk ends after the first
+|boundary_pattern| found at least |min_chunk_size| bytes after its start, or
+after |max_chunk_size| bytes. Inserting or removing data only changes the
+chunks around the change, and bytes.find() keeps chunking at C speed.
+The chunk index of a file is published next to it (<url>.chunks), create it
+with: python -m eztools.ezdeps.delta FILE..."""
+
+import json
+import mmap
+import os
+import sys
+import urllib.error
+
+from eztools.ezdeps.connection import urlopen
+from eztools.ezdeps.hashing import new_hash
+from eztools.ezdeps.utils import log
+
+chunks_suffix = ".chunks"
+delta_part_suffix = ".delta"
+chunks_version = 1
+# Expected to appear once every 64 KiB in compressed data.
+boundary_pattern = b"\xe7\x5a"
+min_chunk_size = 16 * 1024
+max_chunk_size = 256 * 1024
+
+
+def get_chunks(data, pattern=boundary_pattern, min_size=min_chunk_size,
+               max_size=max_chunk_size):
+    """Returns list of (offset, size) of chunks of |data|."""
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = data.find(pattern, start + min_size, start + max_size)
+        if end == -1:
+            end = min(start + max_size, len(data))
+        else:
+            end += len(pattern)
+        chunks.append((start, end - start))
+        start = end
+    return chunks
+
+
+def read_chunks(path, pattern=boundary_pattern, min_size=min_chunk_size,
+                max_size=max_chunk_size):
+    """Returns list of (offset, size, sha1) of chunks of the file |path|."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunks = []
+            for offset, size in get_chunks(data, pattern, min_size,
+                                           max_size):
+                hash = new_hash("sha1")
+                hash.update(data[offset:offset + size])
+                chunks.append((offset, size, hash.hexdigest()))
+            return chunks
+
+
+def write_chunk_index(path, index_path=None):
+    """Write the chunk index of |path| to |index_path| (default to
+    |path| + |chunks_suffix|)."""
+    content = {
+        "version": chunks_version,
+        "pattern": boundary_pattern.hex(),
+        "min_size": min_chunk_size,
+        "max_size": max_chunk_size,
+        "size": os.path.getsize(path),
+        "chunks": read_chunks(path)
+    }
+    with open(index_path or path + chunks_suffix, "w") as f:
+        json.dump(content, f, separators=(",", ":"))
+
+
+def fetch_chunk_index(url, pool=None):
+    """Returns the chunk index published next to |url| or None."""
+    try:
+        with urlopen(url + chunks_suffix, pool=pool) as res:
+            content = json.loads(res.read().decode("utf-8"))
+        if content["version"] != chunks_version:
+            return None
+        return content
+    except (OSError, ValueError, KeyError, urllib.error.URLError):
+        return None
+
+
+def get_missing_ranges(chunks, local_chunks):
+    """Returns list of (offset, size) of ranges of |chunks| to download,
+    adjacent chunks are merged into one range."""
+    ranges = []
+    for offset, size, sha1 in chunks:
+        if sha1 in local_chunks:
+            continue
+        if ranges and ranges[-1][0] + ranges[-1][1] == offset:
+            ranges[-1] = (ranges[-1][0], ranges[-1][1] + size)
+        else:
+            ranges.append((offset, size))
+    return ranges
+
+
+def copy_range(url, offset, size, f, hash, pool=None, limiter=None):
+    """Download |size| bytes at |offset| of |url| to |f|.
+    Returns False if the server doesn't return exactly this range."""
+    headers = {"Range": "bytes={}-{}".format(offset, offset + size - 1)}
+    with urlopen(url, headers, pool) as res:
+        content_range = res.headers.get("Content-Range", "")
+        if getattr(res, "status", None) != 206 or \
+                not content_range.startswith("bytes {}-".format(offset)):
+            return False
+        remaining = size
+        while remaining:
+            data = res.read(min(remaining, max_chunk_size))
+            if not data:
+                return False
+            if limiter:
+                limiter.consume(len(data))
+            hash.update(data)
+            f.write(data)
+            remaining -= len(data)
+    return True
+
+
+def download_delta(url, save_path, checksum, old_path, pool=None,
+                   algorithm="sha1", limiter=None):
+    """Rebuild the file at |url| in |save_path| from chunks of |old_path|
+    that didn't change and ranges downloaded from |url|, using the chunk
+    index published next to |url|.
+    Returns True if the rebuilt file matches |checksum|, False if it
+    doesn't or there is no chunk index, in which case the whole file has
+    to be downloaded."""
+    index = fetch_chunk_index(url, pool)
+    if index is None:
+        return False
+    part_path = save_path + delta_part_suffix
+    rebuilt = False
+    try:
+        local_chunks = {}
+        for offset, size, sha1 in read_chunks(
+                old_path, bytes.fromhex(index["pattern"]), index["min_size"],
+                index["max_size"]):
+            local_chunks.setdefault(sha1, (offset, size))
+        ranges = get_missing_ranges(index["chunks"], local_chunks)
+        hash = new_hash(algorithm)
+        downloaded_size = 0
+        with open(old_path, "rb") as old_file, open(part_path, "wb") as f:
+            position = 0
+            for offset, size, sha1 in index["chunks"]:
+                if offset < position:
+                    # Part of a range that is already downloaded.
+                    continue
+                if sha1 in local_chunks:
+                    old_file.seek(local_chunks[sha1][0])
+                    data = old_file.read(size)
+                    hash.update(data)
+                    f.write(data)
+                    position = offset + size
+                    continue
+                range_offset, range_size = ranges[0]
+                ranges.pop(0)
+                if not copy_range(url, range_offset, range_size, f, hash,
+                                  pool, limiter):
+                    log('"{}" does not support range requests'.format(url))
+                    break
+                downloaded_size += range_size
+                position = range_offset + range_size
+            else:
+                rebuilt = True
+        if rebuilt and hash.hexdigest().lower() != checksum.lower():
+            log('File rebuilt from "{}" does not match {} {}'.format(
+                url, algorithm, checksum))
+            rebuilt = False
+        if rebuilt:
+            os.replace(part_path, save_path)
+    except (OSError, ValueError, KeyError, IndexError,
+            urllib.error.URLError):
+        rebuilt = False
+    if not rebuilt:
+        # The part is closed here, Windows can't remove open files.
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return False
+    log('Downloaded {} of {} bytes of "{}", reused the rest from "{}"'.format(
+        downloaded_size, index["size"], url, old_path))
+    return True
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        write_chunk_index(path)
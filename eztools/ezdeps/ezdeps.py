@@ -7,12 +7,28 @@
 ##----------------------------------------------------------------------------##
 
 import argparse
+import os
 
-from eztools.ezdeps.action import run_action
+from eztools.ezdeps.action import SyncOptions, run_action, tmp_folder_name
+from eztools.ezdeps.cache import (DownloadCache, cache_env_name,
+                                  cache_size_env_name, default_cache_size,
+                                  get_default_cache_dir, parse_size)
+from eztools.ezdeps.connection import (ConnectionPool,
+                                       default_max_connections_per_host)
 from eztools.ezdeps.create__config import create__config
+from eztools.ezdeps.daemon import Daemon, DaemonRunningError
+from eztools.ezdeps.loader import DepsCycleError
+from eztools.ezdeps.lockfile import LockFileError, lock_file_name
+from eztools.ezdeps.mirrors import (MirrorSelector, mirror_stats_file_name,
+                                    mirrors_env_name, read_mirrors_config)
+from eztools.ezdeps.scheduler import BandwidthLimiter
+from eztools.ezdeps.stamp import depfile_suffix
+from eztools.ezdeps.trace import start_tracing, stop_tracing
 
 
 def ezdeps(args):
+    """Run ezdeps with command line |args|.
+    Returns True if the action succeeded."""
     parser = argparse.ArgumentParser(description="Binaries management tool.")
     parser.add_argument(
         "-d",
@@ -51,13 +67,180 @@ def ezdeps(args):
         default=False,
         help="Target architecture (default to current architecture)")
     parser.add_argument(
-        "action", choices=["sync", "clean"], default="sync", nargs='?')
+        "--reload-deps",
+        action="store_true",
+        default=False,
+        help="Execute all DEPS.py files instead of using deps saved by the"
+        " last run")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        default=1,
+        help="Number of deps to sync in parallel (default to 1)",
+        type=int)
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        default=False,
+        help="Extract archives while they are being downloaded (except"
+        " zip archives)")
+    parser.add_argument(
+        "--keep-archive",
+        action="store_true",
+        default=False,
+        help="Save downloaded archives to {} in pipeline mode".format(
+            tmp_folder_name))
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        default=False,
+        help="When a file changes, download only the parts that are not in"
+        " its previous version if the server publishes a chunk index")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="Only write files that changed when an archive is extracted"
+        " again and delete files that are not in the new archive")
+    parser.add_argument(
+        "--compare-content",
+        action="store_true",
+        default=False,
+        help="With --incremental, compare content of files instead of"
+        " their modification time")
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        default=bool(os.environ.get(cache_env_name)),
+        help="Share downloaded files with other workspaces through a cache"
+        " in ${} or ~/.cache/ezdeps (default to on if ${} is set)".format(
+            cache_env_name, cache_env_name))
+    parser.add_argument(
+        "--cache-size",
+        default=os.environ.get(cache_size_env_name, str(default_cache_size)),
+        help="Maximum size of the cache, e.g. 500M or 10G"
+        " (default to ${} or 10G)".format(cache_size_env_name),
+        type=parse_size)
+    parser.add_argument(
+        "--max-rate",
+        default=None,
+        help="Maximum total download rate in bytes per second, e.g. 500K or"
+        " 10M (default to no limit)",
+        type=parse_size)
+    parser.add_argument(
+        "--mirrors",
+        default=os.environ.get(mirrors_env_name, ""),
+        help="JSON file with url rewrite rules that add mirrors to deps"
+        " (default to ${})".format(mirrors_env_name),
+        type=str)
+    parser.add_argument(
+        "--max-connections-per-host",
+        default=default_max_connections_per_host,
+        help="Maximum number of connections opened to the same host"
+        " (default to {})".format(default_max_connections_per_host),
+        type=int)
+    parser.add_argument(
+        "--trace",
+        default="",
+        help="Save a trace of where the time is spent to this file, in"
+        " Chrome trace event format (open in chrome://tracing or Perfetto)",
+        type=str)
+    parser.add_argument(
+        "--lock-file",
+        default=None,
+        help="Lock file written by the lock action and read with"
+        " --from-lock (default to {} in --dir)".format(lock_file_name),
+        type=str)
+    parser.add_argument(
+        "--from-lock",
+        action="store_true",
+        default=False,
+        help="Read deps from the lock file instead of DEPS.py files")
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        default=False,
+        help="With verify and repair, only compare size and modification"
+        " time of extracted files instead of their content")
+    parser.add_argument(
+        "--poll-interval",
+        default=1.0,
+        help="With watch, seconds between checks of DEPS.py files where"
+        " inotify is not available (default to 1)",
+        type=float)
+    parser.add_argument(
+        "--stamp",
+        default=None,
+        help="With sync, write this stamp file and a Ninja depfile next to"
+        " it so a build runs ezdeps only when DEPS.py files or synced files"
+        " change. The stamp is only rewritten when the sync changed"
+        " something",
+        type=str)
+    parser.add_argument(
+        "--depfile",
+        default=None,
+        help="Path of the depfile of --stamp (default to the stamp path"
+        " followed by {})".format(depfile_suffix),
+        type=str)
+    parser.add_argument(
+        "action",
+        choices=["sync", "clean", "lock", "verify", "repair", "watch"],
+        default="sync",
+        nargs='?')
     parsed_args = parser.parse_args(args)
-    create__config(
-        ".", {
-            "host_platform": parsed_args.host_platform,
-            "host_arch": parsed_args.host_arch,
-            "target_platform": parsed_args.target_platform,
-            "target_arch": parsed_args.target_arch
-        }, parsed_args.skip_config)
-    run_action(parsed_args.action, parsed_args.dir)
+    if parsed_args.action == "watch" and parsed_args.from_lock:
+        print("watch reads DEPS.py files, it can't be used with --from-lock")
+        return False
+    config = None
+    config_values = {
+        "host_platform": parsed_args.host_platform,
+        "host_arch": parsed_args.host_arch,
+        "target_platform": parsed_args.target_platform,
+        "target_arch": parsed_args.target_arch
+    }
+    if not parsed_args.from_lock:
+        config = create__config(".", config_values, parsed_args.skip_config)
+    options = SyncOptions(
+        jobs=parsed_args.jobs,
+        pipeline=parsed_args.pipeline,
+        keep_archive=parsed_args.keep_archive,
+        incremental=parsed_args.incremental,
+        delta=parsed_args.delta,
+        compare_content=parsed_args.compare_content,
+        limiter=BandwidthLimiter(parsed_args.max_rate),
+        pool=ConnectionPool(parsed_args.max_connections_per_host),
+        config=config,
+        reload_deps=parsed_args.reload_deps,
+        lock_file=parsed_args.lock_file,
+        from_lock=parsed_args.from_lock,
+        fast=parsed_args.fast,
+        stamp=parsed_args.stamp,
+        depfile=parsed_args.depfile)
+    rules = []
+    if parsed_args.mirrors:
+        try:
+            rules = read_mirrors_config(parsed_args.mirrors)
+        except (OSError, ValueError, KeyError) as e:
+            print("Cannot read mirrors from {}: {}".format(
+                parsed_args.mirrors, e))
+            return False
+    options.mirrors = MirrorSelector(
+        rules, os.path.join(tmp_folder_name, mirror_stats_file_name)).load()
+    if parsed_args.cache:
+        options.cache = DownloadCache(get_default_cache_dir(),
+                                      parsed_args.cache_size)
+    if parsed_args.trace:
+        start_tracing()
+    try:
+        if parsed_args.action == "watch":
+            daemon = Daemon(parsed_args.dir, options, config_values,
+                            parsed_args.poll_interval)
+            return daemon.run()
+        return run_action(parsed_args.action, parsed_args.dir, options)
+    except (DepsCycleError, LockFileError, DaemonRunningError) as e:
+        print(e)
+        return False
+    finally:
+        options.pool.close()
+        if parsed_args.trace:
+            stop_tracing(parsed_args.trace)
@@ -0,0 +1,87 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/hashing.py                                                  ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import concurrent.futures
+import hashlib
+import os
+
+from eztools.ezdeps.trace import add_args, traced
+
+# Hash algorithms a dep can declare, from the most to the least preferred
+# when a dep declares more than one.
+supported_algorithms = ["blake2b", "sha256", "sha1"]
+# Files are read into a reusable buffer of this size so hashing doesn't
+# allocate a new bytes object for every chunk.
+hash_buffer_size = 1024 * 1024
+
+
+def new_hash(algorithm):
+    if algorithm not in supported_algorithms:
+        raise ValueError("Unsupported hash algorithm: " + algorithm)
+    return hashlib.new(algorithm)
+
+
+def get_dep_checksum(dep):
+    """Returns (checksum, algorithm) declared by |dep|, for example
+    ("e3b0c4...", "sha256") for a dep that has "sha256": "e3b0c4..."."""
+    for algorithm in supported_algorithms:
+        if algorithm in dep:
+            return dep[algorithm].lower(), algorithm
+    raise KeyError("Dep {} has none of these hashes: {}".format(
+        dep.get("file_name"), ", ".join(supported_algorithms)))
+
+
+def update_hash_from_file(hash, path):
+    """Feed content of |path| to |hash|.
+    Returns number of bytes read."""
+    size = 0
+    buffer = bytearray(hash_buffer_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        for read_size in iter(lambda: f.readinto(buffer), 0):
+            hash.update(view[:read_size])
+            size += read_size
+    return size
+
+
+@traced("hash_file")
+def hash_file(path, algorithm="sha1"):
+    """Returns hex digest of |path| or "" if |path| is not a file."""
+    if not os.path.isfile(path):
+        return ""
+    if hasattr(hashlib, "file_digest"):
+        # Python 3.11+ hashes straight from the file descriptor.
+        with open(path, "rb", buffering=0) as f:
+            add_args(path=path, algorithm=algorithm,
+                     bytes=os.fstat(f.fileno()).st_size)
+            return hashlib.file_digest(
+                f, lambda: new_hash(algorithm)).hexdigest().lower()
+    hash = new_hash(algorithm)
+    add_args(path=path, algorithm=algorithm,
+             bytes=update_hash_from_file(hash, path))
+    return hash.hexdigest().lower()
+
+
+def verify_file(path, checksum, algorithm="sha1"):
+    return hash_file(path, algorithm) == checksum.lower()
+
+
+def hash_files(files, jobs=None):
+    """Hash many files at once. hashlib releases the GIL while hashing so
+    files are hashed in parallel on up to |jobs| threads (default to the
+    number of CPUs).
+    Args:
+        files: list of (path, algorithm)
+    Returns:
+        List of hex digests in the same order as |files|."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs <= 1 or len(files) <= 1:
+        return [hash_file(path, algorithm) for path, algorithm in files]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(lambda file: hash_file(*file), files))
@@ -0,0 +1,230 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/loader.py                                                   ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import importlib
+import json
+import os
+import sys
+
+from eztools.ezdeps.create__config import (config_filename,
+                                           config_module_name)
+from eztools.ezdeps.hashing import get_dep_checksum, hash_file
+from eztools.ezdeps.utils import load_module_from_source, log
+
+deps_file_name = "DEPS.py"
+deps_graph_file_name = "deps_graph.json"
+deps_graph_version = 1
+
+
+class DepsCycleError(Exception):
+    """Raised when DEPS.py files link to each other in a cycle."""
+
+
+def get_dep_key(dep):
+    """Deps with the same key are the same dep declared more than once."""
+    checksum, algorithm = get_dep_checksum(dep)
+    return (os.path.normcase(os.path.abspath(dep["folder"])),
+            dep["file_name"], algorithm, checksum)
+
+
+def reload_config_module():
+    """DEPS.py files `import _config`, which Python only does once per
+    process. Replace the module imported by an earlier evaluation with the
+    current content of |config_filename| in the current folder, where
+    create__config writes it, read from source because its bytecode cache
+    is only checked to the second."""
+    sys.modules.pop(config_module_name, None)
+    importlib.invalidate_caches()
+    if os.path.isfile(config_filename):
+        sys.modules[config_module_name] = load_module_from_source(
+            config_module_name, config_filename)
+
+
+class DepsLoader:
+    """Load the graph of DEPS.py files.
+    Each DEPS.py is a python script but there are some important variables:
+    - links: path to relative directories to the current DEPS.py file directory
+             that contains other DEPS.py files.
+    - deps: list of dependencies which are objects like this
+            {
+                "file_name": "file_name",
+                "folder": "save or extract location which is relative to DEPS.py",
+                "url": "download url",
+                "sha1": "sha1 of the file",
+                (or "sha256" or "blake2b" instead of "sha1")
+            }
+    Every DEPS.py file is evaluated once even if it is linked many times, and
+    a dep declared by more than one DEPS.py (same folder, file name and hash)
+    is only returned once.
+    After |load|, |deps_files| lists paths of all evaluated DEPS.py files."""
+
+    def __init__(self):
+        self.deps = []
+        self.deps_files = []
+        self.loaded = set()
+        self.stack = []
+        self.dep_keys = set()
+        self.dep_locations = {}
+
+    def load(self, relpath_to_toplevel):
+        """Returns list of deps of DEPS.py in |relpath_to_toplevel| and all
+        DEPS.py files linked from it, linked deps first."""
+        reload_config_module()
+        self.load_deps_file(relpath_to_toplevel)
+        return self.deps
+
+    def load_deps_file(self, relpath_to_toplevel):
+        deps_path = os.path.join(relpath_to_toplevel, deps_file_name)
+        key = os.path.normcase(os.path.realpath(deps_path))
+        if key in self.stack:
+            cycle = self.stack[self.stack.index(key):] + [key]
+            raise DepsCycleError("DEPS files link to each other: " +
+                                 " -> ".join(cycle))
+        if key in self.loaded:
+            return
+        self.stack.append(key)
+        deps = load_module_from_source(deps_path, deps_path)
+        if hasattr(deps, "links"):
+            for link in deps.links:
+                self.load_deps_file(os.path.join(relpath_to_toplevel, link))
+        if hasattr(deps, "deps"):
+            for dep in deps.deps:
+                dep["folder"] = os.path.join(relpath_to_toplevel,
+                                             dep["folder"])
+                dep["deps_file"] = deps_path
+                self.add_dep(dep)
+        self.stack.pop()
+        self.loaded.add(key)
+        self.deps_files.append(deps_path)
+
+    def add_dep(self, dep):
+        dep_key = get_dep_key(dep)
+        if dep_key in self.dep_keys:
+            return
+        location = dep_key[:2]
+        if location in self.dep_locations:
+            log('Warning: "{}" is declared with different hashes in "{}"'
+                ' and "{}"'.format(
+                    os.path.join(dep["folder"], dep["file_name"]),
+                    self.dep_locations[location]["deps_file"],
+                    dep["deps_file"]))
+        else:
+            self.dep_locations[location] = dep
+        self.dep_keys.add(dep_key)
+        self.deps.append(dep)
+
+
+def get_deps_file_record(path):
+    """Returns what is needed to tell whether DEPS.py in |path| has changed,
+    or None if it doesn't exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {
+        "path": path,
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha1": hash_file(path)
+    }
+
+
+def is_deps_file_unchanged(record):
+    """A file whose size and mtime are unchanged is not hashed again. If
+    only the mtime changed (e.g. after a checkout), the sha1 decides."""
+    try:
+        st = os.stat(record["path"])
+    except OSError:
+        return False
+    if st.st_size != record["size"]:
+        return False
+    if st.st_mtime_ns == record["mtime_ns"]:
+        return True
+    return hash_file(record["path"]) == record["sha1"]
+
+
+class DepsGraphCache:
+    """Deps resolved by DepsLoader saved to |path| so later runs don't have
+    to execute any DEPS.py. The content looks like this
+    {
+        "version": deps_graph_version,
+        "dir": "absolute path of the top level directory",
+        "config": {values of variables in _config.py},
+        "deps_files": [{"path", "size", "mtime_ns", "sha1"}],
+        "deps": [deps returned by DepsLoader.load],
+    }
+    The saved deps are only used if they were resolved from the same
+    directory with the same config values and no DEPS.py has changed.
+    DEPS.py files that read other files or environment variables are not
+    tracked, use --reload-deps after changing those."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, relpath_to_toplevel, config, deps_files=None):
+        """Returns the saved deps or None if they are out of date.
+        If |deps_files| is given, it is extended with paths of the DEPS.py
+        files the saved deps were resolved from."""
+        try:
+            with open(self.path, "r") as f:
+                content = json.load(f)
+            if content["version"] != deps_graph_version or \
+                    content["dir"] != os.path.abspath(relpath_to_toplevel) or \
+                    content["config"] != config:
+                return None
+            for record in content["deps_files"]:
+                if not is_deps_file_unchanged(record):
+                    return None
+            if deps_files is not None:
+                deps_files.extend(record["path"]
+                                  for record in content["deps_files"])
+            return content["deps"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save(self, relpath_to_toplevel, config, deps, deps_files):
+        records = [get_deps_file_record(path) for path in deps_files]
+        if None in records:
+            return
+        content = {
+            "version": deps_graph_version,
+            "dir": os.path.abspath(relpath_to_toplevel),
+            "config": config,
+            "deps_files": records,
+            "deps": deps
+        }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                        exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(content, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError, ValueError):
+            # Deps that are not JSON serializable are just not cached.
+            log("Warning: Can't save resolved deps to " + self.path)
+
+
+def load_deps_cached(relpath_to_toplevel, config, cache_path, reload=False,
+                     deps_files=None):
+    """Like DepsLoader.load but reuse deps saved in |cache_path| if none of
+    DEPS.py files and |config| have changed since they were saved.
+    If |deps_files| is given, it is extended with paths of all DEPS.py files
+    the deps come from.
+    Returns list of deps."""
+    graph_cache = DepsGraphCache(cache_path)
+    if not reload:
+        deps = graph_cache.load(relpath_to_toplevel, config, deps_files)
+        if deps is not None:
+            return deps
+    loader = DepsLoader()
+    deps = loader.load(relpath_to_toplevel)
+    graph_cache.save(relpath_to_toplevel, config, deps, loader.deps_files)
+    if deps_files is not None:
+        deps_files.extend(loader.deps_files)
+    return deps
@@ -0,0 +1,89 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/lock.py                                                     ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import os
+import sys
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """Exclusive lock on |path| that works across processes and threads.
+    The lock file is created if it doesn't exist and is never deleted, so
+    processes always agree on which file they lock."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self, blocking=True):
+        """Returns True if the lock is acquired. If |blocking| is False,
+        returns False instead of waiting when the lock is held by someone
+        else."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            if sys.platform == "win32":
+                mode = msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK
+                while True:
+                    try:
+                        msvcrt.locking(fd, mode, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK only retries for 10 seconds.
+                        if not blocking:
+                            raise
+            else:
+                flags = fcntl.LOCK_EX
+                if not blocking:
+                    flags |= fcntl.LOCK_NB
+                fcntl.flock(fd, flags)
+        except OSError:
+            os.close(fd)
+            if blocking:
+                raise
+            return False
+        self.fd = fd
+        return True
+
+    def read(self):
+        """Returns content of the lock file. The lock must be held."""
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        chunks = []
+        for chunk in iter(lambda: os.read(self.fd, 65536), b""):
+            chunks.append(chunk)
+        return b"".join(chunks).decode("utf-8", "replace")
+
+    def write(self, text):
+        """Replace content of the lock file, e.g. to tell the next owner
+        what was done. The lock must be held."""
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.ftruncate(self.fd, 0)
+        os.write(self.fd, text.encode("utf-8"))
+
+    def release(self):
+        if self.fd is None:
+            return
+        if sys.platform == "win32":
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
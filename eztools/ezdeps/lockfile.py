@@ -0,0 +1,76 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/lockfile.py                                                 ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import json
+import os
+
+lock_file_name = "DEPS.lock.json"
+lock_file_version = 1
+
+
+class LockFileError(Exception):
+    """Raised when a lock file can't be read."""
+
+
+def write_lock_file(path, deps, config=None):
+    """Write |deps| resolved from DEPS.py files to |path|.
+    The lock file looks like this
+    {
+        "version": lock_file_version,
+        "config": {values of variables in _config.py used to resolve deps},
+        "deps": [
+            {
+                "file_name": "file_name",
+                "folder": "folder relative to the lock file directory",
+                "url": "download url",
+                "sha1": "sha1 of the file",
+                "size": size of the file if it is known
+            }
+        ]
+    }
+    Folders are relative to the lock file so it can be used from any
+    checkout. Keys are sorted and deps keep their order so the same deps
+    always give the same file."""
+    lock_dir = os.path.dirname(os.path.abspath(path))
+    locked_deps = []
+    for dep in deps:
+        locked_dep = {key: value for key, value in dep.items()
+                      if key != "deps_file"}
+        folder = os.path.relpath(os.path.abspath(dep["folder"]), lock_dir)
+        locked_dep["folder"] = folder.replace(os.sep, "/")
+        locked_deps.append(locked_dep)
+    content = {
+        "version": lock_file_version,
+        "config": config or {},
+        "deps": locked_deps
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="\n") as f:
+        json.dump(content, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def read_lock_file(path):
+    """Returns deps in the lock file |path|, with folders relative to the
+    current directory like deps returned by DepsLoader."""
+    try:
+        with open(path, "r") as f:
+            content = json.load(f)
+    except (OSError, ValueError) as e:
+        raise LockFileError("Cannot read lock file {}: {}".format(path, e))
+    if not isinstance(content, dict) or \
+            content.get("version") != lock_file_version:
+        raise LockFileError("Unsupported lock file: " + path)
+    lock_dir = os.path.dirname(path)
+    deps = content["deps"]
+    for dep in deps:
+        dep["folder"] = os.path.join(lock_dir,
+                                     dep["folder"].replace("/", os.sep))
+        dep["deps_file"] = path
+    return deps
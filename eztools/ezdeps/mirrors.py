@@ -0,0 +1,179 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/mirrors.py                                                  ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from eztools.ezdeps.connection import urlopen
+
+mirrors_env_name = "EZDEPS_MIRRORS"
+mirror_stats_file_name = "mirror_stats.json"
+# Mirrors are ranked by how long they would take to download a file of this
+# size.
+reference_size = 8 * 1024 * 1024
+# Throughput assumed for mirrors nothing was downloaded from yet.
+default_throughput = 10 * 1024 * 1024
+# Weight of the newest measurement in the moving averages.
+smoothing = 0.3
+
+
+def get_origin(url):
+    """Mirrors are measured per origin: scheme and host, or "file" for
+    local files."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme == "file":
+        return "file"
+    return "{}://{}".format(parts.scheme, parts.netloc)
+
+
+def read_mirrors_config(path):
+    """Returns rewrite rules in the JSON file in |path| which looks like this
+    {
+        "rewrites": [
+            {
+                "from": "https://github.com/",
+                "to": ["file:///mnt/artifacts/github/",
+                       "https://mirror.example.com/github/"]
+            }
+        ]
+    }
+    A url that starts with "from" can also be downloaded from the same url
+    with "from" replaced by each of "to"."""
+    with open(path, "r") as f:
+        content = json.load(f)
+    rules = []
+    for rule in content.get("rewrites", []):
+        targets = rule["to"]
+        if isinstance(targets, str):
+            targets = [targets]
+        rules.append((rule["from"], list(targets)))
+    return rules
+
+
+def moving_average(old, new):
+    if old is None:
+        return new
+    return old + smoothing * (new - old)
+
+
+class MirrorSelector:
+    """Choose where to download a dep from.
+    Urls of a dep are its "url", the urls in its optional "mirrors" list and
+    the urls produced by rewrite |rules|. They are tried from the fastest to
+    the slowest mirror, based on the latency and throughput measured by
+    previous downloads (saved in |stats_path|) and on HEAD requests sent to
+    mirrors that were never measured. If a download fails, the next mirror
+    is tried."""
+
+    def __init__(self, rules=None, stats_path=None):
+        self.rules = rules if rules is not None else []
+        self.stats_path = stats_path
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Load measurements of previous syncs from |self.stats_path|."""
+        try:
+            with open(self.stats_path, "r") as f:
+                self.stats = json.load(f)
+        except (OSError, TypeError, ValueError):
+            self.stats = {}
+        return self
+
+    def save(self):
+        if not self.stats_path:
+            return
+        with self.lock:
+            content = json.dumps(self.stats, indent=1, sort_keys=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.stats_path)),
+                    exist_ok=True)
+        tmp_path = "{}.{}.tmp".format(self.stats_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, self.stats_path)
+
+    def get_urls(self, dep):
+        """Returns all urls of |dep| in the configured order: rewritten urls
+        first, then "mirrors" of the dep, then its "url"."""
+        urls = []
+        for url in [dep["url"]] + list(dep.get("mirrors", [])):
+            for prefix, targets in self.rules:
+                if url.startswith(prefix):
+                    urls.extend(target + url[len(prefix):]
+                                for target in targets)
+        urls.extend(dep.get("mirrors", []))
+        urls.append(dep["url"])
+        return list(dict.fromkeys(urls))
+
+    def get_stats(self, url):
+        with self.lock:
+            return dict(self.stats.get(get_origin(url), {}))
+
+    def record(self, url, seconds, size=None):
+        """Record a successful download of |size| bytes in |seconds|."""
+        with self.lock:
+            stats = self.stats.setdefault(get_origin(url), {})
+            stats["failures"] = 0
+            if size:
+                stats["throughput"] = moving_average(
+                    stats.get("throughput"), size / max(seconds, 1e-6))
+
+    def record_latency(self, url, seconds):
+        with self.lock:
+            stats = self.stats.setdefault(get_origin(url), {})
+            stats["latency"] = moving_average(stats.get("latency"), seconds)
+
+    def record_failure(self, url):
+        with self.lock:
+            stats = self.stats.setdefault(get_origin(url), {})
+            stats["failures"] = stats.get("failures", 0) + 1
+
+    def probe(self, url, pool=None):
+        """Measure the latency of |url| with a HEAD request.
+        Returns False if |url| can't be downloaded."""
+        start = time.perf_counter()
+        try:
+            if urllib.parse.urlsplit(url).scheme == "file":
+                if not os.path.isfile(urllib.request.url2pathname(
+                        urllib.parse.urlsplit(url).path)):
+                    return False
+            else:
+                with urlopen(url, pool=pool, method="HEAD") as res:
+                    res.read()
+        except (OSError, urllib.error.URLError):
+            self.record_failure(url)
+            return False
+        self.record_latency(url, time.perf_counter() - start)
+        return True
+
+    def get_estimated_seconds(self, url):
+        stats = self.get_stats(url)
+        latency = stats.get("latency") or 0
+        throughput = stats.get("throughput") or default_throughput
+        return latency + reference_size / throughput
+
+    def rank(self, urls, pool=None):
+        """Returns |urls| from the best to the worst. Mirrors without a
+        latency measurement are probed first. Mirrors that failed recently
+        and urls that don't exist go last, ties keep the configured
+        order."""
+        if len(urls) <= 1:
+            return list(urls)
+        missing_urls = set()
+        for url in urls:
+            if "latency" not in self.get_stats(url):
+                if not self.probe(url, pool):
+                    missing_urls.add(url)
+        return sorted(urls, key=lambda url: (
+            url in missing_urls, self.get_stats(url).get("failures", 0),
+            self.get_estimated_seconds(url)))
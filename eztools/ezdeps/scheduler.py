@@ -0,0 +1,149 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/scheduler.py                                                ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import collections
+import os
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from eztools.ezdeps.connection import urlopen
+
+
+def probe_size(url, pool=None):
+    """Returns size of the file at |url| from a HEAD request, or None if it
+    is unknown."""
+    try:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == "file":
+            return os.path.getsize(urllib.request.url2pathname(parts.path))
+        with urlopen(url, pool=pool, method="HEAD") as res:
+            res.read()
+            length = res.headers.get("Content-Length")
+        return int(length) if length else None
+    except (OSError, ValueError, urllib.error.URLError):
+        return None
+
+
+class BandwidthLimiter:
+    """Token bucket shared by all downloads that keeps the total download
+    rate under |max_rate| bytes per second (no limit if it is None). It also
+    counts the downloaded bytes."""
+
+    def __init__(self, max_rate=None):
+        self.max_rate = max_rate
+        self.lock = threading.Lock()
+        # Allow bursts of one second worth of data.
+        self.tokens = max_rate or 0
+        self.last_time = time.perf_counter()
+        self.start_time = self.last_time
+        self.total = 0
+
+    def consume(self, size):
+        """Account for |size| downloaded bytes, sleeps if they come faster
+        than |self.max_rate|."""
+        with self.lock:
+            self.total += size
+            if not self.max_rate:
+                return
+            now = time.perf_counter()
+            self.tokens = min(self.max_rate, self.tokens +
+                              (now - self.last_time) * self.max_rate)
+            self.last_time = now
+            self.tokens -= size
+            delay = -self.tokens / self.max_rate if self.tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+    def get_throughput(self):
+        """Returns average bytes per second since the limiter was created."""
+        elapsed = time.perf_counter() - self.start_time
+        return self.total / elapsed if elapsed > 0 else 0
+
+
+class Scheduler:
+    """Run tasks on |jobs| threads, the largest first so big downloads don't
+    end up alone at the end, with at most |max_per_host| tasks of the same
+    host running at the same time.
+    After |run|, |stats| has these queue statistics:
+    - tasks: number of tasks.
+    - average_wait, max_wait: seconds tasks spent in the queue.
+    - host_waits: times a worker had to wait because all queued tasks were
+                  for hosts that were already busy.
+    - seconds: wall time of the whole run."""
+
+    def __init__(self, jobs, max_per_host):
+        self.jobs = max(jobs, 1)
+        self.max_per_host = max(max_per_host, 1)
+        self.stats = {}
+
+    def run(self, tasks):
+        """Args:
+            tasks: list of (host, size, function), size can be None if it is
+                   unknown.
+        Returns:
+            List of values returned by the functions, in the order of
+            |tasks|. The first exception raised by a function is raised
+            again once all other tasks are done."""
+        condition = threading.Condition()
+        # Stable sort so tasks of the same size keep their order.
+        pending = sorted(range(len(tasks)),
+                         key=lambda i: -(tasks[i][1] or 0))
+        running = collections.Counter()
+        results = [None] * len(tasks)
+        waits = []
+        errors = []
+        host_waits = [0]
+        start_time = time.perf_counter()
+
+        def get_next_task():
+            with condition:
+                while pending:
+                    for index in pending:
+                        if running[tasks[index][0]] < self.max_per_host:
+                            pending.remove(index)
+                            running[tasks[index][0]] += 1
+                            waits.append(time.perf_counter() - start_time)
+                            return index
+                    host_waits[0] += 1
+                    condition.wait()
+                return None
+
+        def work():
+            while True:
+                index = get_next_task()
+                if index is None:
+                    return
+                host, _, function = tasks[index]
+                try:
+                    results[index] = function()
+                except BaseException as e:
+                    errors.append(e)
+                finally:
+                    with condition:
+                        running[host] -= 1
+                        condition.notify_all()
+
+        threads = [threading.Thread(target=work)
+                   for _ in range(min(self.jobs, len(tasks)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stats = {
+            "tasks": len(tasks),
+            "average_wait": sum(waits) / len(waits) if waits else 0,
+            "max_wait": max(waits) if waits else 0,
+            "host_waits": host_waits[0],
+            "seconds": time.perf_counter() - start_time
+        }
+        if errors:
+            raise errors[0]
+        return results
@@ -0,0 +1,79 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/stamp.py                                                    ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Stamp files and Ninja depfiles so a build can run ezdeps only when it has
+something to do. With this GN action (or the same Ninja rule with
+`restat = 1`), ninja runs the sync again only when a DEPS.py file,
+_config.py or a synced file listed in the depfile changes, and the stamp is
+only rewritten when the sync changed something, so targets that depend on
+it are not rebuilt after a sync that did nothing:
+
+    action("sync_deps") {
+      script = "//eztools.py"
+      args = [ "--tool", "ezdeps", "--dir", rebase_path("//", root_build_dir),
+               "--stamp", "deps.stamp", "sync" ]
+      outputs = [ "$root_build_dir/deps.stamp" ]
+      depfile = "$root_build_dir/deps.stamp.d"
+    }"""
+
+import os
+
+# Suffix of the depfile of a stamp if none is given.
+depfile_suffix = ".d"
+
+
+def escape_depfile_path(path):
+    """Escape |path| the way Ninja reads paths in depfiles."""
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def get_depfile_content(target, inputs):
+    lines = [escape_depfile_path(target) + ":"]
+    lines.extend("  " + escape_depfile_path(path) for path in inputs)
+    return " \\\n".join(lines) + "\n"
+
+
+def write_if_changed(path, content):
+    """Write |content| to |path| unless it already has this content, so its
+    mtime only changes with its content.
+    Returns True if the file was written."""
+    try:
+        with open(path, "r") as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+
+def write_stamp(stamp_path, content, inputs, depfile_path=None,
+                touch=False):
+    """Write |content| to |stamp_path| if it changed, or update its mtime if
+    |touch| is True, and write the depfile that says the stamp depends on
+    |inputs| to |depfile_path| (default to |stamp_path| + |depfile_suffix|).
+    Returns True if the stamp changed."""
+    if depfile_path is None:
+        depfile_path = stamp_path + depfile_suffix
+    write_if_changed(depfile_path, get_depfile_content(stamp_path, inputs))
+    if write_if_changed(stamp_path, content):
+        return True
+    if touch:
+        os.utime(stamp_path, None)
+    return touch
+
+
+def remove_stamp(stamp_path):
+    """Remove |stamp_path| so the next build runs the sync again."""
+    if os.path.isfile(stamp_path):
+        os.remove(stamp_path)
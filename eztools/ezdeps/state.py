@@ -0,0 +1,173 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/state.py                                                    ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import json
+import os
+import threading
+
+from eztools.ezdeps.hashing import get_dep_checksum
+from eztools.ezdeps.lock import FileLock
+
+state_file_name = "state.json"
+state_version = 2
+
+
+def get_state_key(dep):
+    """Deps are identified by where they are saved or extracted."""
+    return os.path.normcase(
+        os.path.abspath(os.path.join(dep["folder"], dep["file_name"])))
+
+
+def stat_file(path):
+    """Returns (size, mtime_ns, inode) of |path| or None if it doesn't
+    exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class SyncState:
+    """Records of deps that were synced successfully in a workspace.
+    Each record looks like this
+    {
+        "url": "download url",
+        "checksum": "hash of the file",
+        "algorithm": "hash algorithm used for checksum",
+        "size": size of the downloaded file,
+        "mtime_ns": modification time of the downloaded file,
+        "inode": inode of the downloaded file,
+        "paths": ["paths extracted from the file relative to its folder"],
+    }
+    size, mtime_ns and inode are None if the file is not kept on disk (for
+    archives extracted in pipeline mode).
+    A dep whose record still matches the file on disk doesn't need to be
+    hashed or extracted again.
+    Several processes can sync the same workspace: |save| only writes the
+    records changed by this process on top of what is in the file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self.lock = threading.Lock()
+        self.changed_keys = set()
+
+    @property
+    def is_dirty(self):
+        return bool(self.changed_keys)
+
+    def read_records(self):
+        """Returns records saved in |self.path|. A missing or unreadable
+        state file is treated as empty."""
+        try:
+            with open(self.path, "r") as f:
+                content = json.load(f)
+            if content.get("version") == state_version:
+                return content["deps"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        return {}
+
+    def load(self):
+        """Load records from |self.path|."""
+        self.records = self.read_records()
+        return self
+
+    def save(self):
+        if not self.is_dirty:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        with FileLock(self.path + ".lock"), self.lock:
+            records = self.read_records()
+            for key in self.changed_keys:
+                if key in self.records:
+                    records[key] = self.records[key]
+                else:
+                    records.pop(key, None)
+            content = {"version": state_version, "deps": records}
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump(content, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+            self.records = records
+            self.changed_keys = set()
+
+    def get_record(self, dep):
+        with self.lock:
+            return self.records.get(get_state_key(dep))
+
+    def is_up_to_date(self, dep, download_path):
+        """Returns True if |dep| was synced with the same url and hash, the
+        downloaded file has not changed since and all extracted paths still
+        exist."""
+        return self.is_record_up_to_date(self.get_record(dep), dep,
+                                         download_path)
+
+    def is_record_up_to_date(self, record, dep, download_path):
+        if not record:
+            return False
+        if record["url"] != dep["url"] or \
+                (record["checksum"], record["algorithm"]) != \
+                get_dep_checksum(dep):
+            return False
+        if record["mtime_ns"] is not None:
+            if stat_file(download_path) != (record["size"],
+                                            record["mtime_ns"],
+                                            record["inode"]):
+                return False
+        elif os.path.exists(download_path):
+            # The file was not kept when the record was written.
+            return False
+        for path in record["paths"]:
+            if not os.path.lexists(os.path.join(dep["folder"], path)):
+                return False
+        return True
+
+    def adopt(self, dep, download_path, record):
+        """Use |record| written by another process that synced |dep|.
+        Returns True if it is still up to date."""
+        if not self.is_record_up_to_date(record, dep, download_path):
+            return False
+        key = get_state_key(dep)
+        with self.lock:
+            self.records[key] = record
+            self.changed_keys.add(key)
+        return True
+
+    def update(self, dep, download_path, paths=None):
+        """Record that |dep| is synced to |download_path| and |paths| are
+        extracted from it.
+        Returns the record."""
+        if paths is None:
+            paths = []
+        checksum, algorithm = get_dep_checksum(dep)
+        record = {
+            "url": dep["url"],
+            "checksum": checksum,
+            "algorithm": algorithm,
+            "size": None,
+            "mtime_ns": None,
+            "inode": None,
+            "paths": list(paths),
+        }
+        stat = stat_file(download_path)
+        if stat:
+            record["size"], record["mtime_ns"], record["inode"] = stat
+        key = get_state_key(dep)
+        with self.lock:
+            self.records[key] = record
+            self.changed_keys.add(key)
+        return record
+
+    def remove(self, dep):
+        key = get_state_key(dep)
+        with self.lock:
+            if self.records.pop(key, None) is not None:
+                self.changed_keys.add(key)
@@ -0,0 +1,148 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/trace.py                                                    ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# Tracer that receives spans, None when tracing is off.
+_tracer = None
+# Args of spans that are open on the current thread, innermost last, and
+# lists that |record_spans| blocks of the current thread collect spans in.
+_spans = threading.local()
+
+
+class Tracer:
+    """Collect spans in Chrome trace event format, which can be loaded in
+    chrome://tracing or https://ui.perfetto.dev."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.thread_ids = set()
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+
+    def get_timestamp(self, counter):
+        """Returns microseconds since the tracer was created."""
+        return (counter - self.start) * 1000000
+
+    def add_span(self, name, start, end, args):
+        event = {
+            "name": name,
+            "cat": "ezdeps",
+            "ph": "X",
+            "ts": self.get_timestamp(start),
+            "dur": (end - start) * 1000000,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args
+        }
+        with self.lock:
+            if event["tid"] not in self.thread_ids:
+                self.thread_ids.add(event["tid"])
+                self.events.append({
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": event["tid"],
+                    "args": {"name": threading.current_thread().name}
+                })
+            self.events.append(event)
+
+    def save(self, path):
+        with self.lock:
+            content = {"traceEvents": self.events, "displayTimeUnit": "ms"}
+        with open(path, "w") as f:
+            json.dump(content, f)
+
+
+def start_tracing():
+    """Record spans from now on. Returns the Tracer."""
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def stop_tracing(path=None):
+    """Stop recording spans and save them to |path| if it is given."""
+    global _tracer
+    tracer = _tracer
+    _tracer = None
+    if tracer and path:
+        tracer.save(path)
+
+
+def is_recording():
+    return _tracer is not None or bool(getattr(_spans, "records", None))
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Record the time spent in this block as a span named |name| with
+    |args|. Does nothing if tracing is off and no |record_spans| block of
+    the current thread is open."""
+    tracer = _tracer
+    records = getattr(_spans, "records", None)
+    if tracer is None and not records:
+        yield
+        return
+    stack = getattr(_spans, "stack", None)
+    if stack is None:
+        stack = _spans.stack = []
+    stack.append(args)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        stack.pop()
+        if tracer:
+            tracer.add_span(name, start, end, args)
+        for spans in records or []:
+            spans.append((name, end - start, args))
+
+
+@contextlib.contextmanager
+def record_spans():
+    """Collect spans that end on the current thread inside this block, even
+    if tracing is off. Yields the list of (name, seconds, args) of these
+    spans, which is filled as they end."""
+    records = getattr(_spans, "records", None)
+    if records is None:
+        records = _spans.records = []
+    spans = []
+    records.append(spans)
+    try:
+        yield spans
+    finally:
+        records.remove(spans)
+
+
+def add_args(**args):
+    """Attach |args| (e.g. byte counts) to the innermost open span of the
+    current thread."""
+    stack = getattr(_spans, "stack", None)
+    if stack:
+        stack[-1].update(args)
+
+
+def traced(name):
+    """Decorator that records every call of the function as a span."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not is_recording():
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -6,9 +6,17 @@
 ## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
 ##----------------------------------------------------------------------------##
 
+import contextlib
 import importlib
 import importlib.util
 import os
+import threading
+import types
+
+_log_lock = threading.Lock()
+_log_buffer = threading.local()
+# Function that receives messages instead of stdout, see |set_log_function|.
+_log_function = None
 
 
 def import_from_path(module_name, path):
@@ -23,3 +31,73 @@ def import_from_path(module_name, path):
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
     return module
+
+
+def load_module_from_source(module_name, path):
+    """Load module from path by compiling its source directly. Unlike
+    |import_from_path|, no bytecode cache is read, written or deleted, so
+    changes in the source file are always picked up."""
+    with open(path, "rb") as f:
+        source = f.read()
+    module = types.ModuleType(module_name)
+    module.__file__ = path
+    exec(compile(source, path, "exec"), module.__dict__)
+    return module
+
+
+def set_log_function(function):
+    """Send messages of |log| to |function| instead of printing them, or
+    print them again if |function| is None. For programs that use ezdeps as
+    a library and don't want it to write to stdout."""
+    global _log_function
+    _log_function = function
+
+
+def write_messages(messages):
+    with _log_lock:
+        if _log_function is None:
+            print("\n".join(messages))
+            return
+        for message in messages:
+            _log_function(message)
+
+
+def log(message):
+    """Print |message|. Inside a |buffered_log| block, the message is held
+    back and printed together with the rest of the block."""
+    for messages in getattr(_log_buffer, "records", None) or []:
+        messages.append(message)
+    lines = getattr(_log_buffer, "lines", None)
+    if lines is not None:
+        lines.append(message)
+        return
+    write_messages([message])
+
+
+@contextlib.contextmanager
+def buffered_log():
+    """Group all messages logged by the current thread inside this block so
+    output from parallel workers does not interleave."""
+    _log_buffer.lines = []
+    try:
+        yield
+    finally:
+        lines = _log_buffer.lines
+        _log_buffer.lines = None
+        if lines:
+            write_messages(lines)
+
+
+@contextlib.contextmanager
+def recorded_log():
+    """Keep messages logged by the current thread inside this block in the
+    list it yields, they are printed as usual too."""
+    records = getattr(_log_buffer, "records", None)
+    if records is None:
+        records = _log_buffer.records = []
+    messages = []
+    records.append(messages)
+    try:
+        yield messages
+    finally:
+        records.remove(messages)
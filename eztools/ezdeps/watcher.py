@@ -0,0 +1,160 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/watcher.py                                                  ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from eztools.ezdeps.state import stat_file
+
+# inotify events of a file that is written, replaced, created or deleted.
+# Editors often save by writing a new file and renaming it over the old one,
+# so folders are watched instead of files.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+inotify_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_DELETE_SELF
+inotify_event_header = struct.Struct("iIII")
+
+
+def get_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+class PollingWatcher:
+    """Detect changes of |paths| by comparing their size, mtime and inode
+    every |interval| seconds."""
+
+    def __init__(self, paths, interval=1.0):
+        self.interval = interval
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """Watch |paths| from now on, changes until now are forgotten."""
+        self.stats = {path: stat_file(path) for path in paths}
+
+    def wait(self, timeout):
+        """Returns set of paths that changed within |timeout| seconds, empty
+        if none did."""
+        deadline = time.monotonic() + timeout
+        while True:
+            changed_paths = set()
+            for path, old_stat in self.stats.items():
+                new_stat = stat_file(path)
+                if new_stat != old_stat:
+                    self.stats[path] = new_stat
+                    changed_paths.add(path)
+            remaining = deadline - time.monotonic()
+            if changed_paths or remaining <= 0:
+                return changed_paths
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """Detect changes of |paths| with Linux inotify, which wakes up as soon
+    as a file is written instead of polling."""
+
+    def __init__(self, paths):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # Watch descriptor to watched folder.
+        self.folders = {}
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """Watch |paths| from now on, changes until now are forgotten."""
+        self.paths = {get_key(path): path for path in paths}
+        folders = set(os.path.dirname(key) for key in self.paths)
+        for wd, folder in list(self.folders.items()):
+            if folder not in folders:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.folders[wd]
+        for folder in folders - set(self.folders.values()):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(folder), inotify_mask)
+            if wd >= 0:
+                self.folders[wd] = folder
+        # Forget events of changes made before.
+        self.read_events()
+
+    def read_events(self):
+        """Returns set of watched paths in events that are ready."""
+        changed_paths = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = inotify_event_header.unpack_from(
+                    data, offset)
+                offset += inotify_event_header.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                folder = self.folders.get(wd)
+                if folder is None:
+                    continue
+                if mask & (IN_DELETE_SELF | IN_IGNORED):
+                    # The folder is gone, all files in it changed.
+                    del self.folders[wd]
+                    changed_paths.update(
+                        path for key, path in self.paths.items()
+                        if os.path.dirname(key) == folder)
+                    continue
+                key = get_key(os.path.join(folder, os.fsdecode(name)))
+                if key in self.paths:
+                    changed_paths.add(self.paths[key])
+        return changed_paths
+
+    def wait(self, timeout):
+        """Returns set of paths that changed within |timeout| seconds, empty
+        if none did."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return set()
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable:
+                changed_paths = self.read_events()
+                if changed_paths:
+                    return changed_paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(paths, interval=1.0):
+    """Returns an InotifyWatcher of |paths| on Linux, or a PollingWatcher
+    that checks them every |interval| seconds if inotify is not
+    available."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(paths, interval)
@@ -0,0 +1,286 @@
+##----------------------------------------------------------------------------##
+## eztools/ezdeps/xz.py                                                       ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+"""Parallel decompression of .xz files made of several blocks.
+An .xz stream is a header, blocks that are compressed independently, an
+index that lists the compressed and uncompressed size of every block and a
+footer. Files written by `xz -T0` (or |compress_file|) have one block every
+few MiB, so their blocks can be decompressed on several threads: each block
+is wrapped in a stream of its own and given to lzma, which releases the GIL
+while decompressing.
+Compress a file in blocks with: python -m eztools.ezdeps.xz FILE..."""
+
+import collections
+import concurrent.futures
+import contextlib
+import io
+import lzma
+import os
+import struct
+import sys
+import tarfile
+import zlib
+
+stream_header_magic = b"\xfd7zXZ\x00"
+stream_footer_magic = b"YZ"
+stream_header_size = 12
+stream_footer_size = 12
+# Stream flags of files whose blocks have a CRC64 check.
+crc64_flags = b"\x00\x04"
+# Blocks written by |compress_file|, the same as xz -6 -T0.
+default_block_size = 24 * 1024 * 1024
+
+# Offset and sizes of a block, |padded_size| is its size in the file.
+Block = collections.namedtuple(
+    "Block", ["offset", "padded_size", "unpadded_size", "uncompressed_size"])
+
+
+class XzIndexError(Exception):
+    """Raised when the index of an .xz file can't be read."""
+
+
+def encode_varint(value):
+    """Encode |value| as a multibyte integer of the xz format."""
+    data = bytearray()
+    while value >= 0x80:
+        data.append(value & 0x7f | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def decode_varint(data, position):
+    """Returns (value, position after it) of the multibyte integer at
+    |position| of |data|."""
+    value = 0
+    for i in range(9):
+        if position + i >= len(data):
+            break
+        byte = data[position + i]
+        value |= (byte & 0x7f) << (i * 7)
+        if not byte & 0x80:
+            return value, position + i + 1
+    raise XzIndexError("Invalid multibyte integer in index")
+
+
+def pad4(size):
+    return (size + 3) & ~3
+
+
+def encode_index(blocks):
+    """Returns the index of a stream made of |blocks|."""
+    index = bytearray(b"\x00")
+    index += encode_varint(len(blocks))
+    for block in blocks:
+        index += encode_varint(block.unpadded_size)
+        index += encode_varint(block.uncompressed_size)
+    index += b"\x00" * (pad4(len(index)) - len(index))
+    return bytes(index) + struct.pack("<I", zlib.crc32(index))
+
+
+def encode_stream_footer(index_size, flags):
+    data = struct.pack("<I", index_size // 4 - 1) + flags
+    return struct.pack("<I", zlib.crc32(data)) + data + stream_footer_magic
+
+
+def read_stream_header(f):
+    """Returns the stream header at the start of |f|."""
+    f.seek(0)
+    header = f.read(stream_header_size)
+    if len(header) != stream_header_size or \
+            not header.startswith(stream_header_magic) or \
+            struct.unpack("<I", header[8:])[0] != zlib.crc32(header[6:8]):
+        raise XzIndexError("Invalid stream header")
+    return header
+
+
+def read_blocks(f):
+    """Returns (stream header, list of Block) of the .xz file |f|.
+    Raises XzIndexError if |f| is not a single .xz stream."""
+    header = read_stream_header(f)
+    file_size = f.seek(0, os.SEEK_END)
+    if file_size < stream_header_size + stream_footer_size:
+        raise XzIndexError("File is too small")
+    f.seek(file_size - stream_footer_size)
+    footer = f.read(stream_footer_size)
+    if footer[10:] != stream_footer_magic or \
+            struct.unpack("<I", footer[:4])[0] != zlib.crc32(footer[4:10]):
+        # Also the case of concatenated streams followed by padding.
+        raise XzIndexError("Invalid stream footer")
+    if footer[8:10] != header[6:8]:
+        raise XzIndexError("Stream flags of header and footer differ")
+    index_size = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+    index_offset = file_size - stream_footer_size - index_size
+    if index_offset < stream_header_size:
+        raise XzIndexError("Invalid index size")
+    f.seek(index_offset)
+    index = f.read(index_size)
+    if index[0] != 0 or struct.unpack("<I", index[-4:])[0] != \
+            zlib.crc32(index[:-4]):
+        raise XzIndexError("Invalid index")
+    count, position = decode_varint(index, 1)
+    blocks = []
+    offset = stream_header_size
+    for _ in range(count):
+        unpadded_size, position = decode_varint(index, position)
+        uncompressed_size, position = decode_varint(index, position)
+        blocks.append(Block(offset, pad4(unpadded_size), unpadded_size,
+                            uncompressed_size))
+        offset += pad4(unpadded_size)
+    if offset != index_offset:
+        # Several streams, the index only describes the last one.
+        raise XzIndexError("Blocks don't end where the index starts")
+    return header, blocks
+
+
+def decompress_block(header, block, data):
+    """Decompress |data| of |block| by wrapping it in a stream of its own
+    that starts with the stream |header| of the file."""
+    index = encode_index([block])
+    stream = b"".join([header, data, index,
+                       encode_stream_footer(len(index), header[6:8])])
+    result = lzma.decompress(stream, lzma.FORMAT_XZ)
+    if len(result) != block.uncompressed_size:
+        raise lzma.LZMAError("Block has a wrong uncompressed size")
+    return result
+
+
+class ParallelXzReader:
+    """Read-only, non-seekable file object that returns the uncompressed
+    content of the .xz file |path| whose |blocks| are decompressed on |jobs|
+    threads. Blocks are returned in order and at most |jobs| + 1 of them
+    are decompressed ahead, which bounds the memory used."""
+
+    def __init__(self, path, header, blocks, jobs):
+        self.file = open(path, "rb")
+        self.header = header
+        self.blocks = collections.deque(blocks)
+        self.jobs = jobs
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=jobs)
+        self.futures = collections.deque()
+        self.buffer = b""
+        self.position = 0
+        self.submit()
+
+    def submit(self):
+        while self.blocks and len(self.futures) <= self.jobs:
+            block = self.blocks.popleft()
+            self.file.seek(block.offset)
+            data = self.file.read(block.padded_size)
+            self.futures.append(self.executor.submit(
+                decompress_block, self.header, block, data))
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0:
+            if self.position == len(self.buffer):
+                if not self.futures:
+                    break
+                self.buffer = self.futures.popleft().result()
+                self.position = 0
+                self.submit()
+                continue
+            end = len(self.buffer) if size < 0 else \
+                min(len(self.buffer), self.position + size)
+            chunks.append(self.buffer[self.position:end])
+            if size > 0:
+                size -= end - self.position
+            self.position = end
+        return b"".join(chunks)
+
+    def close(self):
+        for future in self.futures:
+            future.cancel()
+        self.executor.shutdown(wait=True)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_xz(path, jobs=None):
+    """Open the .xz file |path| for reading. Files with several blocks are
+    decompressed on up to |jobs| threads (default to the number of CPUs) by
+    a ParallelXzReader, which can't seek. Other files are opened by
+    lzma.open."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs > 1:
+        with open(path, "rb") as f:
+            try:
+                header, blocks = read_blocks(f)
+            except (XzIndexError, IndexError, OSError):
+                blocks = []
+        if len(blocks) > 1:
+            return ParallelXzReader(path, header, blocks,
+                                    min(jobs, len(blocks)))
+    return lzma.open(path)
+
+
+@contextlib.contextmanager
+def open_tar_xz(path, jobs=None):
+    """Open the .tar.xz archive |path|, see |open_xz|. Members of archives
+    decompressed in parallel can only be read in order, like in
+    tarfile's stream mode, so pass |jobs| = 1 to go back and forth."""
+    with open_xz(path, jobs) as f:
+        mode = "r|" if isinstance(f, ParallelXzReader) else "r"
+        with tarfile.open(fileobj=f, mode=mode) as tar:
+            yield tar
+
+
+def compress_block(data, preset):
+    """Returns (Block, block data) of |data| compressed with a CRC64 check,
+    the offset of the Block is 0."""
+    stream = lzma.compress(data, lzma.FORMAT_XZ, lzma.CHECK_CRC64, preset)
+    _, blocks = read_blocks(io.BytesIO(stream))
+    block = blocks[0]
+    return block._replace(offset=0), \
+        stream[block.offset:block.offset + block.padded_size]
+
+
+def compress_file(path, xz_path, block_size=default_block_size, preset=6,
+                  jobs=None):
+    """Compress |path| to |xz_path| in blocks of |block_size| bytes that
+    are compressed on up to |jobs| threads (default to the number of
+    CPUs)."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    blocks = []
+    tmp_path = xz_path + ".tmp"
+    with open(path, "rb") as src, open(tmp_path, "wb") as dst, \
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=jobs) as executor:
+        dst.write(stream_header_magic + crc64_flags +
+                  struct.pack("<I", zlib.crc32(crc64_flags)))
+        futures = collections.deque()
+        offset = stream_header_size
+        while True:
+            data = src.read(block_size)
+            if data:
+                futures.append(executor.submit(compress_block, data, preset))
+            if not futures:
+                break
+            if data and len(futures) <= jobs:
+                continue
+            block, block_data = futures.popleft().result()
+            blocks.append(block._replace(offset=offset))
+            dst.write(block_data)
+            offset += len(block_data)
+        index = encode_index(blocks)
+        dst.write(index)
+        dst.write(encode_stream_footer(len(index), crc64_flags))
+    os.replace(tmp_path, xz_path)
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        compress_file(path, path + ".xz")
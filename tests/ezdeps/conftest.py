@@ -0,0 +1,28 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/conftest.py                                                   ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import os
+import pytest
+
+
+@pytest.fixture(scope="function", autouse=True)
+def run_in_tmp_path(tmp_path):
+    """Run every test in its own empty folder, so what the tests and ezdeps
+    write (.tmp, DEPS.py, _config.py...) doesn't end up in the checkout.
+    Test servers serve the current folder so relative urls keep working."""
+    cwd = os.getcwd()
+    os.chdir(str(tmp_path))
+    yield
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope="function")
+def folder():
+    """Relative path of an empty folder for the files of a test."""
+    os.makedirs("folder")
+    return "folder"
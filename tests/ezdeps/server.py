@@ -0,0 +1,92 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/server.py                                                     ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import collections
+import http.server
+import io
+import os
+import re
+import socketserver
+import threading
+
+
+class LocalServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve files like SimpleHTTPRequestHandler but also support
+    "Range: bytes=N-" and "Range: bytes=N-M" requests and record the offsets
+    that were asked for."""
+    requested_offsets = []
+
+    def send_head(self):
+        range_header = self.headers.get("Range")
+        path = self.translate_path(self.path)
+        if not range_header or not os.path.isfile(path):
+            return super().send_head()
+        match = re.match(r"bytes=(\d+)-(\d*)", range_header)
+        start = int(match.group(1))
+        self.requested_offsets.append(start)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if start >= size:
+                self.send_error(416)
+                return None
+            end = size - 1
+            if match.group(2):
+                end = min(int(match.group(2)), end)
+            f.seek(start)
+            data = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Range",
+                         "bytes {}-{}/{}".format(start, end, size))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        return io.BytesIO(data)
+
+
+class TruncatingRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Announce the whole file but close the connection halfway."""
+
+    def copyfile(self, source, outputfile):
+        data = source.read()
+        outputfile.write(data[:len(data) // 2])
+
+
+class KeepAliveRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Keep connections open between requests."""
+    protocol_version = "HTTP/1.1"
+
+
+class CountingRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Count GET requests of every path."""
+    lock = threading.Lock()
+    requested_paths = collections.Counter()
+
+    def do_GET(self):
+        with self.lock:
+            self.requested_paths[self.path] += 1
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(handler_class):
+    """Run a server with |handler_class| on a free port until the generator
+    is resumed. Yields the server address."""
+    httpd = LocalServer(("127.0.0.1", 0), handler_class)
+    threading.Thread(target=httpd.serve_forever).start()
+    yield "http://127.0.0.1:{}/".format(httpd.server_address[1])
+    shutdown_thread = threading.Thread(target=httpd.shutdown)
+    shutdown_thread.start()
+    shutdown_thread.join()
+    httpd.server_close()
@@ -9,18 +9,23 @@
 import hashlib
 import http.server
 import importlib
+import io
+import json
 import lzma
 import os
 import pytest
 import shutil
-import socketserver
 import tarfile
-import threading
 
 import eztools.ezdeps.action as action
+import eztools.ezdeps.trace as trace
 
-port = 8000
-server_address = "http://127.0.0.1:{}/".format(port)
+from eztools.ezdeps.cache import DownloadCache
+from tests.ezdeps.server import (RangeRequestHandler,
+                                 TruncatingRequestHandler, serve)
+
+# Set by |local_server| once the server is bound to a free port.
+server_address = ""
 
 
 def simple_sha1(path):
@@ -56,17 +61,26 @@ def xz_file_and_hash(file_and_hash):
     yield xz_name, xz_path, simple_sha1(xz_path)
     if os.path.exists(xz_path):
         os.remove(xz_path)
+    if os.path.exists(action.get_manifest_path(xz_path)):
+        os.remove(action.get_manifest_path(xz_path))
 
 
 @pytest.fixture(scope="module")
 def local_server():
-    httpd = socketserver.TCPServer(("", port),
-                                   http.server.SimpleHTTPRequestHandler)
-    threading.Thread(target=httpd.serve_forever).start()
-    yield
-    shutdown_thread = threading.Thread(target=httpd.shutdown)
-    shutdown_thread.start()
-    shutdown_thread.join()
+    global server_address
+    for address in serve(http.server.SimpleHTTPRequestHandler):
+        server_address = address
+        yield
+
+
+@pytest.fixture(scope="module")
+def range_server():
+    yield from serve(RangeRequestHandler)
+
+
+@pytest.fixture(scope="module")
+def truncating_server():
+    yield from serve(TruncatingRequestHandler)
 
 
 @pytest.fixture(scope="module")
@@ -155,6 +169,8 @@ deps = [
         os.remove(file_download_path)
     if os.path.exists(xz_download_path):
         os.remove(xz_download_path)
+    if os.path.exists(action.get_manifest_path(xz_download_path)):
+        os.remove(action.get_manifest_path(xz_download_path))
     os.remove(top_level_deps_path)
     shutil.rmtree(link_folder_path)
 
@@ -185,16 +201,174 @@ def test_download_file(download_folder, local_server, non_existent_path,
                                     save_path)
     # invalid address
     assert not action.download_file("http:/abc", save_path)
+    # sha1 is checked before the file is moved into place
+    assert not action.download_file(server_address + xz_path, save_path, "")
+    assert not os.path.exists(save_path)
+    assert not os.path.exists(save_path + action.part_suffix)
+    assert action.download_file(server_address + xz_path, save_path, xz_hash)
+    assert action.verify_sha1(save_path, xz_hash)
+
 
+def test_resume_download(download_folder, range_server, truncating_server,
+                         xz_file_and_hash):
+    xz_name, xz_path, xz_hash = xz_file_and_hash
+    save_path = os.path.join(download_folder, "downloaded_file")
+    part_path = save_path + action.part_suffix
+    with open(xz_path, "rb") as f:
+        size = len(f.read())
+    # The interrupted download is kept.
+    assert not action.download_file(truncating_server + xz_path, save_path,
+                                    xz_hash)
+    assert os.path.getsize(part_path) == size // 2
+    assert not action.get_resumable_size(part_path, range_server + xz_path,
+                                         xz_hash)
+    # Pretend it was downloaded from |range_server|.
+    action.write_part_info(part_path, range_server + xz_path, xz_hash, {})
+    assert action.get_resumable_size(part_path, range_server + xz_path,
+                                     xz_hash) == size // 2
+    RangeRequestHandler.requested_offsets.clear()
+    assert action.download_file(range_server + xz_path, save_path, xz_hash)
+    assert RangeRequestHandler.requested_offsets == [size // 2]
+    assert action.verify_sha1(save_path, xz_hash)
+    assert os.listdir(download_folder) == ["downloaded_file"]
 
-def test_extract_tar_xz(empty_folder, file_and_hash, non_existent_path,
-                        xz_file_and_hash):
+
+def test_resume_download_fallback(download_folder, local_server,
+                                  range_server, xz_file_and_hash):
+    xz_name, xz_path, xz_hash = xz_file_and_hash
+    save_path = os.path.join(download_folder, "downloaded_file")
+    part_path = save_path + action.part_suffix
+    # The server ignores ranges.
+    with open(part_path, "wb") as f:
+        f.write(b"abc")
+    action.write_part_info(part_path, server_address + xz_path, xz_hash, {})
+    assert action.download_file(server_address + xz_path, save_path, xz_hash)
+    assert action.verify_sha1(save_path, xz_hash)
+    # The part file is not a prefix of the file.
+    os.remove(save_path)
+    with open(part_path, "wb") as f:
+        f.write(b"abc")
+    action.write_part_info(part_path, range_server + xz_path, xz_hash, {})
+    assert action.download_file(range_server + xz_path, save_path, xz_hash)
+    assert action.verify_sha1(save_path, xz_hash)
+    assert os.listdir(download_folder) == ["downloaded_file"]
+
+
+def test_extract_archive(empty_folder, file_and_hash, non_existent_path,
+                         xz_file_and_hash):
     file_name, file_path, file_hash = file_and_hash
     xz_name, xz_path, xz_hash = xz_file_and_hash
-    assert action.extract_tar_xz(xz_path, empty_folder)
+    assert action.extract_archive(xz_path, empty_folder)
     assert action.verify_sha1(os.path.join(empty_folder, file_name), file_hash)
-    assert not action.extract_tar_xz(file_path, empty_folder)
-    assert not action.extract_tar_xz(non_existent_path, empty_folder)
+    assert not action.extract_archive(file_path, empty_folder)
+    assert not action.extract_archive(non_existent_path, empty_folder)
+
+
+def write_tar_xz(path, files):
+    """Write an archive with |files|, a dict of name to content."""
+    with tarfile.open(path, "w:xz") as tar:
+        for name, content in sorted(files.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = 1000000000
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(content))
+
+
+def test_incremental_extract(empty_folder):
+    xz_path = os.path.join(empty_folder, "archive.tar.xz")
+    extract_path = os.path.join(empty_folder, "out")
+    write_tar_xz(xz_path, {"a": b"1", "b": b"2", "sub/c": b"3"})
+    assert action.extract_archive(xz_path, extract_path, True) is not None
+    a_path = os.path.join(extract_path, "a")
+    # Same size and mtime, so incremental extraction doesn't look at it.
+    with open(a_path, "wb") as f:
+        f.write(b"x")
+    os.utime(a_path, (1000000000, 1000000000))
+    write_tar_xz(xz_path, {"a": b"1", "b": b"22", "d": b"4"})
+    entries = action.extract_archive(xz_path, extract_path, True)
+    assert sorted(entries) == ["a", "b", "d"]
+    with open(a_path, "rb") as f:
+        assert f.read() == b"x"
+    with open(os.path.join(extract_path, "b"), "rb") as f:
+        assert f.read() == b"22"
+    assert os.path.isfile(os.path.join(extract_path, "d"))
+    # Files that are not in the new archive anymore are deleted.
+    assert not os.path.exists(os.path.join(extract_path, "sub"))
+    # Comparing content catches the change.
+    assert action.extract_archive(xz_path, extract_path, True, True)
+    with open(a_path, "rb") as f:
+        assert f.read() == b"1"
+
+
+def test_manifest_records(empty_folder):
+    xz_path = os.path.join(empty_folder, "archive.tar.xz")
+    extract_path = os.path.join(empty_folder, "out")
+    write_tar_xz(xz_path, {"a": b"1", "sub/b": b"22"})
+    assert action.extract_archive(xz_path, extract_path) == ["a", "sub/b"]
+    records = action.read_manifest_records(action.get_manifest_path(xz_path))
+    assert records == [
+        action.ManifestRecord("a", 1, 1000000000,
+                              hashlib.sha1(b"1").hexdigest()),
+        action.ManifestRecord("sub/b", 2, 1000000000,
+                              hashlib.sha1(b"22").hexdigest())
+    ]
+    # Entries without a hash, like in manifests of older ezdeps.
+    action.write_manifest(action.get_manifest_path(xz_path), ["sub/", "a"])
+    assert action.read_manifest_records(
+        action.get_manifest_path(xz_path)) == [
+            action.ManifestRecord("sub/", None, None, None),
+            action.ManifestRecord("a", None, None, None)
+        ]
+
+
+def test_verify_and_repair(empty_folder, local_server, monkeypatch):
+    xz_path = os.path.join(empty_folder, "verify.tar.xz")
+    write_tar_xz(xz_path, {"a": b"1", "sub/b": b"22"})
+    dep = {
+        "file_name": "verify.tar.xz",
+        "folder": os.path.join(empty_folder, "out"),
+        "url": server_address + xz_path,
+        "sha1": simple_sha1(xz_path)
+    }
+    download_path = action.get_download_path(dep["folder"], dep["file_name"])
+    a_path = os.path.join(dep["folder"], "a")
+    b_path = os.path.join(dep["folder"], "sub", "b")
+    options = action.SyncOptions(
+        state=action.SyncState(os.path.join(empty_folder, "state.json")))
+    assert action.get_dep(dep, options)
+    assert action.action_verify([dep], options)
+    # Same size and mtime, only hashing finds it.
+    with open(a_path, "wb") as f:
+        f.write(b"x")
+    os.utime(a_path, (1000000000, 1000000000))
+    os.remove(b_path)
+    options.fast = True
+    assert action.find_damaged_deps([dep], options) == [(dep, ["sub/b"])]
+    options.fast = False
+    assert action.find_damaged_deps([dep], options) == [(dep, ["a",
+                                                               "sub/b"])]
+    assert not action.action_verify([dep], options)
+
+    def fail(*args):
+        assert False
+
+    # Only the damaged files are extracted from the kept archive.
+    monkeypatch.setattr(action, "get_dep", fail)
+    assert action.action_repair([dep], options)
+    with open(a_path, "rb") as f:
+        assert f.read() == b"1"
+    assert os.path.isfile(b_path)
+    assert action.action_verify([dep], options)
+    monkeypatch.undo()
+    # Without the archive, the dep is synced again.
+    os.remove(download_path)
+    os.remove(a_path)
+    assert action.action_repair([dep], options)
+    assert os.path.isfile(a_path)
+    assert action.action_verify([dep], options)
+    os.remove(download_path)
+    os.remove(action.get_manifest_path(download_path))
 
 
 def test_delete_extracted_files(empty_folder, file_and_hash, xz_file_and_hash):
@@ -202,12 +376,36 @@ def test_delete_extracted_files(empty_folder, file_and_hash, xz_file_and_hash):
     xz_name, xz_path, xz_hash = xz_file_and_hash
     # TODO move this out of here
     extracted_file = os.path.join(empty_folder, file_name)
-    assert action.extract_tar_xz(xz_path, empty_folder)
+    assert action.extract_archive(xz_path, empty_folder)
     assert os.path.isfile(extracted_file)
     action.delete_extracted_files(xz_path, empty_folder)
     assert not os.path.exists(extracted_file)
 
 
+def test_delete_extracted_files_from_manifest(empty_folder):
+    archive_folder = os.path.join(empty_folder, "archive")
+    os.makedirs(os.path.join(archive_folder, "bin"))
+    with open(os.path.join(archive_folder, "bin", "tool"), "w") as f:
+        f.write("tool")
+    xz_path = os.path.join(empty_folder, "archive.tar.xz")
+    with tarfile.open(xz_path, "w:xz") as tar:
+        tar.add(os.path.join(archive_folder, "bin"), arcname="bin")
+    extract_path = os.path.join(empty_folder, "extract")
+    assert action.extract_archive(xz_path, extract_path) == ["bin/",
+                                                            "bin/tool"]
+    assert action.read_manifest(action.get_manifest_path(xz_path)) == \
+        ["bin/", "bin/tool"]
+    # A file that doesn't come from the archive.
+    with open(os.path.join(extract_path, "bin", "other"), "w") as f:
+        f.write("other")
+    # The archive is not needed anymore.
+    os.remove(xz_path)
+    action.delete_extracted_files(xz_path, extract_path)
+    assert not os.path.exists(os.path.join(extract_path, "bin", "tool"))
+    assert os.path.exists(os.path.join(extract_path, "bin", "other"))
+    assert not os.path.exists(action.get_manifest_path(xz_path))
+
+
 def test_has_archive_name():
     assert action.has_archive_name("abc.xz")
     assert action.has_archive_name("abc.tar.xz")
@@ -234,8 +432,8 @@ def test_get_dep(empty_folder, file_and_hash, local_server, xz_file_and_hash):
         "url": download_file_address,
         "sha1": ""
     })
-    assert os.path.isfile(download_path)
-    os.remove(download_path)
+    assert not os.path.exists(download_path)
+    assert not os.path.exists(download_path + action.part_suffix)
     # correct hash
     assert action.get_dep({
         "file_name": xz_name,
@@ -259,6 +457,142 @@ def test_get_dep(empty_folder, file_and_hash, local_server, xz_file_and_hash):
     assert action.verify_sha1(extracted_file, file_hash)
 
 
+def test_pipeline(empty_folder, file_and_hash, local_server,
+                  xz_file_and_hash):
+    file_name, file_path, file_hash = file_and_hash
+    xz_name, xz_path, xz_hash = xz_file_and_hash
+    dep = {
+        "file_name": xz_name,
+        "folder": empty_folder,
+        "url": server_address + xz_path,
+        "sha1": ""
+    }
+    download_path = action.get_download_path(empty_folder, xz_name)
+    extracted_file = os.path.join(empty_folder, file_name)
+    # wrong hash, nothing is extracted
+    assert not action.get_dep(dep, action.SyncOptions(pipeline=True))
+    assert os.listdir(empty_folder) == []
+    # correct hash, the archive is not saved by default
+    dep["sha1"] = xz_hash
+    assert action.get_dep(dep, action.SyncOptions(pipeline=True))
+    assert action.verify_sha1(extracted_file, file_hash)
+    assert os.listdir(empty_folder) == [file_name]
+    assert not os.path.exists(download_path)
+    os.remove(extracted_file)
+    assert action.get_dep(
+        dep, action.SyncOptions(pipeline=True, keep_archive=True))
+    assert action.verify_sha1(extracted_file, file_hash)
+    assert action.verify_sha1(download_path, xz_hash)
+    os.remove(download_path)
+
+
+def write_tar_xz_members(path, members):
+    """Write the archive |path| with |members|, list of (TarInfo, data)."""
+    with tarfile.open(path, "w:xz") as tar:
+        for member, data in members:
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+
+
+def test_pipeline_malicious_members(empty_folder, local_server):
+    archive_path = os.path.join(empty_folder, "evil.tar.xz")
+    write_tar_xz_members(archive_path, [
+        (tarfile.TarInfo("good.txt"), b"good"),
+        (tarfile.TarInfo("../../escaped.txt"), b"evil")])
+    workspace = os.path.join(empty_folder, "ws")
+    dep = {
+        "file_name": "evil.tar.xz",
+        "folder": os.path.join(workspace, "out"),
+        "url": server_address + archive_path,
+        "sha1": "0" * 40
+    }
+    assert not action.get_dep(dep, action.SyncOptions(pipeline=True))
+    assert not os.path.exists(os.path.join(workspace, "escaped.txt"))
+    assert os.listdir(os.path.join(workspace, "out")) == []
+    # Not even with the right hash.
+    dep["sha1"] = action.calculate_sha1(archive_path)
+    assert not action.get_dep(dep, action.SyncOptions(pipeline=True))
+    assert not os.path.exists(os.path.join(workspace, "escaped.txt"))
+
+
+def test_extract_malicious_links(empty_folder):
+    extract_path = os.path.join(empty_folder, "out")
+    for name, linkname in [("abs", "/etc/passwd"), ("up", "../.."),
+                           ("sub/up", "../../x")]:
+        link = tarfile.TarInfo(name)
+        link.type = tarfile.SYMTYPE
+        link.linkname = linkname
+        archive_path = os.path.join(empty_folder, "links.tar.xz")
+        write_tar_xz_members(archive_path, [
+            (link, b""), (tarfile.TarInfo("up/x.txt"), b"x")])
+        assert action.extract_archive(archive_path, extract_path) is None
+        assert not os.path.lexists(os.path.join(extract_path, name))
+    link.linkname = "../sub"
+    write_tar_xz_members(archive_path, [(link, b"")])
+    assert action.extract_archive(archive_path, extract_path) == ["sub/up"]
+
+
+def test_shared_cache(empty_folder, file_and_hash, local_server,
+                      xz_file_and_hash):
+    file_name, file_path, file_hash = file_and_hash
+    xz_name, xz_path, xz_hash = xz_file_and_hash
+    download_cache = DownloadCache(os.path.join(empty_folder, "cache"))
+    options = action.SyncOptions(cache=download_cache)
+    workspaces = [os.path.join(empty_folder, "a"),
+                  os.path.join(empty_folder, "b")]
+    dep = {
+        "file_name": xz_name,
+        "folder": workspaces[0],
+        "url": server_address + xz_path,
+        "sha1": xz_hash
+    }
+    download_path = action.get_download_path(workspaces[0], xz_name)
+    assert action.get_dep(dep, options)
+    os.remove(download_path)
+    # The second workspace gets the archive from the cache.
+    dep = dict(dep, folder=workspaces[1], url="http://abc")
+    assert action.get_dep(dep, options)
+    assert action.verify_sha1(os.path.join(workspaces[1], file_name),
+                              file_hash)
+    os.remove(download_path)
+
+
+def test_move_tree(empty_folder):
+    src = os.path.join(empty_folder, "src")
+    dst = os.path.join(empty_folder, "dst")
+    os.makedirs(os.path.join(src, "a"))
+    os.makedirs(os.path.join(dst, "a"))
+    with open(os.path.join(src, "a", "new"), "w") as f:
+        f.write("new")
+    with open(os.path.join(dst, "a", "new"), "w") as f:
+        f.write("old")
+    with open(os.path.join(dst, "a", "other"), "w") as f:
+        f.write("other")
+    action.move_tree(src, dst)
+    with open(os.path.join(dst, "a", "new")) as f:
+        assert f.read() == "new"
+    assert os.path.isfile(os.path.join(dst, "a", "other"))
+
+
+def test_get_dep_with_sha256(empty_folder, file_and_hash, local_server,
+                             xz_file_and_hash):
+    file_name, file_path, file_hash = file_and_hash
+    xz_name, xz_path, xz_hash = xz_file_and_hash
+    with open(xz_path, "rb") as f:
+        xz_sha256 = hashlib.sha256(f.read()).hexdigest()
+    dep = {
+        "file_name": xz_name,
+        "folder": empty_folder,
+        "url": server_address + xz_path,
+        "sha256": xz_sha256
+    }
+    assert action.get_dep(dep)
+    assert action.verify_sha1(os.path.join(empty_folder, file_name),
+                              file_hash)
+    assert not action.get_dep(dict(dep, sha256=xz_hash))
+    assert not os.path.exists(action.get_download_path(empty_folder, xz_name))
+
+
 def test_clean(empty_folder, file_and_hash, local_server, xz_file_and_hash):
     file_name, file_path, file_hash = file_and_hash
     xz_name, xz_path, xz_hash = xz_file_and_hash
@@ -288,6 +622,147 @@ def test_sync_action(deps_files):
         assert action.verify_sha1(download_path, file["sha1"])
 
 
+def test_no_op_sync(deps_files, monkeypatch):
+    top_level_deps_dir, downloaded_files = deps_files
+    state = action.SyncState(os.path.join(action.tmp_folder_name,
+                                          "test_state.json"))
+    assert action.run_action("sync", top_level_deps_dir,
+                             action.SyncOptions(state=state))
+    assert len(state.records) == len(downloaded_files)
+
+    def fail(*args):
+        assert False
+
+    # Nothing changed so nothing is hashed or extracted again.
+    monkeypatch.setattr(action, "verify_file", fail)
+    monkeypatch.setattr(action, "hash_file", fail)
+    monkeypatch.setattr(action, "extract_archive", fail)
+    assert action.run_action("sync", top_level_deps_dir,
+                             action.SyncOptions(state=state))
+    os.remove(state.path)
+
+
+def test_trace_sync(deps_files, empty_folder):
+    top_level_deps_dir, downloaded_files = deps_files
+    state = action.SyncState(os.path.join(empty_folder, "state.json"))
+    trace_path = os.path.join(empty_folder, "trace.json")
+    trace.start_tracing()
+    try:
+        assert action.run_action("sync", top_level_deps_dir,
+                                 action.SyncOptions(state=state))
+    finally:
+        trace.stop_tracing(trace_path)
+    with open(trace_path, "r") as f:
+        events = json.load(f)["traceEvents"]
+    spans = {}
+    for event in events:
+        if event["ph"] == "X":
+            spans.setdefault(event["name"], []).append(event)
+    assert spans["load_deps"][0]["args"]["deps"] == len(downloaded_files)
+    assert len(spans["get_dep"]) == len(downloaded_files)
+    downloaded_size = sum(
+        event["args"]["bytes"] for event in spans["download_file"])
+    assert downloaded_size == sum(
+        os.path.getsize(action.get_download_path(file["folder"],
+                                                 file["file_name"]))
+        for file in downloaded_files)
+    assert spans["extract_archive"][0]["args"]["files"] == 1
+    # Spans of a dep are inside its get_dep span.
+    get_dep = [event for event in spans["get_dep"]
+               if event["args"]["file_name"].endswith(".tar.xz")][0]
+    extract = spans["extract_archive"][0]
+    assert get_dep["ts"] <= extract["ts"]
+    assert extract["ts"] + extract["dur"] <= get_dep["ts"] + get_dep["dur"]
+
+
+def test_sync_from_lock(deps_files, empty_folder, monkeypatch):
+    top_level_deps_dir, downloaded_files = deps_files
+    lock_path = os.path.join(empty_folder, "DEPS.lock.json")
+    options = action.SyncOptions(lock_file=lock_path)
+    assert action.run_action("lock", top_level_deps_dir, options)
+    with open(lock_path) as f:
+        sizes = [dep["size"] for dep in json.load(f)["deps"]]
+    assert sorted(sizes) == sorted(
+        os.path.getsize(os.path.basename(file["url"]))
+        for file in downloaded_files)
+
+    def fail(*args):
+        assert False
+
+    # DEPS.py files are not evaluated.
+    monkeypatch.setattr(action, "load_deps", fail)
+    state = action.SyncState(os.path.join(empty_folder, "state.json"))
+    assert action.run_action("sync", top_level_deps_dir, action.SyncOptions(
+        lock_file=lock_path, from_lock=True, state=state))
+    for file in downloaded_files:
+        download_path = action.get_download_path(file["folder"],
+                                                 file["file_name"])
+        assert action.verify_sha1(download_path, file["sha1"])
+
+
+def test_parallel_sync_action(deps_files):
+    top_level_deps_dir, downloaded_files = deps_files
+    assert action.run_action("sync", top_level_deps_dir,
+                             action.SyncOptions(jobs=4))
+    for file in downloaded_files:
+        download_path = action.get_download_path(file["folder"],
+                                                 file["file_name"])
+        assert action.verify_sha1(download_path, file["sha1"])
+
+
+def test_parallel_sync_failure(empty_folder, file_and_hash, local_server):
+    file_name, file_path, file_hash = file_and_hash
+    deps = [{
+        "file_name": "good",
+        "folder": empty_folder,
+        "url": server_address + file_path,
+        "sha1": file_hash
+    }, {
+        "file_name": "bad",
+        "folder": empty_folder,
+        "url": server_address + file_path,
+        "sha1": ""
+    }]
+    assert not action.action_get_deps(deps, action.SyncOptions(jobs=2))
+    assert action.verify_sha1(os.path.join(empty_folder, "good"), file_hash)
+
+
+def test_group_deps():
+    deps = [
+        {"file_name": "a", "folder": "x"},
+        {"file_name": "b", "folder": "x"},
+        {"file_name": "a", "folder": os.path.join("x", ".")},
+    ]
+    assert action.group_deps(deps) == [[deps[0], deps[2]], [deps[1]]]
+
+
+def test_group_size(empty_folder, monkeypatch):
+    download_cache = DownloadCache(os.path.join(empty_folder, "cache"))
+    src = os.path.join(empty_folder, "src")
+    with open(src, "wb") as f:
+        f.write(b"cached")
+    cached_dep = {
+        "file_name": "cached",
+        "folder": empty_folder,
+        "url": server_address + "cached",
+        "sha1": simple_sha1(src)
+    }
+    download_cache.add(src, cached_dep["sha1"])
+    other_dep = dict(cached_dep, file_name="other", sha1="0" * 40)
+    probed_urls = []
+
+    def probe_size(url, pool=None):
+        probed_urls.append(url)
+        return 100
+
+    monkeypatch.setattr(action, "probe_size", probe_size)
+    options = action.SyncOptions(cache=download_cache)
+    assert action.get_group_size([cached_dep], options) == 0
+    assert probed_urls == []
+    assert action.get_group_size([cached_dep, other_dep], options) == 100
+    assert probed_urls == [other_dep["url"]]
+
+
 def test_re_extract(deps_files):
     top_level_deps_dir, downloaded_files = deps_files
     action.run_action("sync", top_level_deps_dir)
@@ -322,3 +797,39 @@ def test_archive_download_location(empty_folder, local_server,
     download_path = os.path.join(action.tmp_folder_name, xz_name)
     assert os.path.exists(download_path)
     os.remove(download_path)
+
+
+def test_sync_with_stamp(deps_files, empty_folder):
+    top_level_deps_dir, downloaded_files = deps_files
+    stamp_path = os.path.join(empty_folder, "deps.stamp")
+    state = action.SyncState(os.path.join(empty_folder, "state.json"))
+
+    def sync():
+        return action.run_action("sync", top_level_deps_dir,
+                                 action.SyncOptions(state=state,
+                                                    stamp=stamp_path))
+
+    assert sync()
+    with open(stamp_path) as f:
+        assert f.read().count("sha1 ") == len(downloaded_files)
+    with open(stamp_path + ".d") as f:
+        inputs = f.read().replace("\\\n", "").split()
+    download_paths = [
+        action.get_download_path(file["folder"], file["file_name"])
+        for file in downloaded_files]
+    assert inputs[0] == stamp_path + ":"
+    assert set(inputs[1:]) == set(
+        [os.path.join("link", "DEPS.py"), "DEPS.py"] + download_paths)
+    # A sync that does nothing leaves the stamp alone.
+    os.utime(stamp_path, (1, 1))
+    assert sync()
+    assert os.path.getmtime(stamp_path) == 1
+    # A dep that is synced again touches it.
+    os.remove(download_paths[0])
+    assert sync()
+    assert os.path.getmtime(stamp_path) > 1
+    # A failed sync removes it so the build runs the sync again.
+    with open("DEPS.py", "a") as f:
+        f.write("\ndeps[0]['sha1'] = '0' * 40\n")
+    assert not sync()
+    assert not os.path.exists(stamp_path)
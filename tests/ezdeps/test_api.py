@@ -0,0 +1,142 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_api.py                                                   ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import asyncio
+import hashlib
+import os
+import pytest
+
+from eztools.ezdeps import action
+from eztools.ezdeps.action import part_suffix
+from eztools.ezdeps.api import CancelToken, SyncOptions, sync, sync_async
+from eztools.ezdeps.state import SyncState
+from tests.ezdeps.server import RangeRequestHandler, serve
+
+
+@pytest.fixture(scope="module")
+def local_server():
+    yield from serve(RangeRequestHandler)
+
+
+def write_files(folder, server_address, sizes):
+    """Write a file of every size in |sizes| and DEPS.py with a dep of each,
+    plus a dep that can't be downloaded."""
+    deps = []
+    for i, size in enumerate(sizes):
+        path = os.path.join(folder, "file{}".format(i))
+        data = os.urandom(size)
+        with open(path, "wb") as f:
+            f.write(data)
+        deps.append({
+            "file_name": "file{}".format(i),
+            "folder": "out",
+            "url": server_address + path,
+            "sha1": hashlib.sha1(data).hexdigest()
+        })
+    deps.append({
+        "file_name": "missing",
+        "folder": "out",
+        "url": server_address + folder + "/missing",
+        "sha1": "0" * 40
+    })
+    with open(os.path.join(folder, "DEPS.py"), "w") as f:
+        f.write("deps = {!r}\n".format(deps))
+
+
+def get_options(folder):
+    return SyncOptions(
+        state=SyncState(os.path.join(folder, "state.json")))
+
+
+def test_sync(folder, local_server):
+    write_files(folder, local_server, [1000, 2000])
+    events = []
+    options = get_options(folder)
+    result = sync(folder, options, events.append)
+    assert options.progress is None
+    assert not result.ok
+    assert [dep_result.status for dep_result in result.deps] == [
+        "synced", "synced", "failed"]
+    assert [dep_result.bytes for dep_result in result.deps] == [
+        1000, 2000, 0]
+    assert result.bytes == 3000
+    assert "download_file" in result.deps[0].phases
+    assert result.failed == [result.deps[2]]
+    assert "missing" in result.failed[0].error
+    kinds = [(event.kind, event.dep["file_name"]) for event in events]
+    assert kinds[0] == ("start", "file0")
+    assert ("done", "missing") in kinds
+    done_events = [event for event in events if event.kind == "done"]
+    assert [event.result for event in done_events] == result.deps
+    # Synced deps are not downloaded again.
+    result = sync(folder, get_options(folder))
+    assert [dep_result.status for dep_result in result.deps] == [
+        "up_to_date", "up_to_date", "failed"]
+    assert result.bytes == 0
+
+
+def test_cancel(folder, local_server):
+    write_files(folder, local_server, [3 * 1024 * 1024, 1000])
+    cancel = CancelToken()
+
+    def progress(event):
+        if event.kind == "bytes":
+            cancel.cancel()
+
+    result = sync(folder, get_options(folder), progress, cancel)
+    assert result.cancelled
+    assert [dep_result.status for dep_result in result.deps] == [
+        "cancelled"] * 3
+    # The part is kept to resume the download later.
+    out_folder = os.path.join(folder, "out")
+    assert os.path.isfile(os.path.join(out_folder, "file0" + part_suffix))
+    result = sync(folder, get_options(folder))
+    assert [dep_result.status for dep_result in result.deps] == [
+        "synced", "synced", "failed"]
+    assert result.deps[0].bytes < 3 * 1024 * 1024
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_sync_error(folder, local_server, monkeypatch, jobs):
+    write_files(folder, local_server, [1000, 2000])
+    sync_dep = action.sync_dep
+
+    def failing_sync_dep(dep, options):
+        if dep["file_name"] == "file0":
+            raise OSError("Disk is full")
+        return sync_dep(dep, options)
+
+    monkeypatch.setattr(action, "sync_dep", failing_sync_dep)
+    events = []
+    options = get_options(folder)
+    options.jobs = jobs
+    result = sync(folder, options, events.append)
+    assert [dep_result.status for dep_result in result.deps] == [
+        "failed", "synced", "failed"]
+    assert result.deps[0].error == "Disk is full"
+    assert [event.dep["file_name"] for event in events
+            if event.kind == "done"].count("file0") == 1
+
+
+def test_sync_async(folder, local_server):
+    write_files(folder, local_server, [1000])
+    events = []
+
+    async def run():
+        task = asyncio.ensure_future(sync_async(
+            folder, get_options(folder), events.append))
+        return await task
+
+    loop = asyncio.new_event_loop()
+    try:
+        result = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert [dep_result.status for dep_result in result.deps] == [
+        "synced", "failed"]
+    assert [event.kind for event in events][-1] == "done"
@@ -0,0 +1,183 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_archive.py                                               ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import hashlib
+import http.server
+import io
+import os
+import pytest
+import tarfile
+import zipfile
+
+import eztools.ezdeps.action as action
+import eztools.ezdeps.archive as archive
+
+from tests.ezdeps.server import serve
+
+files = {"bin/tool": b"tool", "readme": b"readme" * 100}
+
+
+@pytest.fixture(scope="module")
+def server_address():
+    yield from serve(http.server.SimpleHTTPRequestHandler)
+
+
+def write_tar(path, mode):
+    with tarfile.open(path, mode) as tar:
+        info = tarfile.TarInfo("bin")
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        tar.addfile(info)
+        for name, content in sorted(files.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o755 if name.startswith("bin/") else 0o644
+            info.mtime = 1000000000
+            tar.addfile(info, io.BytesIO(content))
+
+
+def write_zip(path):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip:
+        zip.writestr(zipfile.ZipInfo("bin/"), b"")
+        for name, content in sorted(files.items()):
+            info = zipfile.ZipInfo(name, (2001, 9, 9, 1, 46, 40))
+            info.external_attr = (0o100755 if name.startswith("bin/")
+                                  else 0o100644) << 16
+            zip.writestr(info, content)
+
+
+def check_extracted(extract_path):
+    for name, content in files.items():
+        with open(os.path.join(extract_path, name), "rb") as f:
+            assert f.read() == content
+    if os.name != "nt":
+        assert os.access(os.path.join(extract_path, "bin", "tool"), os.X_OK)
+
+
+def test_get_format():
+    assert archive.get_format_by_name("a.tar.xz").name == "tar.xz"
+    assert archive.get_format_by_name("a.xz").name == "tar.xz"
+    assert archive.get_format_by_name("a.TGZ").name == "tar.gz"
+    assert archive.get_format_by_name("a.tar.gz").name == "tar.gz"
+    assert archive.get_format_by_name("a.tar.zst").name == "tar.zst"
+    assert archive.get_format_by_name("a.zip").name == "zip"
+    assert archive.get_format_by_name("a.tar").name == "tar"
+    assert not archive.has_archive_name("a.txt")
+    assert not archive.has_archive_name("a.tar.xzy")
+    assert not archive.can_stream("a.zip")
+    assert archive.can_stream("a.tar.gz")
+
+
+@pytest.mark.parametrize("name,mode", [("a.tar", "w"), ("a.tar.gz", "w:gz"),
+                                       ("a.tar.xz", "w:xz"), ("a.zip", None)])
+def test_extract(folder, name, mode):
+    path = os.path.join(folder, name)
+    if mode:
+        write_tar(path, mode)
+    else:
+        write_zip(path)
+    extract_path = os.path.join(folder, "out")
+    assert sorted(action.extract_archive(path, extract_path)) == \
+        ["bin/", "bin/tool", "readme"]
+    check_extracted(extract_path)
+    records = action.read_manifest_records(action.get_manifest_path(path))
+    assert [record.sha1 for record in records] == [
+        None, hashlib.sha1(b"tool").hexdigest(),
+        hashlib.sha1(b"readme" * 100).hexdigest()]
+    os.remove(os.path.join(extract_path, "readme"))
+    assert action.extract_members(path, extract_path, ["readme"]) == 1
+    check_extracted(extract_path)
+    # Incremental extraction compares content of members with files.
+    assert sorted(action.extract_archive(path, extract_path, True, True)) == \
+        ["bin/", "bin/tool", "readme"]
+    action.delete_extracted_files(path, extract_path)
+    assert os.listdir(extract_path) == []
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Symbolic links need rights")
+def test_zip_symlink(folder):
+    path = os.path.join(folder, "a.zip")
+    with zipfile.ZipFile(path, "w") as zip:
+        zip.writestr("readme", b"readme")
+        info = zipfile.ZipInfo("link")
+        info.external_attr = 0o120777 << 16
+        zip.writestr(info, b"readme")
+    extract_path = os.path.join(folder, "out")
+    link_path = os.path.join(extract_path, "link")
+    # Extracting again replaces the link.
+    for _ in range(2):
+        assert sorted(action.extract_archive(path, extract_path)) == [
+            "link", "readme"]
+        assert os.readlink(link_path) == "readme"
+    os.remove(link_path)
+    with open(link_path, "w") as f:
+        f.write("modified")
+    assert action.extract_members(path, extract_path, ["link"]) == 1
+    assert os.readlink(link_path) == "readme"
+
+
+def test_detect_format(folder):
+    # The content wins over the name.
+    path = os.path.join(folder, "a.tar.xz")
+    write_tar(path, "w:gz")
+    assert archive.detect_format(path).name == "tar.gz"
+    extract_path = os.path.join(folder, "out")
+    assert action.extract_archive(path, extract_path)
+    check_extracted(extract_path)
+    with open(path, "wb") as f:
+        f.write(b"not an archive")
+    assert action.extract_archive(path, extract_path) is None
+
+
+def test_zstd(folder):
+    path = os.path.join(folder, "a.tar.zst")
+    if not archive.get_format_by_name(path).available:
+        with open(path, "wb") as f:
+            f.write(b"\x28\xb5\x2f\xfd")
+        with pytest.raises(archive.ArchiveError):
+            with archive.open_archive(path):
+                pass
+        assert not archive.can_stream(path)
+        return
+    tar_path = os.path.join(folder, "a.tar")
+    write_tar(tar_path, "w")
+    if archive.zstd:
+        with open(tar_path, "rb") as f:
+            with archive.zstd.open(path, "wb") as zst:
+                zst.write(f.read())
+    else:
+        with open(tar_path, "rb") as f, open(path, "wb") as zst:
+            archive.zstandard.ZstdCompressor().copy_stream(f, zst)
+    extract_path = os.path.join(folder, "out")
+    assert action.extract_archive(path, extract_path)
+    check_extracted(extract_path)
+    assert action.extract_archive(path, extract_path, True, True)
+
+
+@pytest.mark.parametrize("name,mode", [("a.tar.gz", "w:gz"), ("a.zip", None)])
+def test_pipeline(folder, server_address, name, mode):
+    path = os.path.join(folder, name)
+    if mode:
+        write_tar(path, mode)
+    else:
+        write_zip(path)
+    with open(path, "rb") as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    dep = {
+        "file_name": "pipeline_" + name,
+        "folder": os.path.join(folder, "out"),
+        "url": server_address + path,
+        "sha1": sha1
+    }
+    # Zip archives can't be read as a stream, they are downloaded first.
+    assert action.get_dep(dep, action.SyncOptions(pipeline=True))
+    check_extracted(dep["folder"])
+    download_path = action.get_download_path(dep["folder"], dep["file_name"])
+    assert not os.path.exists(download_path)
+    action.clean(dep)
+    assert os.listdir(dep["folder"]) == []
@@ -0,0 +1,82 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_cache.py                                                 ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import hashlib
+import os
+import time
+
+import eztools.ezdeps.cache as cache
+
+
+def write_file(path, content):
+    with open(path, "wb") as f:
+        f.write(content)
+    return hashlib.sha1(content).hexdigest()
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_parse_size():
+    assert cache.parse_size("512") == 512
+    assert cache.parse_size("2k") == 2048
+    assert cache.parse_size("1.5M") == 1536 * 1024
+    assert cache.parse_size("10GB") == 10 * 1024 ** 3
+
+
+def test_place_file(folder):
+    src = os.path.join(folder, "src")
+    dst = os.path.join(folder, "dir", "dst")
+    write_file(src, b"content")
+    write_file(os.path.join(folder, "old"), b"old")
+    assert cache.place_file(src, dst) in ["hardlink", "reflink", "copy"]
+    assert read_file(dst) == b"content"
+    # Existing files are replaced.
+    write_file(src + "2", b"new content")
+    cache.place_file(src + "2", dst)
+    assert read_file(dst) == b"new content"
+    assert sorted(os.listdir(os.path.join(folder, "dir"))) == ["dst"]
+
+
+def test_add_and_fetch(folder):
+    download_cache = cache.DownloadCache(os.path.join(folder, "cache"))
+    src = os.path.join(folder, "src")
+    sha1 = write_file(src, b"content")
+    dst = os.path.join(folder, "workspace", "dst")
+    assert not download_cache.fetch(sha1, dst)
+    download_cache.add(src, sha1)
+    os.remove(src)
+    assert download_cache.fetch(sha1.upper(), dst)
+    assert read_file(dst) == b"content"
+    download_cache.remove(sha1)
+    assert not download_cache.fetch(sha1, dst + "2")
+
+
+def test_evict_least_recently_used(folder):
+    download_cache = cache.DownloadCache(os.path.join(folder, "cache"),
+                                         max_size=8)
+    hashes = []
+    for i, content in enumerate([b"aaaa", b"bbbb", b"cccc"]):
+        if i == 2:
+            # "aaaa" is used again so "bbbb" becomes the least recently used.
+            used_path = download_cache.get_object_path(hashes[0]) + \
+                cache.last_used_suffix
+            os.utime(used_path, (time.time() - 50, time.time() - 50))
+        src = os.path.join(folder, str(i))
+        hashes.append(write_file(src, content))
+        download_cache.add(src, hashes[-1])
+        if i < 2:
+            # Make sure last used times are different.
+            used_path = download_cache.get_object_path(hashes[-1]) + \
+                cache.last_used_suffix
+            os.utime(used_path, (time.time() - 100 + i, time.time() - 100 + i))
+    assert os.path.isfile(download_cache.get_object_path(hashes[0]))
+    assert not os.path.isfile(download_cache.get_object_path(hashes[1]))
+    assert os.path.isfile(download_cache.get_object_path(hashes[2]))
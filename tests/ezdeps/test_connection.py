@@ -0,0 +1,75 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_connection.py                                            ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import concurrent.futures
+import os
+import pytest
+import urllib.error
+
+from eztools.ezdeps.connection import ConnectionPool, urlopen
+from tests.ezdeps.server import KeepAliveRequestHandler, serve
+
+
+@pytest.fixture(scope="module")
+def keep_alive_server():
+    yield from serve(KeepAliveRequestHandler)
+
+
+@pytest.fixture(scope="function")
+def served_file():
+    path = "served_file"
+    with open(path, "wb") as f:
+        f.write(b"content" * 1000)
+    yield path
+    os.remove(path)
+
+
+def test_reuse_connection(keep_alive_server, served_file):
+    pool = ConnectionPool()
+    for _ in range(3):
+        with urlopen(keep_alive_server + served_file, pool=pool) as res:
+            assert res.read() == b"content" * 1000
+    assert pool.created == 1
+    assert pool.reused == 2
+    # Errors don't break the connection.
+    with pytest.raises(urllib.error.HTTPError):
+        urlopen(keep_alive_server + "non_existent", pool=pool)
+    assert pool.created == 1
+    pool.close()
+
+
+def test_partially_read_response(keep_alive_server, served_file):
+    pool = ConnectionPool()
+    with urlopen(keep_alive_server + served_file, pool=pool) as res:
+        res.read(10)
+    with urlopen(keep_alive_server + served_file, pool=pool) as res:
+        assert res.read() == b"content" * 1000
+    assert pool.created == 2
+    assert pool.reused == 0
+    pool.close()
+
+
+def test_max_connections_per_host(keep_alive_server, served_file):
+    pool = ConnectionPool(max_connections_per_host=2)
+
+    def download(_):
+        with urlopen(keep_alive_server + served_file, pool=pool) as res:
+            return res.read()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(download, range(16)))
+    assert results == [b"content" * 1000] * 16
+    assert pool.created <= 2
+    assert pool.created + pool.reused == 16
+    pool.close()
+
+
+def test_invalid_url():
+    pool = ConnectionPool()
+    with pytest.raises(urllib.error.URLError):
+        urlopen("http:/abc", pool=pool)
@@ -53,8 +53,9 @@ def test_existing__config_file(_config):
 def test_value_from_commnand_line(_config):
     _config_dir, _config_path = _config
     target_arch_value = "abc"
-    createconfig.create__config(_config_dir,
-                                {"target_arch": target_arch_value}, False)
+    variables_value = createconfig.create__config(
+        _config_dir, {"target_arch": target_arch_value}, False)
+    assert variables_value["target_arch"] == target_arch_value
     config_module = import_from_path(createconfig.config_module_name,
                                      _config_path)
     assert config_module.target_arch == target_arch_value
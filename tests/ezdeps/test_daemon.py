@@ -0,0 +1,197 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_daemon.py                                                ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import hashlib
+import http.server
+import os
+import pytest
+import sys
+import threading
+import time
+
+from eztools.ezdeps.action import SyncOptions, tmp_folder_name
+from eztools.ezdeps.client import (DaemonNotRunningError, get_socket_path,
+                                   send_request)
+from eztools.ezdeps.create__config import config_filename
+from eztools.ezdeps.daemon import Daemon, DaemonRunningError
+from eztools.ezdeps.state import SyncState
+from eztools.ezdeps.watcher import InotifyWatcher, PollingWatcher
+from tests.ezdeps.server import serve
+
+
+@pytest.fixture(scope="module")
+def local_server():
+    yield from serve(http.server.SimpleHTTPRequestHandler)
+
+
+def replace_file(path, content):
+    """Write |path| the way editors do: to a new file renamed over it."""
+    with open(path + ".new", "w") as f:
+        f.write(content)
+    os.replace(path + ".new", path)
+
+
+def write_deps_file(folder, server_address, file_paths):
+    deps = []
+    for path in file_paths:
+        with open(path, "rb") as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        deps.append({
+            "file_name": os.path.basename(path),
+            "folder": "out",
+            "url": server_address + path,
+            "sha1": sha1
+        })
+    replace_file(os.path.join(folder, "DEPS.py"),
+                 "deps = {!r}\n".format(deps))
+
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+
+def test_polling_watcher(folder):
+    path = os.path.join(folder, "DEPS.py")
+    replace_file(path, "deps = []\n")
+    watcher = PollingWatcher([path], 0.01)
+    assert watcher.wait(0.05) == set()
+    replace_file(path, "deps = [] \n")
+    assert watcher.wait(1) == {path}
+    assert watcher.wait(0.05) == set()
+    os.remove(path)
+    assert watcher.wait(1) == {path}
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"),
+                    reason="inotify is only available on Linux")
+def test_inotify_watcher(folder):
+    path = os.path.join(folder, "DEPS.py")
+    other_path = os.path.join(folder, "other.py")
+    replace_file(path, "deps = []\n")
+    watcher = InotifyWatcher([path])
+    try:
+        assert watcher.wait(0.05) == set()
+        # Files that are not watched are ignored.
+        replace_file(other_path, "")
+        assert watcher.wait(0.05) == set()
+        replace_file(path, "deps = [] \n")
+        assert watcher.wait(1) == {path}
+        # Changes before set_paths are forgotten.
+        replace_file(path, "deps = []\n")
+        watcher.set_paths([path, other_path])
+        assert watcher.wait(0.05) == set()
+        with open(other_path, "w") as f:
+            f.write("x")
+        assert watcher.wait(1) == {other_path}
+    finally:
+        watcher.close()
+
+
+def test_daemon(folder, local_server):
+    file_paths = []
+    for name in ["a.txt", "b.txt"]:
+        path = os.path.join(folder, name)
+        with open(path, "w") as f:
+            f.write(name * 100)
+        file_paths.append(path)
+    write_deps_file(folder, local_server, file_paths[:1])
+    with pytest.raises(DaemonNotRunningError):
+        send_request("status")
+    options = SyncOptions(
+        state=SyncState(os.path.join(folder, "state.json")))
+    daemon = Daemon(folder, options, poll_interval=0.05)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        assert daemon.ready.wait(10)
+        out_folder = os.path.join(folder, "out")
+        assert os.path.isfile(os.path.join(out_folder, "a.txt"))
+        status = send_request("status")
+        assert status["ok"]
+        assert status["deps"] == 1
+        assert status["out_of_date"] == []
+        with pytest.raises(DaemonRunningError):
+            Daemon(folder, SyncOptions()).start_server()
+        # A second daemon stops before syncing anything.
+        other_daemon = Daemon(folder, SyncOptions())
+        with pytest.raises(DaemonRunningError):
+            other_daemon.run()
+        assert other_daemon.last_sync is None
+        assert other_daemon.watcher is None
+        # Editing DEPS.py syncs the new dep.
+        write_deps_file(folder, local_server, file_paths)
+        wait_until(lambda: daemon.last_sync["deps"] == 1 and os.path.isfile(
+            os.path.join(out_folder, "b.txt")))
+        os.remove(os.path.join(out_folder, "a.txt"))
+        assert send_request("status")["out_of_date"] == [
+            os.path.join(out_folder, "a.txt")]
+        response = send_request("sync")
+        assert response["ok"]
+        assert response["deps"] == 2
+        assert os.path.isfile(os.path.join(out_folder, "a.txt"))
+        # The previous deps are kept when DEPS.py can't be evaluated.
+        replace_file(os.path.join(folder, "DEPS.py"), "deps = [\n")
+        wait_until(lambda: send_request("status")["error"] is not None)
+        assert send_request("status")["deps"] == 2
+        assert not send_request("unknown")["ok"]
+    finally:
+        send_request("stop")
+        thread.join()
+    assert not os.path.exists(get_socket_path())
+    with pytest.raises(DaemonNotRunningError):
+        send_request("status")
+
+
+def test_daemon_config_change(folder, local_server):
+    for platform in ["linux", "win"]:
+        with open(os.path.join(folder, "f-" + platform), "w") as f:
+            f.write(platform)
+    replace_file(os.path.join(folder, "DEPS.py"), """
+import _config
+deps = [{{
+    "file_name": "f-" + _config.target_platform,
+    "folder": "out",
+    "url": "{}{}/f-" + _config.target_platform,
+    "sha1": ""
+}}]
+""".format(local_server, folder))
+    config_values = {"target_platform": "linux", "target_arch": "",
+                     "host_platform": "", "host_arch": ""}
+    daemon = Daemon(folder, SyncOptions(
+        state=SyncState(os.path.join(folder, "state.json"))),
+        config_values, poll_interval=0.05)
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    try:
+        assert daemon.ready.wait(10)
+
+        def get_file_names():
+            return [dep["file_name"] for dep in daemon.deps]
+
+        assert get_file_names() == ["f-linux"]
+        # Values from the command line change.
+        config_values["target_platform"] = "win"
+        send_request("reload")
+        assert get_file_names() == ["f-win"]
+        # The main loop watches the new paths, not the request's thread.
+        wait_until(lambda: not daemon.paths_changed.is_set())
+        # _config.py is edited.
+        config_values["target_platform"] = ""
+        with open(config_filename) as f:
+            content = f.read().replace('"win"', '"linux"')
+        replace_file(config_filename, content)
+        wait_until(lambda: get_file_names() == ["f-linux"])
+        with open(os.path.join(tmp_folder_name, "deps_graph.json")) as f:
+            assert "f-linux" in f.read()
+    finally:
+        send_request("stop")
+        thread.join()
+        os.remove(config_filename)
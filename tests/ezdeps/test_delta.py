@@ -0,0 +1,116 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_delta.py                                                 ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import http.server
+import os
+import pytest
+import random
+
+import eztools.ezdeps.action as action
+import eztools.ezdeps.delta as delta
+
+from eztools.ezdeps.scheduler import BandwidthLimiter
+from tests.ezdeps.server import RangeRequestHandler, serve
+
+
+@pytest.fixture(scope="module")
+def range_server():
+    yield from serve(RangeRequestHandler)
+
+
+@pytest.fixture(scope="module")
+def plain_server():
+    yield from serve(http.server.SimpleHTTPRequestHandler)
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, "little")
+
+
+def get_versions():
+    """Returns two versions of a file that share most of their content."""
+    old = random_bytes(2 * 1024 * 1024, 1)
+    new = old[:300000] + b"inserted" + old[300000:1500000] + \
+        random_bytes(100000, 2)
+    return old, new
+
+
+def test_get_chunks():
+    old, new = get_versions()
+    old_chunks = set(old[offset:offset + size]
+                     for offset, size in delta.get_chunks(old))
+    new_chunks = delta.get_chunks(new)
+    assert sum(size for _, size in new_chunks) == len(new)
+    for _, size in new_chunks[:-1]:
+        assert delta.min_chunk_size <= size <= delta.max_chunk_size
+    reused_size = sum(size for offset, size in new_chunks
+                      if new[offset:offset + size] in old_chunks)
+    assert reused_size > len(new) * 0.7
+
+
+def test_download_delta(folder, range_server):
+    old, new = get_versions()
+    served_path = os.path.join(folder, "served")
+    with open(served_path, "wb") as f:
+        f.write(new)
+    delta.write_chunk_index(served_path)
+    dep = {
+        "file_name": "file",
+        "folder": folder,
+        "url": range_server + served_path,
+        "sha1": action.calculate_sha1(served_path)
+    }
+    # The previous version of the dep is on disk.
+    download_path = os.path.join(folder, "file")
+    with open(download_path, "wb") as f:
+        f.write(old)
+    limiter = BandwidthLimiter()
+    options = action.SyncOptions(delta=True, limiter=limiter)
+    assert action.get_dep(dep, options)
+    with open(download_path, "rb") as f:
+        assert f.read() == new
+    assert limiter.total < len(new) * 0.3
+    assert not os.path.exists(download_path + action.old_suffix)
+
+
+def test_download_delta_without_index(folder, range_server):
+    old, new = get_versions()
+    served_path = os.path.join(folder, "served")
+    with open(served_path, "wb") as f:
+        f.write(new)
+    old_path = os.path.join(folder, "old")
+    with open(old_path, "wb") as f:
+        f.write(old)
+    save_path = os.path.join(folder, "file")
+    sha1 = action.calculate_sha1(served_path)
+    url = range_server + served_path
+    assert not delta.download_delta(url, save_path, sha1, old_path)
+    assert not os.path.exists(save_path)
+    # The index doesn't describe the file anymore.
+    with open(served_path + delta.chunks_suffix, "w") as f:
+        f.write('{"version": 1, "pattern": "e75a", "min_size": 16384,'
+                ' "max_size": 262144, "size": 5, "chunks": [[0, 5, "a"]]}')
+    assert not delta.download_delta(url, save_path, sha1, old_path)
+    assert not os.path.exists(save_path)
+
+
+def test_download_delta_without_ranges(folder, plain_server):
+    old, new = get_versions()
+    served_path = os.path.join(folder, "served")
+    with open(served_path, "wb") as f:
+        f.write(new)
+    delta.write_chunk_index(served_path)
+    old_path = os.path.join(folder, "old")
+    with open(old_path, "wb") as f:
+        f.write(old)
+    save_path = os.path.join(folder, "file")
+    sha1 = action.calculate_sha1(served_path)
+    assert not delta.download_delta(plain_server + served_path, save_path,
+                                    sha1, old_path)
+    assert not os.path.exists(save_path)
+    assert not os.path.exists(save_path + delta.delta_part_suffix)
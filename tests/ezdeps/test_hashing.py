@@ -0,0 +1,66 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_hashing.py                                               ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import hashlib
+import os
+import pytest
+
+import eztools.ezdeps.hashing as hashing
+
+
+@pytest.fixture(scope="function")
+def files(folder):
+    paths = []
+    for i in range(8):
+        path = os.path.join(folder, str(i))
+        with open(path, "wb") as f:
+            # Bigger than the buffer to hash more than one chunk.
+            f.write(os.urandom(hashing.hash_buffer_size + i * 1000))
+        paths.append(path)
+    return paths
+
+
+def expected_digest(path, algorithm):
+    with open(path, "rb") as f:
+        return hashlib.new(algorithm, f.read()).hexdigest()
+
+
+def test_hash_file(files):
+    for algorithm in hashing.supported_algorithms:
+        assert hashing.hash_file(files[0], algorithm) == \
+            expected_digest(files[0], algorithm)
+        assert hashing.verify_file(
+            files[0], expected_digest(files[0], algorithm).upper(), algorithm)
+    assert hashing.hash_file("non_existent_file") == ""
+    with pytest.raises(ValueError):
+        hashing.hash_file(files[0], "md5")
+
+
+def test_update_hash_from_file(files):
+    hash = hashlib.sha256()
+    assert hashing.update_hash_from_file(hash, files[1]) == \
+        os.path.getsize(files[1])
+    assert hash.hexdigest() == expected_digest(files[1], "sha256")
+
+
+def test_hash_files(files):
+    algorithms = hashing.supported_algorithms
+    requests = [(path, algorithms[i % len(algorithms)])
+                for i, path in enumerate(files)]
+    expected = [expected_digest(path, algorithm)
+                for path, algorithm in requests]
+    assert hashing.hash_files(requests, jobs=4) == expected
+    assert hashing.hash_files(requests, jobs=1) == expected
+
+
+def test_get_dep_checksum():
+    assert hashing.get_dep_checksum({"sha1": "ABC"}) == ("abc", "sha1")
+    assert hashing.get_dep_checksum({"sha1": "a", "sha256": "b"}) == \
+        ("b", "sha256")
+    with pytest.raises(KeyError):
+        hashing.get_dep_checksum({"file_name": "file", "md5": "a"})
@@ -0,0 +1,117 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_loader.py                                                ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import os
+import pytest
+
+from eztools.ezdeps.loader import (DepsCycleError, DepsLoader,
+                                   load_deps_cached)
+
+
+def write_deps_file(folder, links=[], deps=[], counter=None):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "DEPS.py"), "w") as f:
+        if counter:
+            # Every evaluation of this DEPS.py appends a line to |counter|.
+            f.write("open({!r}, 'a').write('x\\n')\n".format(
+                os.path.abspath(counter)))
+        f.write("links = {!r}\n".format(links))
+        f.write("deps = {!r}\n".format(deps))
+
+
+def make_dep(file_name, sha1="abc"):
+    return {
+        "file_name": file_name,
+        "folder": "../shared",
+        "url": "http://127.0.0.1/" + file_name,
+        "sha1": sha1
+    }
+
+
+def test_load_diamond(folder):
+    counter = os.path.join(folder, "counter")
+    write_deps_file(folder, links=["a", "b"])
+    write_deps_file(os.path.join(folder, "a"), links=["../c"])
+    write_deps_file(os.path.join(folder, "b"), links=["../c"])
+    write_deps_file(os.path.join(folder, "c"), deps=[make_dep("c.txt")],
+                    counter=counter)
+    loader = DepsLoader()
+    deps = loader.load(folder)
+    assert len(deps) == 1
+    assert deps[0]["folder"] == os.path.join(folder, "a", "../c",
+                                             "../shared")
+    with open(counter) as f:
+        assert f.read() == "x\n"
+    assert len(loader.deps_files) == 4
+    assert loader.deps_files[-1] == os.path.join(folder, "DEPS.py")
+
+
+def test_load_cycle(folder):
+    write_deps_file(folder, links=["a"])
+    write_deps_file(os.path.join(folder, "a"), links=["../b"])
+    write_deps_file(os.path.join(folder, "b"), links=["../a"])
+    with pytest.raises(DepsCycleError) as e:
+        DepsLoader().load(folder)
+    message = str(e.value)
+    assert message.count(" -> ") == 2
+    assert os.path.join("a", "DEPS.py") in message
+
+
+def test_load_duplicated_deps(folder):
+    write_deps_file(folder, links=["a", "b"])
+    write_deps_file(os.path.join(folder, "a"),
+                    deps=[make_dep("same.txt"), make_dep("other.txt")])
+    write_deps_file(os.path.join(folder, "b"),
+                    deps=[make_dep("same.txt"),
+                          make_dep("other.txt", sha1="def")])
+    deps = DepsLoader().load(folder)
+    assert [(dep["file_name"], dep["sha1"]) for dep in deps] == [
+        ("same.txt", "abc"), ("other.txt", "abc"), ("other.txt", "def")]
+
+
+def test_load_deps_cached(folder):
+    counter = os.path.join(folder, "counter")
+    cache_path = os.path.join(folder, "deps_graph.json")
+    write_deps_file(folder, links=["a"])
+    write_deps_file(os.path.join(folder, "a"), deps=[make_dep("a.txt")],
+                    counter=counter)
+    config = {"target_arch": "x64", "is_linux": True}
+
+    def evaluations():
+        with open(counter) as f:
+            return f.read().count("x")
+
+    deps_files = []
+    deps = load_deps_cached(folder, config, cache_path,
+                            deps_files=deps_files)
+    assert evaluations() == 1
+    cached_deps_files = []
+    assert load_deps_cached(folder, config, cache_path,
+                            deps_files=cached_deps_files) == deps
+    assert cached_deps_files == deps_files == [
+        os.path.join(folder, "a", "DEPS.py"),
+        os.path.join(folder, "DEPS.py")]
+    assert evaluations() == 1
+    # Touching a DEPS.py without changing it keeps the saved deps.
+    deps_path = os.path.join(folder, "a", "DEPS.py")
+    st = os.stat(deps_path)
+    os.utime(deps_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert load_deps_cached(folder, config, cache_path) == deps
+    assert evaluations() == 1
+    # Config values are part of the fingerprint.
+    config["target_arch"] = "x86"
+    load_deps_cached(folder, config, cache_path)
+    assert evaluations() == 2
+    load_deps_cached(folder, config, cache_path, reload=True)
+    assert evaluations() == 3
+    # So is content of every DEPS.py.
+    write_deps_file(os.path.join(folder, "a"),
+                    deps=[make_dep("a.txt", sha1="def")], counter=counter)
+    deps = load_deps_cached(folder, config, cache_path)
+    assert evaluations() == 4
+    assert deps[0]["sha1"] == "def"
@@ -0,0 +1,85 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_lock.py                                                  ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import concurrent.futures
+import io
+import json
+import multiprocessing
+import os
+import tarfile
+
+import eztools.ezdeps.action as action
+
+from eztools.ezdeps.lock import FileLock
+from tests.ezdeps.server import CountingRequestHandler, serve
+
+process_count = 8
+archive_count = 6
+
+
+def test_file_lock(folder):
+    path = os.path.join(folder, "a.lock")
+    with FileLock(path) as lock:
+        other = FileLock(path)
+        assert not other.acquire(blocking=False)
+        lock.write("done")
+    assert other.acquire(blocking=False)
+    assert other.read() == "done"
+    other.release()
+
+
+def sync_in_process(folder):
+    """Run in another process by |test_concurrent_syncs|."""
+    options = action.SyncOptions(
+        jobs=3, state=action.SyncState(os.path.join(folder, "state.json")))
+    return action.run_action("sync", folder, options)
+
+
+def test_concurrent_syncs(folder):
+    """Many processes sync the same workspace at the same time, every file
+    is downloaded once and the others reuse it."""
+    served_folder = os.path.join(folder, "served")
+    os.makedirs(served_folder)
+    files = {}
+    for i in range(archive_count):
+        name = "archive{}.tar.xz".format(i)
+        with tarfile.open(os.path.join(served_folder, name), "w:xz") as tar:
+            content = os.urandom(64 * 1024)
+            info = tarfile.TarInfo("out{}/file".format(i))
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        files[name] = action.calculate_sha1(os.path.join(served_folder,
+                                                         name))
+    CountingRequestHandler.requested_paths.clear()
+    for address in serve(CountingRequestHandler):
+        deps = [{
+            "file_name": name,
+            "folder": "extracted",
+            "url": address + served_folder + "/" + name,
+            "sha1": sha1
+        } for name, sha1 in sorted(files.items())]
+        with open(os.path.join(folder, "DEPS.py"), "w") as f:
+            f.write("deps = {!r}\n".format(deps))
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(
+                process_count, mp_context=context) as executor:
+            results = list(executor.map(sync_in_process,
+                                        [folder] * process_count))
+    assert all(results)
+    assert sorted(CountingRequestHandler.requested_paths.values()) == \
+        [1] * archive_count
+    for i in range(archive_count):
+        assert os.path.isfile(os.path.join(folder, "extracted",
+                                           "out{}".format(i), "file"))
+    # Every process saved its records without dropping the others'.
+    with open(os.path.join(folder, "state.json")) as f:
+        assert len(json.load(f)["deps"]) == archive_count
+    for name in files:
+        download_path = action.get_download_path(folder, name)
+        action.remove_file(download_path)
+        action.remove_file(action.get_manifest_path(download_path))
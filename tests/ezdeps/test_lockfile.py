@@ -0,0 +1,55 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_lockfile.py                                              ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import os
+import pytest
+
+from eztools.ezdeps.lockfile import (LockFileError, read_lock_file,
+                                     write_lock_file)
+
+
+def test_write_and_read(folder):
+    deps = [{
+        "file_name": "b.tar.xz",
+        "folder": os.path.join(folder, "out", "b"),
+        "url": "http://127.0.0.1/b.tar.xz",
+        "sha256": "abc",
+        "size": 10,
+        "deps_file": os.path.join(folder, "DEPS.py")
+    }, {
+        "file_name": "a",
+        "folder": ".",
+        "url": "http://127.0.0.1/a",
+        "sha1": "def"
+    }]
+    path = os.path.join(folder, "DEPS.lock.json")
+    write_lock_file(path, deps, {"target_arch": "x64"})
+    with open(path, "rb") as f:
+        content = f.read()
+    # The same deps always give the same file.
+    write_lock_file(path, deps, {"target_arch": "x64"})
+    with open(path, "rb") as f:
+        assert f.read() == content
+    assert b"deps_file" not in content
+    assert b'"folder": "out/b"' in content
+    locked_deps = read_lock_file(path)
+    assert [dep["file_name"] for dep in locked_deps] == ["b.tar.xz", "a"]
+    assert os.path.abspath(locked_deps[0]["folder"]) == \
+        os.path.abspath(deps[0]["folder"])
+    assert os.path.abspath(locked_deps[1]["folder"]) == os.path.abspath(".")
+    assert locked_deps[0]["size"] == 10
+
+
+def test_read_invalid(folder):
+    path = os.path.join(folder, "DEPS.lock.json")
+    with pytest.raises(LockFileError):
+        read_lock_file(path)
+    with open(path, "w") as f:
+        f.write('{"version": 1000}')
+    with pytest.raises(LockFileError):
+        read_lock_file(path)
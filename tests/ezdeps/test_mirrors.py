@@ -0,0 +1,96 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_mirrors.py                                               ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import http.server
+import json
+import os
+import pathlib
+import pytest
+
+import eztools.ezdeps.action as action
+
+from eztools.ezdeps.mirrors import (MirrorSelector, get_origin,
+                                    read_mirrors_config)
+from tests.ezdeps.server import serve
+
+
+@pytest.fixture(scope="module")
+def mirror_server():
+    yield from serve(http.server.SimpleHTTPRequestHandler)
+
+
+def test_get_urls(folder):
+    config_path = os.path.join(folder, "mirrors.json")
+    with open(config_path, "w") as f:
+        json.dump({"rewrites": [
+            {"from": "https://github.com/", "to": "file:///mnt/github/"},
+            {"from": "https://b.com/", "to": ["https://c.com/"]}]}, f)
+    selector = MirrorSelector(read_mirrors_config(config_path))
+    dep = {"url": "https://github.com/a/b.tar.xz",
+           "mirrors": ["https://b.com/b.tar.xz"]}
+    assert selector.get_urls(dep) == ["file:///mnt/github/a/b.tar.xz",
+                                      "https://c.com/b.tar.xz",
+                                      "https://b.com/b.tar.xz",
+                                      "https://github.com/a/b.tar.xz"]
+    assert get_origin("file:///mnt/github/a") == "file"
+    assert get_origin(dep["url"]) == "https://github.com"
+
+
+def test_rank(folder):
+    stats_path = os.path.join(folder, "stats.json")
+    selector = MirrorSelector([], stats_path)
+    slow = "http://slow.com/a"
+    fast = "http://fast.com/a"
+    broken = "http://broken.com/a"
+    for url in [slow, fast, broken]:
+        selector.record_latency(url, 0.01)
+    selector.record(slow, 10, 1024 * 1024)
+    selector.record(fast, 1, 100 * 1024 * 1024)
+    selector.record_failure(broken)
+    assert selector.rank([broken, slow, fast]) == [fast, slow, broken]
+    # A local mirror that doesn't have the file goes last.
+    missing = pathlib.Path(os.path.abspath("missing")).as_uri()
+    assert selector.rank([missing, slow])[-1] == missing
+    selector.save()
+    assert MirrorSelector([], stats_path).load().stats == selector.stats
+
+
+def test_failover(folder, mirror_server):
+    file_path = os.path.join(folder, "file")
+    with open(file_path, "wb") as f:
+        f.write(b"content")
+    dep = {
+        "file_name": "downloaded",
+        "folder": folder,
+        "url": mirror_server + "does_not_exist",
+        "mirrors": [mirror_server + file_path],
+        "sha1": action.calculate_sha1(file_path)
+    }
+    options = action.SyncOptions(mirrors=MirrorSelector())
+    assert action.get_dep(dep, options)
+    assert action.verify_sha1(os.path.join(folder, "downloaded"),
+                              dep["sha1"])
+
+
+def test_rewrite_to_local_mirror(folder, mirror_server):
+    local_folder = os.path.join(folder, "local")
+    os.makedirs(local_folder)
+    with open(os.path.join(local_folder, "file"), "wb") as f:
+        f.write(b"local content")
+    dep = {
+        "file_name": "downloaded",
+        "folder": folder,
+        # Only the local mirror has this file.
+        "url": "http://unreachable.invalid/file",
+        "sha1": action.calculate_sha1(os.path.join(local_folder, "file"))
+    }
+    rules = [("http://unreachable.invalid/",
+              [pathlib.Path(os.path.abspath(local_folder)).as_uri() + "/"])]
+    selector = MirrorSelector(rules)
+    assert action.get_dep(dep, action.SyncOptions(mirrors=selector))
+    assert selector.stats["file"]["throughput"] > 0
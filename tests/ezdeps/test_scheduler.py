@@ -0,0 +1,72 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_scheduler.py                                             ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import collections
+import threading
+import time
+
+import pytest
+
+from eztools.ezdeps.scheduler import BandwidthLimiter, Scheduler
+
+
+def test_largest_first():
+    started = []
+    tasks = [("a", size, lambda size=size: started.append(size) or size)
+             for size in [1, None, 30, 20]]
+    scheduler = Scheduler(1, 1)
+    assert scheduler.run(tasks) == [1, None, 30, 20]
+    assert started == [30, 20, 1, None]
+    assert scheduler.stats["tasks"] == 4
+
+
+def test_max_per_host():
+    lock = threading.Lock()
+    running = collections.Counter()
+    max_running = collections.Counter()
+
+    def task(host):
+        with lock:
+            running[host] += 1
+            max_running[host] = max(max_running[host], running[host])
+        time.sleep(0.02)
+        with lock:
+            running[host] -= 1
+        return host
+
+    tasks = [(host, 1, lambda host=host: task(host))
+             for host in ["a"] * 6 + ["b"] * 2]
+    scheduler = Scheduler(4, 2)
+    assert scheduler.run(tasks) == ["a"] * 6 + ["b"] * 2
+    assert max_running["a"] == 2
+    assert max_running["b"] <= 2
+    assert scheduler.stats["host_waits"] > 0
+
+
+def test_task_failure():
+    def fail():
+        raise RuntimeError("failed")
+
+    ran = []
+    tasks = [("a", 2, fail), ("a", 1, lambda: ran.append(True))]
+    with pytest.raises(RuntimeError):
+        Scheduler(2, 1).run(tasks)
+    assert ran == [True]
+
+
+def test_bandwidth_limiter():
+    limiter = BandwidthLimiter(1000000)
+    start = time.perf_counter()
+    # The first second worth of data is allowed as a burst.
+    for _ in range(15):
+        limiter.consume(100000)
+    assert time.perf_counter() - start >= 0.4
+    assert limiter.total == 1500000
+    unlimited = BandwidthLimiter()
+    unlimited.consume(10 ** 12)
+    assert unlimited.total == 10 ** 12
@@ -0,0 +1,42 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_stamp.py                                                 ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import os
+
+from eztools.ezdeps.stamp import (get_depfile_content, remove_stamp,
+                                  write_stamp)
+
+
+def test_depfile_content():
+    assert get_depfile_content("out/deps.stamp", [
+        "DEPS.py", "my dir/a$b#c"]) == \
+        "out/deps.stamp: \\\n  DEPS.py \\\n  my\\ dir/a$$b\\#c\n"
+
+
+def test_write_stamp(folder):
+    stamp_path = os.path.join(folder, "gen", "deps.stamp")
+    assert write_stamp(stamp_path, "a\n", ["DEPS.py"])
+    with open(stamp_path + ".d") as f:
+        assert f.read() == get_depfile_content(stamp_path, ["DEPS.py"])
+    os.utime(stamp_path, (1, 1))
+    os.utime(stamp_path + ".d", (1, 1))
+    # Nothing changed, so neither file is written.
+    assert not write_stamp(stamp_path, "a\n", ["DEPS.py"])
+    assert os.path.getmtime(stamp_path) == 1
+    assert os.path.getmtime(stamp_path + ".d") == 1
+    assert write_stamp(stamp_path, "a\n", ["DEPS.py"], touch=True)
+    assert os.path.getmtime(stamp_path) > 1
+    depfile_path = os.path.join(folder, "deps.d")
+    assert write_stamp(stamp_path, "b\n", ["_config.py"], depfile_path)
+    with open(stamp_path) as f:
+        assert f.read() == "b\n"
+    with open(depfile_path) as f:
+        assert "_config.py" in f.read()
+    remove_stamp(stamp_path)
+    assert not os.path.exists(stamp_path)
+    remove_stamp(stamp_path)
@@ -0,0 +1,69 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_state.py                                                 ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import os
+import pytest
+
+from eztools.ezdeps.state import SyncState
+
+
+@pytest.fixture(scope="function")
+def synced_dep(folder):
+    download_path = os.path.join(folder, "archive.tar.xz")
+    with open(download_path, "w") as f:
+        f.write("archive")
+    extracted_path = os.path.join(folder, "extracted")
+    with open(extracted_path, "w") as f:
+        f.write("extracted")
+    dep = {
+        "file_name": "archive.tar.xz",
+        "folder": folder,
+        "url": "http://127.0.0.1/archive.tar.xz",
+        "sha1": "ABC"
+    }
+    return dep, download_path, extracted_path
+
+
+def test_up_to_date(folder, synced_dep):
+    dep, download_path, extracted_path = synced_dep
+    state = SyncState(os.path.join(folder, "state.json"))
+    assert not state.is_up_to_date(dep, download_path)
+    state.update(dep, download_path, ["extracted"])
+    assert state.is_up_to_date(dep, download_path)
+    assert not state.is_up_to_date(dict(dep, sha1="def"), download_path)
+    assert not state.is_up_to_date(dict(dep, url="http://a"), download_path)
+    # The downloaded file is modified.
+    with open(download_path, "a") as f:
+        f.write("modified")
+    assert not state.is_up_to_date(dep, download_path)
+    state.update(dep, download_path, ["extracted"])
+    # An extracted file is deleted.
+    os.remove(extracted_path)
+    assert not state.is_up_to_date(dep, download_path)
+    state.remove(dep)
+    assert not state.records
+
+
+def test_without_downloaded_file(folder, synced_dep):
+    dep, download_path, extracted_path = synced_dep
+    os.remove(download_path)
+    state = SyncState(os.path.join(folder, "state.json"))
+    state.update(dep, download_path, ["extracted"])
+    assert state.is_up_to_date(dep, download_path)
+
+
+def test_save_and_load(folder, synced_dep):
+    dep, download_path, extracted_path = synced_dep
+    state_path = os.path.join(folder, "state.json")
+    state = SyncState(state_path)
+    state.update(dep, download_path, ["extracted"])
+    state.save()
+    assert SyncState(state_path).load().is_up_to_date(dep, download_path)
+    with open(state_path, "w") as f:
+        f.write("not json")
+    assert SyncState(state_path).load().records == {}
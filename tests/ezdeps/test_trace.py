@@ -0,0 +1,73 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_trace.py                                                 ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import json
+import os
+import threading
+
+import eztools.ezdeps.trace as trace
+
+
+@trace.traced("work")
+def work(size):
+    trace.add_args(bytes=size)
+    return size
+
+
+def test_span():
+    tracer = trace.start_tracing()
+    try:
+        with trace.span("outer", dep="a"):
+            assert work(3) == 3
+            trace.add_args(count=1)
+        thread = threading.Thread(target=work, args=(5,))
+        thread.start()
+        thread.join()
+    finally:
+        trace.stop_tracing()
+    spans = [event for event in tracer.events if event["ph"] == "X"]
+    assert [(event["name"], event["args"]) for event in spans] == [
+        ("work", {"bytes": 3}),
+        ("outer", {"dep": "a", "count": 1}),
+        ("work", {"bytes": 5})]
+    assert spans[0]["tid"] == spans[1]["tid"] != spans[2]["tid"]
+    names = [event for event in tracer.events if event["ph"] == "M"]
+    assert len(names) == 2
+    # Nothing is recorded once tracing is stopped.
+    with trace.span("ignored"):
+        work(1)
+    assert len(tracer.events) == 5
+
+
+def test_save():
+    trace.start_tracing()
+    with trace.span("saved"):
+        pass
+    path = "trace.json"
+    trace.stop_tracing(path)
+    with open(path, "r") as f:
+        content = json.load(f)
+    os.remove(path)
+    assert content["traceEvents"][-1]["name"] == "saved"
+    assert content["traceEvents"][-1]["dur"] >= 0
+
+
+def test_record_spans():
+    with trace.record_spans() as spans:
+        with trace.span("outer"):
+            work(2)
+        # Spans of other threads are not recorded.
+        thread = threading.Thread(target=work, args=(5,))
+        thread.start()
+        thread.join()
+    assert [(name, args) for name, _, args in spans] == [
+        ("work", {"bytes": 2}), ("outer", {})]
+    assert all(seconds >= 0 for _, seconds, _ in spans)
+    with trace.span("ignored"):
+        work(1)
+    assert len(spans) == 2
@@ -0,0 +1,97 @@
+##----------------------------------------------------------------------------##
+## tests/ezdeps/test_xz.py                                                    ##
+##                                                                            ##
+## This file is distributed under the MIT License.                            ##
+## See LICENSE.txt for details.                                               ##
+## Copyright (C) Tran Tuan Nghia <trantuannghia95@gmail.com> 2018             ##
+##----------------------------------------------------------------------------##
+
+import io
+import lzma
+import os
+import pytest
+import tarfile
+
+import eztools.ezdeps.action as action
+import eztools.ezdeps.xz as xz
+
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+def test_compress_file(folder):
+    data = os.urandom(50000) * 3 + b"abc" * 30000
+    path = write_file(os.path.join(folder, "data"), data)
+    xz_path = path + ".xz"
+    xz.compress_file(path, xz_path, block_size=20000, jobs=3)
+    with open(xz_path, "rb") as f:
+        assert lzma.decompress(f.read()) == data
+        _, blocks = xz.read_blocks(f)
+    assert len(blocks) == (len(data) + 19999) // 20000
+    assert sum(block.uncompressed_size for block in blocks) == len(data)
+    for jobs in [1, 2, 8]:
+        with xz.open_xz(xz_path, jobs) as f:
+            assert isinstance(f, xz.ParallelXzReader) == (jobs > 1)
+            content = b""
+            for chunk in iter(lambda: f.read(7000), b""):
+                content += chunk
+            assert content == data
+    # Empty files have no blocks.
+    path = write_file(os.path.join(folder, "empty"), b"")
+    xz.compress_file(path, path + ".xz")
+    with open(path + ".xz", "rb") as f:
+        assert lzma.decompress(f.read()) == b""
+        assert xz.read_blocks(f)[1] == []
+
+
+def test_single_block(folder):
+    path = os.path.join(folder, "data.xz")
+    write_file(path, lzma.compress(b"data" * 1000))
+    with xz.open_xz(path, 4) as f:
+        assert not isinstance(f, xz.ParallelXzReader)
+        assert f.read() == b"data" * 1000
+    # Concatenated streams.
+    write_file(path, lzma.compress(b"a") + lzma.compress(b"b"))
+    with open(path, "rb") as f:
+        with pytest.raises(xz.XzIndexError):
+            xz.read_blocks(f)
+    with xz.open_xz(path, 4) as f:
+        assert f.read() == b"ab"
+
+
+def test_corrupted_block(folder):
+    data = os.urandom(100000)
+    path = write_file(os.path.join(folder, "data"), data)
+    xz.compress_file(path, path + ".xz", block_size=10000, preset=0)
+    with open(path + ".xz", "r+b") as f:
+        f.seek(xz.stream_header_size + 30000)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xff]))
+    with pytest.raises(lzma.LZMAError):
+        with xz.open_xz(path + ".xz", 4) as f:
+            f.read()
+
+
+def test_parallel_extract(folder):
+    tar_path = os.path.join(folder, "archive.tar")
+    files = {"a": os.urandom(30000), "sub/b": os.urandom(50000), "c": b""}
+    with tarfile.open(tar_path, "w") as tar:
+        for name, content in sorted(files.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = 1000000000
+            tar.addfile(info, io.BytesIO(content))
+    xz_path = tar_path + ".xz"
+    xz.compress_file(tar_path, xz_path, block_size=16384)
+    extract_path = os.path.join(folder, "out")
+    for incremental in [False, True]:
+        assert sorted(action.extract_archive(xz_path, extract_path,
+                                             incremental, jobs=4)) == \
+            sorted(files)
+        for name, content in files.items():
+            with open(os.path.join(extract_path, name), "rb") as f:
+                assert f.read() == content